@@ -0,0 +1,68 @@
+#
+# Copyright (c) 2019 Jonathan Weyn <jweyn@uw.edu>
+#
+# See the file LICENSE for your rights.
+#
+
+"""
+Regression tests and benchmark for the BUFKIT surface parser, on small recorded files from an hourly GFS run (1-hour
+precipitation, P01M) and a 3-hourly FV3 run (3-hour precipitation, P03M). The expected timeseries were produced by the
+original line-by-line regex parser, with missing values (-9999) as NaN.
+"""
+
+import os
+import time
+from datetime import datetime
+import numpy as np
+import pandas as pd
+import pytest
+from thetae.data_parsers import bufkit
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'bufkit')
+
+config = {'debug': 0}
+forecast_date = datetime(2018, 9, 14)
+
+cases = [
+    # file name, model, expected daily values
+    ('2018091300.gfs_ksea', 'GFS', (80.0, 2.0, 57.0, 6.174806484)),
+    ('2018091300.fv3gfsx_ksea', 'FV3', (86.0, 10.0, 59.0, 0.922047742)),
+]
+
+
+@pytest.mark.parametrize('file_name,model,daily', cases)
+def test_surface_parser(file_name, model, daily):
+    forecast = bufkit.bufr_surface_parser(config, model, 'KSEA', forecast_date,
+                                          os.path.join(DATA_DIR, file_name + '.buf'))
+    expected = pd.read_csv(os.path.join(DATA_DIR, file_name + '.csv'), index_col=0, parse_dates=True)
+    data = forecast.timeseries.data
+
+    assert list(data.index) == list(expected.index)
+    assert list(data['dateTime']) == list(expected.index)
+    for column in expected.columns:
+        assert data[column].dtype == np.float64
+        np.testing.assert_allclose(data[column].values, expected[column].values, rtol=0, atol=1e-5,
+                                   err_msg=column)
+    np.testing.assert_allclose(forecast.daily.get_values(), daily, rtol=1e-9)
+
+
+def test_missing_values():
+    times, columns, values = bufkit.parse_arrays(os.path.join(DATA_DIR, '2018091300.gfs_ksea.buf'))
+    assert len(times) == values.shape[0] == 73
+    assert len(columns) == values.shape[1] == 31
+    assert np.isnan(values[0, columns['P01M']])
+    assert np.isnan(values[7, columns['TD2M']])
+    assert np.count_nonzero(np.isnan(values)) == 2
+
+
+def test_parser_benchmark():
+    repeats = 20
+    for file_name, model, daily in cases:
+        path = os.path.join(DATA_DIR, file_name + '.buf')
+        start = time.time()
+        for _ in range(repeats):
+            bufkit.bufr_surface_parser(config, model, 'KSEA', forecast_date, path)
+        elapsed = (time.time() - start) / repeats
+        print('bufkit: %s parsed in %.2f ms' % (file_name, elapsed * 1000.))
+        # The original regex parser took about 9 ms (GFS) and 3 ms (FV3) for these files; this is a generous bound
+        assert elapsed < 0.1
@@ -0,0 +1,50 @@
+#
+# Copyright (c) 2019 Jonathan Weyn <jweyn@uw.edu>
+#
+# See the file LICENSE for your rights.
+#
+
+"""
+Import-time benchmark: importing thetae, or the engine, must not import the heavy dependencies used by the drivers and
+services. Modules are measured with python -X importtime in a fresh interpreter.
+"""
+
+import os
+import sys
+import subprocess
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+heavy_modules = ['pandas', 'numpy', 'matplotlib', 'bs4', 'selenium', 'pytz']
+
+
+def import_times(statement):
+    """
+    Return a dictionary of the cumulative import time in microseconds of each top-level module imported by statement.
+    """
+    output = subprocess.run([sys.executable, '-X', 'importtime', '-c', statement], cwd=ROOT,
+                            stderr=subprocess.PIPE, universal_newlines=True, check=True).stderr
+    times = {}
+    for line in output.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        self_time, cumulative, name = line[len('import time:'):].split('|')
+        times[name.strip()] = int(cumulative)
+    return times
+
+
+@pytest.mark.parametrize('statement', ['import thetae', 'import thetae.engine'])
+def test_no_heavy_imports(statement):
+    times = import_times(statement)
+    loaded = [module for module in heavy_modules if module in times]
+    assert loaded == [], '%s imports %s' % (statement, ', '.join(loaded))
+
+
+def test_import_time_report():
+    times = import_times('import thetae.engine')
+    print('import thetae.engine: %.3f s' % (times['thetae.engine'] / 1e6))
+    slowest = sorted(times.items(), key=lambda item: item[1], reverse=True)[:10]
+    for name, cumulative in slowest:
+        print('    %8.3f s  %s' % (cumulative / 1e6, name))
+    assert times['thetae.engine'] > 0
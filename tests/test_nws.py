@@ -0,0 +1,73 @@
+#
+# Copyright (c) 2019 Jonathan Weyn <jweyn@uw.edu>
+#
+# See the file LICENSE for your rights.
+#
+
+"""
+Tests for the streaming NWS DWML parser, on a recorded 48-hour digital DWML document which spans the change from
+daylight saving time (two 01:00 local times with different offsets). It includes nil values, a parameter of a type
+which is not read (heat index, all nil), a parameter with a 'name' child, and empty, nil, single, and multiple weather
+conditions. The expected values were produced by the original ElementTree-to-dict parser.
+"""
+
+import os
+from datetime import datetime
+import numpy as np
+import pandas as pd
+import pytest
+from thetae.data_parsers import nws
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'nws')
+DWML_FILE = os.path.join(DATA_DIR, 'sea_dwml.xml')
+
+
+@pytest.fixture
+def expected():
+    return pd.read_csv(os.path.join(DATA_DIR, 'sea_dwml.csv'), index_col=0, parse_dates=True)
+
+
+def test_hourly_frame(expected):
+    hourly = nws.parse_dwml(DWML_FILE)
+    assert list(hourly.columns) == ['DateTime'] + list(expected.columns)
+    assert list(hourly.index) == list(expected.index)
+    assert list(hourly['DateTime']) == list(expected.index)
+    # Continuous hourly UTC times across the change of offset
+    assert (np.diff(hourly.index.values) == np.timedelta64(1, 'h')).all()
+    for column in expected.columns:
+        if column == 'condition':
+            continue
+        assert hourly[column].dtype == np.float64
+        np.testing.assert_allclose(hourly[column].values, expected[column].values, rtol=0, atol=1e-5,
+                                   err_msg=column)
+    assert hourly['windGust'].isnull().sum() == 10
+    assert hourly['rain'].isnull().sum() == 8
+
+
+def test_conditions(expected):
+    conditions = list(nws.parse_dwml(DWML_FILE)['condition'])
+    assert [c if isinstance(c, str) else None for c in conditions] == \
+        [c if isinstance(c, str) else None for c in expected['condition']]
+    assert conditions[1] == 'rain showers'
+    assert conditions[3] == 'rain,thunderstorms'
+    assert pd.isnull(conditions[0])  # empty
+    assert pd.isnull(conditions[11])  # nil
+
+
+def test_get_nws_forecast(monkeypatch):
+    with open(DWML_FILE, 'rb') as f:
+        content = f.read()
+
+    class Response(object):
+        def __init__(self, url):
+            self.url = url
+            self.content = content
+
+        def raise_for_status(self):
+            if 'api.weather.gov' in self.url:
+                raise IOError('no daily forecast')
+
+    monkeypatch.setattr(nws.http, 'model_get', lambda config, model, url, **kwargs: Response(url))
+    forecast = nws.get_nws_forecast({'debug': 0}, 'NWS', 'KSEA', 47.45, -122.31, datetime(2018, 11, 4))
+    np.testing.assert_allclose(forecast.daily.get_values(), (59.0, 41.0, 21.7244, 2.13))
+    assert len(forecast.timeseries.data) == 48
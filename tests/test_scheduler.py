@@ -0,0 +1,45 @@
+#
+# Copyright (c) 2019 Jonathan Weyn <jweyn@uw.edu>
+#
+# See the file LICENSE for your rights.
+#
+
+"""
+Tests for the validation of the daemon schedule.
+"""
+
+import pytest
+from thetae.scheduler import Scheduler
+
+
+def make_config(schedule):
+    return {'Engine': {'Services': {'retrieve_services': ['thetae.getForecasts']}, 'Schedule': schedule}}
+
+
+def test_after_chain():
+    scheduler = Scheduler(make_config({
+        'obs': {'services': 'thetae.getVerification', 'interval': '60'},
+        'calc': {'services': 'thetae.calcVerification', 'after': 'obs'},
+        'output': {'services': ['thetae.plot.all', 'thetae.web.all'], 'after': ['calc', 'obs']},
+    }))
+    obs = scheduler.jobs[0]
+    assert [job.name for job in scheduler.completed(obs)] == ['calc', 'output']
+
+
+@pytest.mark.parametrize('schedule', [
+    {'self': {'services': 'thetae.getForecasts', 'interval': '60', 'after': 'self'}},
+    {'a': {'services': 'thetae.getForecasts', 'interval': '60', 'after': 'b'},
+     'b': {'services': 'thetae.getVerification', 'after': 'a'}},
+    {'start': {'services': 'thetae.getForecasts', 'interval': '60'},
+     'a': {'services': 'thetae.getVerification', 'after': ['start', 'c']},
+     'b': {'services': 'thetae.calcVerification', 'after': 'a'},
+     'c': {'services': 'thetae.web.all', 'after': 'b'}},
+])
+def test_circular_after(schedule):
+    with pytest.raises(ValueError, match='circular'):
+        Scheduler(make_config(schedule))
+
+
+def test_unknown_after():
+    with pytest.raises(ValueError, match='unknown job'):
+        Scheduler(make_config({'a': {'services': 'thetae.getForecasts', 'after': 'b'}}))
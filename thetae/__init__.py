@@ -19,14 +19,31 @@ all_service_groups = [
 ]
 
 # ==============================================================================
-# Make sure we import everything we need.
+# Lazy imports.
 # ==============================================================================
 
-# Current-level module imports. 'engine' depends on 'all_service_groups' above.
-from . import db
-from . import engine
-from . import getForecasts
-from . import getVerification
-from . import calcVerification
-from . import util
-from .util import Forecast, Daily, TimeSeries
+# Sub-modules, such as 'db' and 'engine', and the data classes in 'data' are
+# imported on first access (PEP 562), so that importing thetae, e.g., to parse
+# command-line arguments, does not import pandas, numpy, and the other heavy
+# dependencies. Drivers and services are only imported when they are used, by
+# util.get_object.
+
+_data_names = ['Forecast', 'Daily', 'TimeSeries']
+
+
+def __getattr__(name):
+    import importlib
+    if name in _data_names:
+        return getattr(importlib.import_module('.data', __name__), name)
+    if name.startswith('_'):
+        raise AttributeError("module '%s' has no attribute '%s'" % (__name__, name))
+    try:
+        return importlib.import_module('.' + name, __name__)
+    except ImportError as e:
+        if getattr(e, 'name', None) != '%s.%s' % (__name__, name):
+            raise
+        raise AttributeError("module '%s' has no attribute '%s'" % (__name__, name))
+
+
+def __dir__():
+    return sorted(list(globals().keys()) + _data_names)
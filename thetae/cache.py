@@ -0,0 +1,131 @@
+#
+# Copyright (c) 2019 Jonathan Weyn <jweyn@uw.edu>
+#
+# See the file LICENSE for your rights.
+#
+
+"""
+On-disk cache for HTTP responses, used by thetae.http.
+
+Each response is saved as a pair of files in the cache directory, named by a hash of the full request URL: a '.body'
+file with the raw content and a '.json' file with the hash, the time it was retrieved, and the headers needed to
+re-create the response and to revalidate it (ETag and Last-Modified). The URL itself is not saved, since it may contain
+API keys. The total size of the cache is bounded; when it is exceeded the least recently used responses are removed.
+"""
+
+import os
+import json
+import time
+import hashlib
+import threading
+
+
+class ResponseCache(object):
+    """
+    Size-bounded, least-recently-used cache of HTTP response content on disk.
+    """
+
+    saved_headers = ['Content-Type', 'ETag', 'Last-Modified']
+
+    def __init__(self, cache_dir, max_size=100 * 1024 * 1024):
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.revalidations = 0
+        self.lock = threading.Lock()
+        if not (os.path.isdir(cache_dir)):
+            os.makedirs(cache_dir)
+
+    @staticmethod
+    def key(url):
+        return hashlib.sha1(url.encode('utf-8')).hexdigest()
+
+    def _files(self, key):
+        base = os.path.join(self.cache_dir, key)
+        return base + '.json', base + '.body'
+
+    def load(self, url):
+        """
+        Return (meta, content) for a cached URL, or None if it is not in the cache. Marks the entry as recently used.
+        """
+        meta_file, body_file = self._files(self.key(url))
+        try:
+            with open(meta_file, 'r') as f:
+                meta = json.load(f)
+            with open(body_file, 'rb') as f:
+                content = f.read()
+            os.utime(body_file, None)
+        except (IOError, OSError, ValueError):
+            return None
+        if meta.get('key') != self.key(url):
+            return None
+        return meta, content
+
+    def store(self, url, headers, content):
+        """
+        Save the content and relevant headers of a response.
+        """
+        meta = {
+            'key': self.key(url),
+            'time': time.time(),
+            'headers': {h: headers[h] for h in self.saved_headers if h in headers},
+        }
+        meta_file, body_file = self._files(self.key(url))
+        with self.lock:
+            with open(body_file, 'wb') as f:
+                f.write(content)
+            with open(meta_file, 'w') as f:
+                json.dump(meta, f)
+            self.evict()
+
+    def refresh(self, url):
+        """
+        Reset the retrieval time of a cached response, e.g., after the server says it has not been modified.
+        """
+        entry = self.load(url)
+        if entry is None:
+            return
+        meta = entry[0]
+        meta['time'] = time.time()
+        meta_file, body_file = self._files(self.key(url))
+        with self.lock:
+            with open(meta_file, 'w') as f:
+                json.dump(meta, f)
+
+    def evict(self):
+        """
+        Remove the least recently used responses until the cache is within its size limit.
+        """
+        entries = []
+        total_size = 0
+        for file_name in os.listdir(self.cache_dir):
+            if not file_name.endswith('.body'):
+                continue
+            body_file = os.path.join(self.cache_dir, file_name)
+            try:
+                stat = os.stat(body_file)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, file_name[:-5]))
+            total_size += stat.st_size
+        entries.sort()
+        while total_size > self.max_size and len(entries) > 0:
+            mtime, size, key = entries.pop(0)
+            for cache_file in self._files(key):
+                try:
+                    os.remove(cache_file)
+                except OSError:
+                    pass
+            total_size -= size
+
+    def count(self, counter):
+        """
+        Add one to the 'hits', 'misses', or 'revalidations' counter.
+        """
+        with self.lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def stats(self):
+        with self.lock:
+            return {'hits': self.hits, 'misses': self.misses, 'revalidations': self.revalidations}
@@ -9,46 +9,78 @@ Calculate verification scores and metrics. These are not saved to the database,
 """
 
 import numpy as np
-from thetae.db import readDaily
+from thetae.db import readDaily, readDailyForecasts, readClimo
 from datetime import datetime, timedelta
-from thetae.util import date_to_string, last_leap_year, date_to_datetime, Daily
+from thetae.util import date_to_string, date_to_datetime
 from collections import OrderedDict
 import json
+import warnings
 
 
-def get_forecast_stats(forecasts, verifs, day_list=None):
+variables = ['high', 'low', 'wind', 'rain']
+
+# Data used and written by this service, for the engine's service graph (see thetae.graph)
+requires = ['forecast', 'verif', 'climo']
+provides = ['stats']
+
+
+def get_forecast_stats(forecast_values, verif_values, mask):
     """
-    Returns the statistics of a forecast relative to a verification.
+    Returns the statistics of forecasts relative to a verification, for many models at once. Days where mask is False
+    are ignored.
+
+    :param forecast_values: ndarray: forecasts of shape (model, day, variable), or (day, variable) for the same forecast
+        for every model, e.g., climatology
+    :param verif_values: ndarray: verification of shape (day, variable)
+    :param mask: ndarray: bool array of shape (model, day) of days to verify for each model
+    :return: bias, rmse, rmse_no_bias: ndarrays of shape (model, variable)
     """
-    if day_list is not None:
-        days = day_list
-    else:
-        days = list(forecasts.keys() & verifs.keys())
-    num_days = len(days)
-    stats_dict = OrderedDict()
-    stats_dict['attrs'] = OrderedDict()
-    stats_dict['attrs']['numDays'] = num_days
-    stats_dict['attrs']['verifyingDays'] = [date_to_datetime(d).isoformat() + 'Z' for d in days]
-    stats_dict['stats'] = OrderedDict()
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', category=RuntimeWarning)
+        errors = np.where(mask[:, :, None], forecast_values - verif_values, np.nan)
+        bias = np.nanmean(errors, axis=1)
+        rmse = np.nanmean(np.sqrt(errors ** 2.), axis=1)
+        rmse_no_bias = np.nanmean(np.sqrt((errors - bias[:, None, :]) ** 2.), axis=1)
+    return bias, rmse, rmse_no_bias
 
-    for var in ['high', 'low', 'wind', 'rain']:
-        stats_dict['stats'][var] = OrderedDict()
 
-    if num_days < 1:
-        return stats_dict
+def get_skill(rmse, reference_rmse):
+    """
+    Returns the skill score of an rmse relative to that of a reference forecast.
+    """
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return 1. - rmse / reference_rmse
 
-    for var in ['high', 'low', 'wind', 'rain']:
-        forecast_values = np.array([getattr(forecasts[day], var) for day in days], dtype=np.float)
-        verif_values = np.array([getattr(verifs[day], var) for day in days], dtype=np.float)
 
-        bias = np.nanmean(forecast_values - verif_values)
-        rmse = np.nanmean(np.sqrt((forecast_values - verif_values) ** 2.))
-        rmse_no_bias = np.nanmean(np.sqrt((forecast_values - bias - verif_values) ** 2.))
-        stats_dict['stats'][var]['bias'] = bias
-        stats_dict['stats'][var]['rmse'] = rmse
-        stats_dict['stats'][var]['rmseNoBias'] = rmse_no_bias
+def dailys_to_array(dailys, days):
+    """
+    Returns an array of shape (day, variable) of the values in a {date: daily} dictionary for the given days, and a
+    bool array of which days are present. Values for missing days are NaN.
+    """
+    values = np.full((len(days), len(variables)), np.nan)
+    available = np.zeros(len(days), dtype=bool)
+    for d, day in enumerate(days):
+        if day in dailys:
+            values[d] = np.array([getattr(dailys[day], v) for v in variables], dtype=float)
+            available[d] = True
+    return values, available
 
-    return stats_dict
+
+def forecasts_to_array(forecasts, models, days):
+    """
+    Returns an array of shape (model, day, variable) of the values in a DataFrame of daily forecasts, as returned by
+    db.readDailyForecasts, and a bool array of shape (model, day) of which forecasts are present.
+    """
+    values = np.full((len(models), len(days), len(variables)), np.nan)
+    available = np.zeros((len(models), len(days)), dtype=bool)
+    model_index = forecasts['MODEL'].map({model: m for m, model in enumerate(models)})
+    day_index = forecasts['DATETIME'].map({day: d for d, day in enumerate(days)})
+    rows = (model_index.notnull() & day_index.notnull()).to_numpy()
+    model_index = model_index[rows].to_numpy(dtype=int)
+    day_index = day_index[rows].to_numpy(dtype=int)
+    values[model_index, day_index] = forecasts[[v.upper() for v in variables]].to_numpy(dtype=float)[rows]
+    available[model_index, day_index] = True
+    return values, available
 
 
 def list_to_dict(dailys):
@@ -99,19 +131,9 @@ def main(config):
         # Load verification and climo data
         if config['debug'] > 50:
             print('calcVerification: loading verification and climo data')
-        verification = readDaily(config, stid, data_binding, 'verif', start_date=start_date, end_date=end_date)
-        climo = []
-        current_date = start_date
-        while current_date <= end_date:
-            climo_date = current_date.replace(year=last_leap_year())
-            try:
-                climo_day = readDaily(config, stid, data_binding, 'climo', start_date=climo_date, end_date=climo_date)
-                climo_day.date = current_date
-            except ValueError:  # missing climo data
-                climo_day = Daily(stid, current_date)
-                climo_day.set_values(np.nan, np.nan, np.nan, np.nan)
-            climo.append(climo_day)
-            current_date += timedelta(days=1)
+        verification = readDaily(config, stid, data_binding, 'verif', start_date=start_date, end_date=end_date,
+                                 force_list=True)
+        climo = readClimo(config, stid, start_date, end_date)
 
         # Get persistence and convert to dictionaries
         persistence = OrderedDict()
@@ -120,51 +142,58 @@ def main(config):
         verification = list_to_dict(verification)
         climo = list_to_dict(climo)
 
+        # Load the forecasts for all models at once
+        if config['debug'] > 50:
+            print('calcVerification: loading forecast data')
+        models = list(config['Models'].keys())
+        all_forecasts = readDailyForecasts(config, stid, models, start_date + timedelta(days=1), end_date)
+
+        # Assemble the arrays of forecast and reference values. The verifying days for each model are those with a
+        # forecast, a verification, and a persistence forecast; climo is present for all days.
+        days = [date_to_string(start_date + timedelta(days=d)) for d in range(1, (end_date - start_date).days + 1)]
+        forecast_values, forecast_available = forecasts_to_array(all_forecasts, models, days)
+        verif_values, verif_available = dailys_to_array(verification, days)
+        climo_values, climo_available = dailys_to_array(climo, days)
+        persist_values, persist_available = dailys_to_array(persistence, days)
+        mask = forecast_available & verif_available & climo_available & persist_available
+
+        # Get stats for each of the model, climo, and persistence. We do this for every model so that the skill scores
+        # can be compared across different sets of available verification days for each model.
+        if config['debug'] > 50:
+            print('calcVerification: calculating statistics for %d models' % len(models))
+        bias, rmse, rmse_no_bias = get_forecast_stats(forecast_values, verif_values, mask)
+        climo_rmse = get_forecast_stats(climo_values, verif_values, mask)[1]
+        persist_rmse = get_forecast_stats(persist_values, verif_values, mask)[1]
+        scores = OrderedDict([
+            ('bias', bias),
+            ('rmse', rmse),
+            ('rmseNoBias', rmse_no_bias),
+            ('skillClimo', get_skill(rmse, climo_rmse)),
+            ('skillClimoNoBias', get_skill(rmse_no_bias, climo_rmse)),
+            ('skillPersist', get_skill(rmse, persist_rmse)),
+            ('skillPersistNoBias', get_skill(rmse_no_bias, persist_rmse)),
+        ])
+
         stats[stid] = OrderedDict()
-        for model in list(config['Models'].keys()):
-            if config['debug'] > 50:
-                print('calcVerification: loading forecast data for %s' % model)
-            try:
-                forecasts = readDaily(config, stid, data_binding, 'daily_forecast', model=model,
-                                      start_date=start_date+timedelta(days=1), end_date=end_date, force_list=True)
-                forecasts = list_to_dict(forecasts)
-            except ValueError:
+        for m, model in enumerate(models):
+            if not np.any(forecast_available[m]):
                 if config['debug'] > 9:
                     print('calcVerification warning: no data found for model %s at %s' % (model, stid))
                 continue
-            verif_days = [d for d in forecasts.keys() if (d in verification.keys() and d in climo.keys() and
-                                                          d in persistence.keys())]
-
-            # Get stats for each of the model, climo, and persistence. We do this for every model so that the skill
-            # scores can be compared across different sets of available verification days for each model.
-            if config['debug'] > 50:
-                print('calcVerification: calculating statistics for %s' % model)
-            model_stats = get_forecast_stats(forecasts, verification, day_list=verif_days)
-            climo_stats = get_forecast_stats(climo, verification, day_list=verif_days)
-            persist_stats = get_forecast_stats(persistence, verification, day_list=verif_days)
-
-            # Add in the skill scores
-            for var in ['high', 'low', 'wind', 'rain']:
-                try:
-                    model_stats['stats'][var]['skillClimo'] = 1. - (model_stats['stats'][var]['rmse'] /
-                                                                    climo_stats['stats'][var]['rmse'])
-                except KeyError:
-                    model_stats['stats'][var]['skillClimo'] = None
-                try:
-                    model_stats['stats'][var]['skillClimoNoBias'] = 1. - (model_stats['stats'][var]['rmseNoBias'] /
-                                                                          climo_stats['stats'][var]['rmse'])
-                except KeyError:
-                    model_stats['stats'][var]['skillClimoNoBias'] = None
-                try:
-                    model_stats['stats'][var]['skillPersist'] = 1. - (model_stats['stats'][var]['rmse'] /
-                                                                      persist_stats['stats'][var]['rmse'])
-                except KeyError:
-                    model_stats['stats'][var]['skillPersist'] = None
-                try:
-                    model_stats['stats'][var]['skillPersistNoBias'] = 1. - (model_stats['stats'][var]['rmseNoBias'] /
-                                                                            persist_stats['stats'][var]['rmse'])
-                except KeyError:
-                    model_stats['stats'][var]['skillPersistNoBias'] = None
+            verif_days = [days[d] for d in np.where(mask[m])[0]]
+            model_stats = OrderedDict()
+            model_stats['attrs'] = OrderedDict()
+            model_stats['attrs']['numDays'] = len(verif_days)
+            model_stats['attrs']['verifyingDays'] = [date_to_datetime(d).isoformat() + 'Z' for d in verif_days]
+            model_stats['stats'] = OrderedDict()
+            for v, var in enumerate(variables):
+                model_stats['stats'][var] = OrderedDict()
+                for score in scores.keys():
+                    # Without verifying days, only the skill scores are given, as None
+                    if len(verif_days) > 0:
+                        model_stats['stats'][var][score] = float(scores[score][m, v])
+                    elif score.startswith('skill'):
+                        model_stats['stats'][var][score] = None
 
             # Remove NaN (not interpreted by json) and add to the large dictionary
             replace_nan_in_dict(model_stats)
@@ -12,20 +12,22 @@ be separately obtained from the API with a location call. These keys will be aut
 """
 
 from thetae import Forecast
-from thetae.util import get_codes, write_codes, check_cache_file, localized_date_to_utc
+from thetae.util import check_cache_file
+from thetae.data import get_codes, write_codes, dates_to_utc
 from datetime import datetime, timedelta
-from dateutil.parser import parse as parse_iso
 import requests
+from thetae import http
 import pandas as pd
-import numpy as np
 import json
 
 default_model_name = 'AccuWeather'
 
 
-def get_accuwx_location(lat, lon, api_key):
+def get_accuwx_location(config, model, lat, lon, api_key):
     """
     Retrieves a site's location key from the AccuWeather API.
+    :param config:
+    :param model:
     :param lat:
     :param lon:
     :param api_key:
@@ -34,18 +36,19 @@ def get_accuwx_location(lat, lon, api_key):
     api_url = 'http://dataservice.accuweather.com/locations/v1/cities/geoposition/search'
     point = '%0.3f,%0.3f' % (lat, lon)
     api_options = {'apikey': api_key, 'q': point}
-    response = requests.get(api_url, params=api_options)
+    response = http.model_get(config, model, api_url, params=api_options)
     accuwx_location = response.json()
     location_key = accuwx_location['Key']
 
     return location_key
 
 
-def get_location_key(config, stid, lat, lon, api_key):
+def get_location_key(config, model, stid, lat, lon, api_key):
     """
     Gets a site's location key either from the archived codes file or the API, writing to the archive file in the
     process.
     :param config:
+    :param model:
     :param stid:
     :param lat:
     :param lon:
@@ -56,11 +59,11 @@ def get_location_key(config, stid, lat, lon, api_key):
     try:
         location_key = get_codes(config, codes_file, stid=stid)
     except (IOError, OSError):  # codes file does not exist
-        location_key = get_accuwx_location(lat, lon, api_key)
+        location_key = get_accuwx_location(config, model, lat, lon, api_key)
         codes = {stid: location_key}
         write_codes(config, codes, codes_file, header='station ID,location key')
     except KeyError:  # site not in codes file
-        location_key = get_accuwx_location(lat, lon, api_key)
+        location_key = get_accuwx_location(config, model, lat, lon, api_key)
         codes = get_codes(config, codes_file)
         codes[stid] = location_key
         write_codes(config, codes, codes_file, header='station ID,location key')
@@ -68,10 +71,11 @@ def get_location_key(config, stid, lat, lon, api_key):
     return location_key
 
 
-def get_accuwx_forecast(config, stid, location_key, api_key, forecast_date):
+def get_accuwx_forecast(config, model, stid, location_key, api_key, forecast_date):
     """
     Get a Forecast from the AccuWeather API or the cache file.
     :param config:
+    :param model:
     :param stid:
     :param location_key:
     :param api_key:
@@ -87,7 +91,7 @@ def get_accuwx_forecast(config, stid, location_key, api_key, forecast_date):
     if not cache_ok:
         api_url = 'http://dataservice.accuweather.com/forecasts/v1/daily/5day/%s' % location_key
         api_options = {'apikey': api_key}
-        response = requests.get(api_url, params=api_options)
+        response = http.model_get(config, model, api_url, params=api_options)
         accuwx_data = response.json()
         # Raise error if we have invalid HTTP response
         try:
@@ -103,9 +107,7 @@ def get_accuwx_forecast(config, stid, location_key, api_key, forecast_date):
 
     # Convert to pandas DataFrame, fix time, and get high and low
     accuwx_df = pd.DataFrame(accuwx_data['DailyForecasts'])
-    accuwx_df['DateTime'] = np.nan
-    for idx in accuwx_df.index:
-        accuwx_df.loc[idx, 'DateTime'] = localized_date_to_utc(parse_iso(accuwx_df.loc[idx, 'Date'])).replace(hour=0)
+    accuwx_df['DateTime'] = dates_to_utc(accuwx_df['Date']).normalize()
     accuwx_df.set_index('DateTime', inplace=True)
     high = float(accuwx_df.loc[forecast_date, 'Temperature']['Maximum']['Value'])
     # Low should be for night before. We can also 'guess' that the low could be non-diurnal and halfway between the
@@ -142,9 +144,9 @@ def main(config, model, stid, forecast_date):
         raise KeyError('accuweather.py: no api_key parameter defined for model %s in config!' % model)
 
     # Get the location key
-    location_key = get_location_key(config, stid, lat, lon, api_key)
+    location_key = get_location_key(config, model, stid, lat, lon, api_key)
 
     # Get forecast
-    forecast = get_accuwx_forecast(config, stid, location_key, api_key, forecast_date)
+    forecast = get_accuwx_forecast(config, model, stid, location_key, api_key, forecast_date)
 
     return forecast
@@ -9,17 +9,16 @@ Retrieve Aeris forecast data.
 """
 
 from thetae import Forecast
-from thetae.util import localized_date_to_utc
+from thetae.data import dates_to_utc
 from datetime import datetime, timedelta
-from dateutil.parser import parse as parse_iso
 import requests
+from thetae import http
 import pandas as pd
-import numpy as np
 
 default_model_name = 'Aeris'
 
 
-def get_aeris_forecast(stid, lat, lon, api_id, api_secret, forecast_date):
+def get_aeris_forecast(config, model, stid, lat, lon, api_id, api_secret, forecast_date):
 
     # Retrieve data
     api_url = 'https://api.aerisapi.com/forecasts/%s'
@@ -31,7 +30,7 @@ def get_aeris_forecast(stid, lat, lon, api_id, api_secret, forecast_date):
         'plimit': '60',
     }
     json_url = api_url % point
-    response = requests.get(json_url, params=api_options)
+    response = http.model_get(config, model, json_url, params=api_options)
     aeris_data = response.json()
     # Raise error for invalid HTTP response
     try:
@@ -42,9 +41,7 @@ def get_aeris_forecast(stid, lat, lon, api_id, api_secret, forecast_date):
 
     # Convert to pandas DataFrame and fix time, units, and columns
     aeris_df = pd.DataFrame(aeris_data['response'][0]['periods'])
-    aeris_df['DateTime'] = np.nan
-    for idx in aeris_df.index:
-        aeris_df.loc[idx, 'DateTime'] = localized_date_to_utc(parse_iso(aeris_df.loc[idx, 'dateTimeISO']))
+    aeris_df['DateTime'] = dates_to_utc(aeris_df['dateTimeISO'])
     aeris_df.set_index('DateTime', inplace=True)
     column_names_dict = {
         'avgTempF': 'temperature',
@@ -106,6 +103,6 @@ def main(config, model, stid, forecast_date):
         raise KeyError('aeris: no api_secret parameter defined for model %s in config!' % model)
 
     # Get forecast
-    forecast = get_aeris_forecast(stid, lat, lon, api_id, api_secret, forecast_date)
+    forecast = get_aeris_forecast(config, model, stid, lat, lon, api_id, api_secret, forecast_date)
 
     return forecast
@@ -9,18 +9,46 @@ Module for processing BUFKIT model data.
 """
 
 import os
-from datetime import timedelta, datetime
+import glob
+import json
+import shutil
+import subprocess
+import threading
+from datetime import timedelta
 import re
 import numpy as np
 import pandas as pd
-from thetae.util import c_to_f, ms_to_kt, wind_uv_to_speed_dir, mm_to_in
+from thetae.util import c_to_f, ms_to_kt, mm_to_in, to_bool
+from thetae.data import wind_uv_to_speed_dir
 from thetae import Forecast
+from thetae.trace import span
 from io import open
+from builtins import str
+from concurrent.futures import ThreadPoolExecutor
+
+default_timeout = 600
+default_workers = 4
+
+# Files already requested by prefetch in this run, as (dataset, cycle, model time, station)
+_prefetched = set()
+
+_archive_lock = threading.Lock()
+
+
+def _remove(pattern):
+    for path in glob.glob(pattern):
+        if os.path.isdir(path):
+            shutil.rmtree(path, ignore_errors=True)
+        else:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
 
 
 def bufr_delete_yesterday(bufr_dir, stid, date):
     """
-    Delete the BUFKIT archived files for a specific date.
+    Delete the BUFKIT downloaded files for a specific date.
 
     :param bufr_dir: directory where bufrgruven is told to save bufr files
     :param stid:
@@ -28,163 +56,254 @@ def bufr_delete_yesterday(bufr_dir, stid, date):
     :return:
     """
     yesterday_date = (date - timedelta(days=1)).strftime('%Y%m%d')
-    os.system('rm -rf %s/bufkit/%s*%s.buf' % (bufr_dir, yesterday_date, stid.lower()))
-    os.system('rm -rf %s/gempak/%s*' % (bufr_dir, yesterday_date))
-    os.system('rm -rf %s/bufr/*%s*' % (bufr_dir, yesterday_date))
+    _remove('%s/bufkit/%s*%s.buf' % (bufr_dir, yesterday_date, stid.lower()))
+    _remove('%s/gempak/%s*' % (bufr_dir, yesterday_date))
+    _remove('%s/bufr/*%s*' % (bufr_dir, yesterday_date))
     return
 
 
+def get_archive_options(config):
+    """
+    Return whether parsed bufkit data are archived, and the number of days to keep them (0 to keep them forever).
+    """
+    try:
+        archive = to_bool(config['BUFKIT']['archive'])
+    except (KeyError, ValueError):
+        archive = False
+    try:
+        archive_days = int(config['BUFKIT']['archive_days'])
+    except (KeyError, ValueError):
+        archive_days = 0
+    return archive, archive_days
+
+
+def archive_dir(bufr_dir, stid):
+    return '%s/archive/%s' % (bufr_dir, stid.lower())
+
+
+def _read_index(directory):
+    try:
+        with open('%s/index.json' % directory, 'r') as f:
+            return json.load(f)
+    except (IOError, OSError, ValueError):
+        return {}
+
+
+def _write_index(directory, index):
+    # Write atomically, since the index may be read by another process
+    index_file = '%s/index.json' % directory
+    with open(index_file + '.tmp', 'w') as f:
+        f.write(str(json.dumps(index, indent=1, sort_keys=True)))
+    os.rename(index_file + '.tmp', index_file)
+
+
+def archive_arrays(bufr_dir, stid, model_time, bufr_name, times, columns, values):
+    """
+    Save the arrays parsed from a bufkit file in a compressed .npz file, with values as float32, and add it to the
+    station's archive index.
+    """
+    directory = archive_dir(bufr_dir, stid)
+    key = '%s.%s' % (model_time, bufr_name)
+    names = sorted(columns.keys(), key=lambda name: columns[name])
+    with _archive_lock:
+        if not (os.path.isdir(directory)):
+            os.makedirs(directory)
+        np.savez_compressed('%s/%s.npz' % (directory, key), times=times.values.astype('datetime64[s]').astype(np.int64),
+                            columns=np.array(names), values=values.astype(np.float32))
+        index = _read_index(directory)
+        index[key] = {'file': '%s.npz' % key, 'model_time': model_time, 'bufr_name': bufr_name,
+                      'rows': int(values.shape[0]), 'columns': names}
+        _write_index(directory, index)
+
+
+def archive_entry(bufr_dir, stid, model_time, bufr_name):
+    """
+    Return the archive index entry of a model run for a station, or None if it is not in the archive.
+    """
+    directory = archive_dir(bufr_dir, stid)
+    entry = _read_index(directory).get('%s.%s' % (model_time, bufr_name), None)
+    if entry is None or not os.path.isfile('%s/%s' % (directory, entry['file'])):
+        return None
+    return entry
+
+
+def load_arrays(bufr_dir, stid, model_time, bufr_name):
+    """
+    Load archived arrays as returned by parse_arrays, or None if they are not in the archive. Only the arrays of the
+    requested file are read.
+    """
+    entry = archive_entry(bufr_dir, stid, model_time, bufr_name)
+    if entry is None:
+        return None
+    directory = archive_dir(bufr_dir, stid)
+    with np.load('%s/%s' % (directory, entry['file'])) as archive:
+        times = pd.to_datetime(archive['times'], unit='s')
+        columns = dict([(name, n) for n, name in enumerate(archive['columns'])])
+        values = archive['values'].astype(np.float64)
+    return times, columns, values
+
+
+def prune_archive(bufr_dir, stid, archive_days, date):
+    """
+    Remove archived arrays of model runs more than archive_days before date.
+    """
+    if archive_days <= 0:
+        return
+    directory = archive_dir(bufr_dir, stid)
+    oldest = (date - timedelta(days=archive_days)).strftime('%Y%m%d')
+    with _archive_lock:
+        index = _read_index(directory)
+        old_keys = [key for key, entry in index.items() if entry['model_time'][:8] < oldest]
+        if len(old_keys) == 0:
+            return
+        for key in old_keys:
+            try:
+                os.remove('%s/%s' % (directory, index[key]['file']))
+            except OSError:
+                pass
+            del index[key]
+        _write_index(directory, index)
+
+
+def bufr_dataset(model, stid):
+    """
+    Return the bufrgruven dataset name for a model and station, accounting for some odd bufrgruven naming conventions.
+    """
+    dataset = re.search(r'[^0-2]*', model).group().lower()
+    if dataset == 'fv3':
+        dataset = 'fv3gfsx'
+    if dataset == 'hrrr' and stid.upper()[0] == 'P':
+        dataset = 'hrrrak'
+    if dataset == 'namnest' and stid.upper()[0] == 'P':
+        dataset = 'aknest'
+    return dataset
+
+
+def bufr_file_name(bufkit_dir, model_time, bufr_name, stid):
+    return '%s/bufkit/%s.%s_%s.buf' % (bufkit_dir, model_time, bufr_name, stid.lower())
+
+
+def run_bufrgruven(config, bufr, bufkit_dir, dataset, model_cycle, model_time, stations):
+    """
+    Call bufrgruven to download the files of one dataset and cycle for a list of stations, saving them in bufkit_dir.
+    The call is stopped after the config BUFKIT option 'timeout' seconds.
+    """
+    try:
+        timeout = float(config['BUFKIT']['timeout'])
+    except (KeyError, ValueError):
+        timeout = default_timeout
+    command = [bufr, '--dset', dataset, '--cycle', model_cycle, '--stations', ','.join([s.lower() for s in stations]),
+               '--noascii', '--nozipit', '--metdat', bufkit_dir, '--date', model_time[:-2], '--noverbose']
+    if config['debug'] > 9:
+        print('bufkit: running %s' % ' '.join(command))
+    with span('bufrgruven %s %s' % (dataset, ','.join(stations)), 'subprocess', command=' '.join(command)):
+        try:
+            subprocess.call(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, timeout=timeout)
+        except subprocess.TimeoutExpired:
+            print('bufkit warning: bufrgruven timed out after %g s for %s %s' % (timeout, dataset, ','.join(stations)))
+
+
 def get_bufkit_forecast(config, bufr, bufkit_dir, model, bufr_name, cycle, stid, forecast_date):
     """
     Produce a Forecast from retrieved bufkit files.
     """
     model_cycle = re.search(r'\d+', cycle).group()
     model_time = '%s%s' % ((forecast_date - timedelta(days=1)).strftime('%Y%m%d'), model_cycle)
-
-    # Specify the correct filenames and account for some odd bufrgruven naming conventions
-    bufr_search_model = re.search(r'[^0-2]*', model).group().lower()
-    if bufr_search_model == 'fv3':
-        bufr_search_model = 'fv3gfsx'
-    if bufr_search_model == 'hrrr' and stid.upper()[0] == 'P':
-        bufr_search_model = 'hrrrak'
-    if bufr_search_model == 'namnest' and stid.upper()[0] == 'P':
-        bufr_search_model = 'aknest'
-    bufr_file_name = '%s/bufkit/%s.%s_%s.buf' % (bufkit_dir, model_time, bufr_name, stid.lower())
-
-    # Check if bufkit file was already downloaded
-    if os.path.isfile(bufr_file_name):
-        forecast = bufr_surface_parser(config, model, stid, forecast_date, bufr_file_name)
-        return forecast
-    else:
+    file_name = bufr_file_name(bufkit_dir, model_time, bufr_name, stid)
+    archive, archive_days = get_archive_options(config)
+
+    # Use the archived arrays if this file was already parsed
+    if archive:
+        arrays = load_arrays(bufkit_dir, stid, model_time, bufr_name)
+        if arrays is not None:
+            times, columns, values = arrays
+            return build_forecast(config, model, stid, forecast_date, times, columns, values)
+
+    # Check if bufkit file was already downloaded, e.g., by prefetch
+    if not os.path.isfile(file_name):
         # Call bufrgruven, save files in specified bufr directory
-        command = ('%s --dset %s --cycle %s --stations %s --noascii --nozipit --metdat %s --date %s '
-                   '--noverbose >& /dev/null' %
-                   (bufr, bufr_search_model, model_cycle, stid.lower(), bufkit_dir, model_time[:-2]))
-        os.system(command)
-
-        # Check again for bufkit file, if it exists then create forecast object
-        if os.path.isfile(bufr_file_name):
-            forecast = bufr_surface_parser(config, model, stid, forecast_date, bufr_file_name)
-            return forecast
+        run_bufrgruven(config, bufr, bufkit_dir, bufr_dataset(model, stid), model_cycle, model_time, [stid])
+
+    # Check again for bufkit file, if it exists then create forecast object
+    if os.path.isfile(file_name):
+        times, columns, values = parse_arrays(file_name)
+        if archive:
+            archive_arrays(bufkit_dir, stid, model_time, bufr_name, times, columns, values)
+        forecast = build_forecast(config, model, stid, forecast_date, times, columns, values)
+        return forecast
 
     # If we get here, we're missing the bufkit file
-    raise IOError('bufr file %s not found' % bufr_file_name)
+    raise IOError('bufr file %s not found' % file_name)
 
 
-def bufr_surface_parser(config, model, stid, forecast_date, bufr_file_name):
+def parse_arrays(bufr_file_name):
     """
-    By Luke Madaus. Modified by jweyn and joejoezz.
-    Parse surface data from a bufkit file.
-    """
-
-    # Open bufkit file
-    infile = open(bufr_file_name, 'r', newline='')
-
-    # define variables
-    dateTime = []
-    temperature = []
-    dewpoint = []
-    windSpeed = []
-    windDirection = []
-    rain = []
-    pressure = []
-
-    block_lines = []
-    inblock = False
-    for line in infile:
-        if re.search(r'SELV', line):
-            try:  # jweyn
-                elev = re.search(r'SELV = -?(\d{1,4})', line).groups()[0]  # jweyn: -?
-                elev = float(elev)
-            except:
-                elev = 0.0
-        if line.startswith('STN YY'):
-            # We've found the line that starts the header info
-            inblock = True
-            block_lines.append(line)
-        elif inblock:
-            # Keep appending lines until we start hitting numbers
-            if re.search(r'\d{6}', line):
-                inblock = False
-            else:
-                block_lines.append(line)
-
-    # Build an re search pattern based on this
-    # We know the first two parts of the section are station id num and date
-    re_string = r"(\d{6}|\w{4}) (\d{6})/(\d{4})"
-    # Now compute the remaining number of variables
-    dum_num = len(block_lines[0].split()) - 2
-    for n in range(dum_num):
-        re_string = re_string + r" (-?\d{1,4}.\d{2})"
-    re_string = re_string + '\r\n'
-    for line in block_lines[1:]:
-        dum_num = len(line.split())
-        for n in range(dum_num):
-            re_string = re_string + r'(-?\d{1,4}.\d{2}) '
-        re_string = re_string[:-1]  # Get rid of the trailing space
-        re_string = re_string + '\r\n'
-
-    # Compile this re_string for more efficient re searches
-    block_expr = re.compile(re_string)
-
-    # Now get corresponding indices of the variables we need
-    full_line = ''
-    for r in block_lines:
-        full_line = full_line + r[:-2] + ' '
-    # Now split it
-    varlist = re.split(r'[ /]', full_line)
-
-    # Now loop through all blocks that match the search pattern we defined above
-    blocknum = -1
-    infile.seek(0)
-
-    for block_match in block_expr.finditer(infile.read()):
-        blocknum += 1
-        # Split out the match into each component number
-        vals = list(block_match.groups())
-        # Check for missing values
-        for v in range(len(vals)):
-            if vals[v] == -9999.:
-                vals[v] = np.nan
-        # Set the time
-        dt = '20' + vals[varlist.index('YYMMDD')] + vals[varlist.index('HHMM')]
-        validtime = datetime.strptime(dt, '%Y%m%d%H%M')
-
-        # End loop if we are more than 60 hours past the start of the forecast date
-        if validtime > forecast_date + timedelta(hours=60):
-            break
-
-        # Append values at this time step
-        dateTime.append(validtime)
-        pressure.append(vals[varlist.index('PMSL')])
-        temperature.append(c_to_f(vals[varlist.index('T2MS')]))
-        dewpoint.append(c_to_f(vals[varlist.index('TD2M')]))
-        uwind = ms_to_kt(vals[varlist.index('UWND')])
-        vwind = ms_to_kt(vals[varlist.index('VWND')])
-        speed, dir = wind_uv_to_speed_dir(uwind, vwind)
-        windSpeed.append(speed)
-        windDirection.append(dir)
-        if 'P01M' in varlist:
-            rain.append(mm_to_in(vals[varlist.index('P01M')]))
-        else:
-            # This condition only applies to FV3 model: save 3 hr precipitation instead of 1 hour
-            rain.append(mm_to_in(vals[varlist.index('P03M')]))
-
-    infile.close()
+    Read the surface section of a bufkit file into arrays. The file is read at once and the section is split into
+    tokens once; each record has the station, the date/time, and one value for each variable.
 
-    # first element of rain should be zero (sometimes it is -9999.99)
-    rain[0] = '0.0'
+    :param bufr_file_name: str: path to bufkit file
+    :return: times: DatetimeIndex of valid times; columns: dict of column index for each variable name; values: 2-D
+        float array with a row for each time, where missing values (-9999) are NaN
+    """
+    with open(bufr_file_name, 'rb') as infile:
+        buf = infile.read()
+    header_start = buf.find(b'STN YY')
+    if header_start < 0:
+        raise ValueError('bufkit: no surface data found in %s' % bufr_file_name)
+    section = buf[header_start:]
+
+    # The header lines list the variables, up to the first line with a station number and date
+    match = re.search(br'^\s*\S+ \d{6}/\d{4}', section, re.M)
+    if match is None:
+        raise ValueError('bufkit: no surface data found in %s' % bufr_file_name)
+    names = section[:match.start()].decode('ascii').split()
+    num_values = len(names) - 2  # the station and the date/time are single tokens
+    columns = dict([(name, n) for n, name in enumerate(names[2:])])
+
+    # Split the records into a 2-D array, ignoring any incomplete record at the end
+    tokens = section[match.start():].split()
+    num_records = len(tokens) // (num_values + 2)
+    records = np.array(tokens[:num_records * (num_values + 2)]).reshape((num_records, num_values + 2))
+    times = pd.to_datetime(np.char.add(b'20', records[:, 1]).astype(str), format='%Y%m%d/%H%M')
+    values = records[:, 2:].astype(np.float64)
+    values[values <= -9999.] = np.nan
+    return times, columns, values
+
+
+def build_forecast(config, model, stid, forecast_date, times, columns, values):
+    """
+    Produce a Forecast from the arrays returned by parse_arrays, with unit conversions done on whole columns.
+    """
+    # Only keep times up to 60 hours past the start of the forecast date
+    num_times = int(np.searchsorted(times, forecast_date + timedelta(hours=60), side='right'))
+    times = times[:num_times]
+    values = values[:num_times]
+
+    def column(name):
+        return values[:, columns[name]]
+
+    uwind = ms_to_kt(column('UWND'))
+    vwind = ms_to_kt(column('VWND'))
+    wind_speed, wind_direction = wind_uv_to_speed_dir(uwind, vwind)
+    if 'P01M' in columns:
+        rain = mm_to_in(column('P01M'))
+    else:
+        # This condition only applies to FV3 model: save 3 hr precipitation instead of 1 hour
+        rain = mm_to_in(column('P03M'))
+    # first element of rain should be zero (sometimes it is missing)
+    rain = np.array(rain, dtype=np.float64)
+    rain[0] = 0.0
 
     # Make into dataframe
     df = pd.DataFrame({
-        'temperature': temperature,
-        'dewpoint': dewpoint,
-        'windSpeed': windSpeed,
-        'windDirection': windDirection,
+        'temperature': c_to_f(column('T2MS')),
+        'dewpoint': c_to_f(column('TD2M')),
+        'windSpeed': wind_speed,
+        'windDirection': wind_direction,
         'rain': rain,
-        'pressure': pressure,
-        'dateTime': dateTime
-    }, index=dateTime)
+        'pressure': column('PMSL'),
+        'dateTime': times
+    }, index=times)
 
     # Convert to forecast object
     forecast_start = forecast_date.replace(hour=6)
@@ -217,6 +336,15 @@ def bufr_surface_parser(config, model, stid, forecast_date, bufr_file_name):
     return forecast
 
 
+def bufr_surface_parser(config, model, stid, forecast_date, bufr_file_name):
+    """
+    By Luke Madaus. Modified by jweyn and joejoezz.
+    Parse surface data from a bufkit file.
+    """
+    times, columns, values = parse_arrays(bufr_file_name)
+    return build_forecast(config, model, stid, forecast_date, times, columns, values)
+
+
 def main(config, model, stid, forecast_date):
     """
     Produce a Forecast object from bufkit data.
@@ -245,12 +373,11 @@ def main(config, model, stid, forecast_date):
     else:
         bufr_stid = str(stid)
 
-    # Delete yesterday's bufkit files
-    try:
-        if not(config['BUFKIT']['archive']):
-            bufr_delete_yesterday(bufkit_directory, bufr_stid, forecast_date - timedelta(days=1))
-    except KeyError:
-        bufr_delete_yesterday(bufkit_directory, bufr_stid, forecast_date - timedelta(days=1))
+    # Delete yesterday's bufkit files, which are archived as arrays if archive is set, and expire old archived arrays
+    bufr_delete_yesterday(bufkit_directory, bufr_stid, forecast_date - timedelta(days=1))
+    archive, archive_days = get_archive_options(config)
+    if archive:
+        prune_archive(bufkit_directory, bufr_stid, archive_days, forecast_date)
 
     # Get bufkit forecasts
     forecast = get_bufkit_forecast(config, bufr, bufkit_directory, model, bufr_name, run_time, bufr_stid, forecast_date)
@@ -259,6 +386,70 @@ def main(config, model, stid, forecast_date):
     return forecast
 
 
+def prefetch(config, model, stations, forecast_date):
+    """
+    Download the bufkit files of all the BUFKIT models in the config at once, before main is called for each model and
+    station. Stations are grouped into a single bufrgruven call for each dataset and cycle, and the calls for different
+    datasets run in parallel, using up to the config BUFKIT option 'workers' processes. Files which were already
+    downloaded, or requested earlier in the same run, are skipped, so only the first call for a given forecast date
+    does anything. getForecasts calls prefetch for each model in config order, so a run starts with the call for the
+    first BUFKIT model; the record of requested files is cleared then, so that a later run retries any files that
+    failed (e.g., after a bufrgruven timeout).
+    """
+    # Get parameters from the config
+    try:
+        bufr = config['BUFKIT']['BUFR']
+    except KeyError:
+        raise KeyError('bufkit: missing BUFR executable path in config BUFKIT options')
+    try:
+        bufkit_directory = config['BUFKIT']['BUFKIT_directory']
+    except KeyError:
+        bufkit_directory = '%s/site_data' % config['THETAE_ROOT']
+    try:
+        num_workers = int(config['BUFKIT']['workers'])
+    except (KeyError, ValueError):
+        num_workers = default_workers
+    archive, archive_days = get_archive_options(config)
+    bufkit_models = [m for m in config['Models'].keys() if config['Models'][m].get('driver', None) == __name__]
+    if len(bufkit_models) > 0 and model == bufkit_models[0]:
+        _prefetched.clear()
+
+    # Group the stations still missing files by dataset and cycle
+    groups = {}
+    for bufkit_model in bufkit_models:
+        model_config = config['Models'][bufkit_model]
+        try:
+            model_cycle = re.search(r'\d+', model_config['run_time']).group()
+            bufr_name = model_config['bufr_name']
+        except KeyError:
+            continue
+        model_time = '%s%s' % ((forecast_date - timedelta(days=1)).strftime('%Y%m%d'), model_cycle)
+        for stid in stations:
+            bufr_stid = str(config['Stations'][stid].get('bufr_stid', stid))
+            dataset = bufr_dataset(bufkit_model, bufr_stid)
+            key = (dataset, model_cycle, model_time, bufr_stid.lower())
+            if key in _prefetched or os.path.isfile(bufr_file_name(bufkit_directory, model_time, bufr_name,
+                                                                   bufr_stid)):
+                continue
+            if archive and archive_entry(bufkit_directory, bufr_stid, model_time, bufr_name) is not None:
+                continue
+            _prefetched.add(key)
+            group = groups.setdefault((dataset, model_cycle, model_time), [])
+            if bufr_stid not in group:
+                group.append(bufr_stid)
+    if len(groups) == 0:
+        return
+
+    if config['debug'] > 9:
+        print('bufkit: prefetching %d datasets/cycles for %d stations' % (len(groups), len(stations)))
+    with ThreadPoolExecutor(max_workers=max(1, min(num_workers, len(groups)))) as executor:
+        futures = [executor.submit(run_bufrgruven, config, bufr, bufkit_directory, dataset, model_cycle, model_time,
+                                   group_stations)
+                   for (dataset, model_cycle, model_time), group_stations in sorted(groups.items())]
+        for future in futures:
+            future.result()
+
+
 def historical(config, model, stid, forecast_dates):
     """
     Produce a list of Forecast objects from bufkit for each date in forecast_dates.
@@ -298,11 +489,7 @@ def historical(config, model, stid, forecast_dates):
             if int(config['debug']) > 9:
                 print('bufkit: failed to retrieve historical forecast for %s on %s' % (model, forecast_date))
                 print("*** Reason: '%s'" % str(e))
-        # Delete the bufkit files after processing, unless archived
-        try:
-            if not (config['BUFKIT']['archive']):
-                bufr_delete_yesterday(bufkit_directory, bufr_stid, forecast_date)
-        except KeyError:
-            bufr_delete_yesterday(bufkit_directory, bufr_stid, forecast_date)
+        # Delete the bufkit files after processing; they are archived as arrays if archive is set
+        bufr_delete_yesterday(bufkit_directory, bufr_stid, forecast_date)
 
     return forecasts
@@ -9,23 +9,24 @@ Retrieve Dark Sky forecast data.
 """
 
 from thetae import Forecast
-from thetae.util import epoch_time_to_datetime, mph_to_kt
+from thetae.util import mph_to_kt
+from thetae.data import dates_to_utc
 from datetime import datetime, timedelta
 import requests
+from thetae import http
 import pandas as pd
-import numpy as np
 
 default_model_name = 'Dark Sky'
 
 
-def get_darksky_forecast(stid, lat, lon, api_key, forecast_date):
+def get_darksky_forecast(config, model, stid, lat, lon, api_key, forecast_date):
 
     # Retrieve data
     api_url = 'https://api.darksky.net/forecast/%s/%s'
     point = '%0.3f,%0.3f' % (lat, lon)
     api_options = {'exclude': 'currently,minutely,daily,alerts,flags'}
     json_url = api_url % (api_key, point)
-    response = requests.get(json_url, params=api_options)
+    response = http.model_get(config, model, json_url, params=api_options)
     darksky_data = response.json()
     # Raise error for invalid HTTP response
     try:
@@ -36,9 +37,7 @@ def get_darksky_forecast(stid, lat, lon, api_key, forecast_date):
 
     # Convert to pandas DataFrame and fix time, units, and columns
     darksky_df = pd.DataFrame(darksky_data['hourly']['data'])
-    darksky_df['DateTime'] = np.nan
-    for idx in darksky_df.index:
-        darksky_df.loc[idx, 'DateTime'] = epoch_time_to_datetime(darksky_df.loc[idx, 'time'])  # already UTC
+    darksky_df['DateTime'] = dates_to_utc(darksky_df['time'])  # already UTC
     darksky_df.set_index('DateTime', inplace=True)
     column_names_dict = {
         'cloudCover': 'cloud',
@@ -86,6 +85,6 @@ def main(config, model, stid, forecast_date):
         raise KeyError('darksky: no api_key parameter defined for model %s in config!' % model)
 
     # Get forecast
-    forecast = get_darksky_forecast(stid, lat, lon, api_key, forecast_date)
+    forecast = get_darksky_forecast(config, model, stid, lat, lon, api_key, forecast_date)
 
     return forecast
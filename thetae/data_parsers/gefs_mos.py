@@ -16,10 +16,10 @@ function write_ensemble_daily.
 
 import re
 from thetae import Forecast, Daily
-from thetae.util import write_ensemble_daily
+from thetae.data import write_ensemble_daily
 from datetime import datetime, timedelta
 import numpy as np
-import requests
+from thetae import http
 from bs4 import BeautifulSoup
 
 default_model_name = 'GEFS MOS'
@@ -48,10 +48,12 @@ def qpf_interpreter(qpf):
     return new_p
 
 
-def get_gefs_mos_forecast(stid, forecast_date):
+def get_gefs_mos_forecast(config, model, stid, forecast_date):
     """
     Retrieve GEFS MOS data. 
 
+    :param config:
+    :param model: model name in config
     :param stid: station ID
     :param forecast_date: datetime of day to forecast
     :return: Forecast object for high, low, precip for next day. No wind.
@@ -59,7 +61,7 @@ def get_gefs_mos_forecast(stid, forecast_date):
 
     # Retrieve the model data
     url = 'http://www.nws.noaa.gov/cgi-bin/mos/getens.pl?sta=%s' % stid
-    response = requests.get(url)
+    response = http.model_get(config, model, url)
     page = response.text
     soup = BeautifulSoup(page, 'html.parser')
 
@@ -128,7 +130,7 @@ def main(config, model, stid, forecast_date):
     """
 
     # Get forecast
-    mean_forecast, dailys = get_gefs_mos_forecast(stid, forecast_date)
+    mean_forecast, dailys = get_gefs_mos_forecast(config, model, stid, forecast_date)
 
     # Write the ensemble to a file, for the current STID
     if stid.upper() == config['current_stid'].upper():
@@ -12,7 +12,8 @@ from thetae import Forecast
 from datetime import datetime, timedelta
 import pandas as pd
 import numpy as np
-import requests
+from thetae import http
+from io import StringIO
 from builtins import str
 
 default_model_name = 'MOS'
@@ -41,10 +42,12 @@ def qpf_interpreter(qpf):
     return new_p
 
 
-def get_mos_forecast(stid, mos_model, init_date, forecast_date):
+def get_mos_forecast(config, model, stid, mos_model, init_date, forecast_date):
     """
     Retrieve MOS data. No unit conversions, yay!
 
+    :param config:
+    :param model: model name in config
     :param stid: station ID
     :param mos_model: model name ('GFS' or 'NAM')
     :param init_date: datetime of model initialization
@@ -58,9 +61,9 @@ def get_mos_forecast(stid, mos_model, init_date, forecast_date):
     base_url = 'http://mesonet.agron.iastate.edu/mos/csv.php?station=%s&runtime=%s&model=%s'
     formatted_date = init_date.strftime('%Y-%m-%d%%20%H:00')
     url = base_url % (stid, formatted_date, mos_model)
-    response = requests.get(url, stream=True)
+    response = http.model_get(config, model, url)
     # Create pandas DataFrame
-    df = pd.read_csv(response.raw, index_col=False)
+    df = pd.read_csv(StringIO(response.text), index_col=False)
     # Raise exception if DataFrame is empty
     if len(df.index) == 0:
         raise ValueError('mos: error: empty DataFrame; data missing.')
@@ -137,7 +140,7 @@ def main(config, model, stid, forecast_date):
         init_date = forecast_date - timedelta(hours=24)
 
     # Get forecast
-    forecast = get_mos_forecast(stid, mos_model, init_date, forecast_date)
+    forecast = get_mos_forecast(config, model, stid, mos_model, init_date, forecast_date)
 
     return forecast
 
@@ -157,7 +160,7 @@ def historical(config, model, stid, forecast_dates):
     for forecast_date in forecast_dates:
         init_date = forecast_date - timedelta(hours=12)
         try:
-            forecast = get_mos_forecast(stid, mos_model, init_date, forecast_date)
+            forecast = get_mos_forecast(config, model, stid, mos_model, init_date, forecast_date)
             forecasts.append(forecast)
         except BaseException as e:
             if int(config['debug']) > 9:
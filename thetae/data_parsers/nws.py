@@ -9,12 +9,13 @@ Retrieve NWS forecast data.
 """
 
 from thetae import Forecast
-from thetae.util import to_float, localized_date_to_utc, mph_to_kt
+from thetae.util import mph_to_kt
+from thetae.data import dates_to_utc
 from datetime import datetime, timedelta
 from dateutil.parser import parse as parse_iso
-import requests
-from collections import defaultdict
-from xml.etree import cElementTree as eTree
+from thetae import http
+from io import BytesIO
+from xml.etree import ElementTree as eTree
 import pandas as pd
 import numpy as np
 import re
@@ -23,68 +24,97 @@ from builtins import str
 default_model_name = 'NWS'
 
 
-def etree_to_dict(t):
-    """
-    Convert an XML tree to a dictionary, courtesy of @K3---rnc (StackOverflow)
-    """
-    d = {t.tag: {} if t.attrib else None}
-    children = list(t)
-    if children:
-        dd = defaultdict(list)
-        for dc in map(etree_to_dict, children):
-            for k, v in dc.items():
-                dd[k].append(v)
-        d = {t.tag: {k: v[0] if len(v) == 1 else v for k, v in dd.items()}}
-    if t.attrib:
-        d[t.tag].update(('@' + k, v) for k, v in t.attrib.items())
-    if t.text:
-        text = t.text.strip()
-        if children or t.attrib:
-            if text:
-                d[t.tag]['#text'] = text
-        else:
-            d[t.tag] = text
-    return d
-
-
-def xml_to_values(l):
+# Hourly series read from the DWML parameters, by element tag and type (None for any type)
+dwml_series = [
+    ('temperature', 'hourly', 'temperature'),
+    ('temperature', 'dew point', 'dewPoint'),
+    ('wind-speed', 'sustained', 'windSpeed'),
+    ('wind-speed', 'gust', 'windGust'),
+    ('cloud-amount', None, 'cloud'),
+    ('direction', None, 'windDirection'),
+    ('hourly-qpf', None, 'rain'),
+]
+
+_xsi_nil = '{http://www.w3.org/2001/XMLSchema-instance}nil'
+
+
+def weather_condition(element):
     """
-    Return a list of values from a list of XML data potentially including null values.
+    Return the condition of a 'weather-conditions' XML element: the comma-separated weather types, or None.
     """
-    new = []
-    for element in l:
-        if isinstance(element, dict):
-            new.append(None)
-        else:
-            new.append(to_float(element))
-    return new
+    if element.get(_xsi_nil) == 'true':
+        return None
+    types = [value.get('weather-type') for value in element if value.tag == 'value' and value.get('weather-type')]
+    if len(types) > 0:
+        return ','.join(types)
+    text = (element.text or '').strip()
+    return text[:20] if text else None
 
 
-def xml_to_condition(l):
+def parse_dwml(source):
     """
-    Returns a list of values from a list of 'weather-condition' XML data.
+    Parse the hourly series of an NWS digital DWML document. The XML is streamed with iterparse, keeping only the
+    needed parameters, whose values go straight into arrays; the times are converted to UTC all at once.
+
+    :param source: file name or file object of the DWML document
+    :return: DataFrame of hourly values, indexed by timezone-unaware UTC time
     """
-    new = []
-    for element in l:
-        if isinstance(element, dict):
-            key = list(element.keys())[0]
-            if key.endswith('nil'):
-                new.append(None)
-            elif key == 'value':
-                if isinstance(element[key], list):
-                    new.append(','.join([t['@weather-type'] for t in element[key]]))
-                elif isinstance(element[key], dict):
-                    new.append(element[key]['@weather-type'])
-                else:
-                    new.append(str(element[key])[:20])
-            else:
-                new.append(None)
-        else:
-            try:
-                new.append(str(element)[:20])
-            except:
-                new.append(None)
-    return new
+    times = []
+    values = {}
+    conditions = None
+    series_name = None
+    series_element = None
+    series_values = None
+    in_parameters = False
+    for event, element in eTree.iterparse(source, events=('start', 'end')):
+        tag = element.tag
+        if event == 'start':
+            if tag == 'parameters':
+                in_parameters = True
+            elif tag == 'weather' and in_parameters:
+                conditions = []
+            elif in_parameters and series_name is None:
+                for series_tag, series_type, name in dwml_series:
+                    if tag == series_tag and (series_type is None or element.get('type') == series_type) \
+                            and name not in values:
+                        series_name = name
+                        series_element = element
+                        series_values = []
+                        break
+            continue
+
+        # End of an element: collect what is needed, then discard it
+        if tag == 'start-valid-time':
+            times.append(element.text)
+        elif tag == 'value' and series_name is not None:
+            series_values.append(None if element.get(_xsi_nil) == 'true' else element.text)
+        elif tag == 'value' and conditions is not None:
+            # Needed by the enclosing weather-conditions element
+            continue
+        elif tag == 'weather-conditions' and conditions is not None:
+            conditions.append(weather_condition(element))
+        elif element is series_element:
+            numbers = pd.to_numeric(pd.Series(series_values, dtype=object), errors='coerce')
+            values[series_name] = numbers.values.astype(np.float64)
+            series_name = None
+            series_element = None
+        elif tag == 'parameters':
+            in_parameters = False
+        element.clear()
+
+    # De-localize the times so we can do an explicit datetime comparison
+    date_times = dates_to_utc(times)
+    hourly = pd.DataFrame({'DateTime': date_times}, index=date_times.rename('datetime_index'))
+    for series_tag, series_type, name in dwml_series:
+        if name in values:
+            hourly[name] = values[name]
+    if 'windSpeed' in hourly:
+        hourly['windSpeed'] = mph_to_kt(hourly['windSpeed'])
+    if 'windGust' in hourly:
+        hourly['windGust'] = mph_to_kt(hourly['windGust'])
+    if conditions is not None:
+        hourly['condition'] = conditions
+    return hourly
 
 
 def wind_speed_interpreter(wind):
@@ -99,11 +129,12 @@ def wind_speed_interpreter(wind):
     return new_wind
 
 
-def get_nws_forecast(config, stid, lat, lon, forecast_date):
+def get_nws_forecast(config, model, stid, lat, lon, forecast_date):
     """
     Retrieve current NWS forecast for a point location.
 
     :param config:
+    :param model: str: model name in config
     :param stid: str: station ID
     :param lat: float: latitude
     :param lon: float: longitude
@@ -111,44 +142,8 @@ def get_nws_forecast(config, stid, lat, lon, forecast_date):
     :return:
     """
     hourly_url = 'http://forecast.weather.gov/MapClick.php?lat=%f&lon=%f&FcstType=digitalDWML'
-    response = requests.get(hourly_url % (lat, lon))
-    hourly_xml = eTree.fromstring(response.text)
-    hourly_dict = etree_to_dict(hourly_xml)
-
-    # Create a DataFrame for hourly data
-    hourly = pd.DataFrame()
-    hourly['DateTime'] = hourly_dict['dwml']['data']['time-layout']['start-valid-time']
-    # De-localize the starting time so we can do an explicit datetime comparison
-    hourly['DateTime'] = [localized_date_to_utc(parse_iso(hourly['DateTime'].iloc[j])) for j in
-                          range(len(hourly['DateTime']))]
-    hourly['DateTime'] = [hourly['DateTime'].iloc[j].to_pydatetime().replace(tzinfo=None) for j in
-                          range(len(hourly['DateTime']))]
-    hourly['datetime_index'] = hourly['DateTime']
-    hourly.set_index('datetime_index', inplace=True)
-    parameters = hourly_dict['dwml']['data']['parameters']
-
-    # Get the temperatures
-    for element in parameters['temperature']:
-        if element['@type'] == 'hourly':
-            hourly['temperature'] = xml_to_values(element['value'])
-        elif element['@type'] == 'dew point':
-            hourly['dewPoint'] = xml_to_values(element['value'])
-    # Get the winds
-    for element in parameters['wind-speed']:
-        if element['@type'] == 'sustained':
-            hourly['windSpeed'] = xml_to_values(element['value'])
-            hourly['windSpeed'] = mph_to_kt(hourly['windSpeed'])
-        elif element['@type'] == 'gust':
-            hourly['windGust'] = xml_to_values(element['value'])
-            hourly['windGust'] = mph_to_kt(hourly['windGust'])
-    # Get other parameters
-    hourly['cloud'] = xml_to_values(parameters['cloud-amount']['value'])
-    hourly['windDirection'] = xml_to_values(parameters['direction']['value'])
-    hourly['rain'] = xml_to_values(parameters['hourly-qpf']['value'])
-    try:
-        hourly['condition'] = xml_to_condition(parameters['weather']['weather-conditions'])
-    except:
-        pass
+    response = http.model_get(config, model, hourly_url % (lat, lon))
+    hourly = parse_dwml(BytesIO(response.content))
 
     # Aggregate daily values from hourly series
     forecast_start = forecast_date.replace(hour=6)
@@ -168,7 +163,7 @@ def get_nws_forecast(config, stid, lat, lon, forecast_date):
     point = '%0.3f,%0.3f' % (lat, lon)
     # Retrieve daily forecast
     daily_url = '%s/%s/forecast' % (api_url, point)
-    response = requests.get(daily_url)
+    response = http.model_get(config, model, daily_url)
     # Test for an error HTTP response. If there is an error response, omit the daily part.
     try:
         response.raise_for_status()
@@ -215,6 +210,6 @@ def main(config, model, stid, forecast_date):
         raise(KeyError('nws: missing or invalid latitude or longitude for station %s' % stid))
 
     # Get forecast
-    forecast = get_nws_forecast(config, stid, lat, lon, forecast_date)
+    forecast = get_nws_forecast(config, model, stid, lat, lon, forecast_date)
 
     return forecast
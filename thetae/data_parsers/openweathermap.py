@@ -9,9 +9,11 @@ Retrieve OpenWeatherMap forecast data.
 """
 
 from thetae import Forecast
-from thetae.util import date_to_datetime, mm_to_in, mph_to_kt, dewpoint_from_t_rh
+from thetae.util import date_to_datetime, mm_to_in, mph_to_kt
+from thetae.data import dewpoint_from_t_rh
 from datetime import datetime, timedelta
 import requests
+from thetae import http
 import pandas as pd
 import numpy as np
 
@@ -37,7 +39,7 @@ def get_parameter(value, param, is_list=False):
     return new_value
 
 
-def get_owm_forecast(stid, lat, lon, api_key, forecast_date):
+def get_owm_forecast(config, model, stid, lat, lon, api_key, forecast_date):
 
     # Retrieve data
     api_url = 'http://api.openweathermap.org/data/2.5/forecast'
@@ -47,7 +49,7 @@ def get_owm_forecast(stid, lat, lon, api_key, forecast_date):
         'lon': lon,
         'units': 'imperial',
     }
-    response = requests.get(api_url, params=api_options)
+    response = http.model_get(config, model, api_url, params=api_options)
     owm_data = response.json()
     # Raise error for invalid HTTP response
     try:
@@ -128,6 +130,6 @@ def main(config, model, stid, forecast_date):
         raise KeyError('openweathermap: no api_key parameter defined for model %s in config!' % model)
 
     # Get forecast
-    forecast = get_owm_forecast(stid, lat, lon, api_key, forecast_date)
+    forecast = get_owm_forecast(config, model, stid, lat, lon, api_key, forecast_date)
 
     return forecast
@@ -9,9 +9,11 @@ Retrieve forecasts from the new weather.com API.
 """
 
 from thetae import Forecast
-from thetae.util import epoch_time_to_datetime, mph_to_kt, dewpoint_from_t_rh
+from thetae.util import mph_to_kt
+from thetae.data import dates_to_utc, dewpoint_from_t_rh
 from datetime import datetime, timedelta
 import requests
+from thetae import http
 import pandas as pd
 
 default_model_name = 'Weather Channel'
@@ -26,7 +28,7 @@ def dn_to_timedelta(s):
         return s
 
 
-def get_twc_forecast(stid, api_key, forecast_date):
+def get_twc_forecast(config, model, stid, api_key, forecast_date):
 
     # retrieve api json data
     api_url = 'https://api.weather.com/v3/wx/forecast/daily/5day'
@@ -37,7 +39,7 @@ def get_twc_forecast(stid, api_key, forecast_date):
         'apiKey': api_key,
         'icaoCode': stid
     }
-    response = requests.get(api_url, params=api_options)
+    response = http.model_get(config, model, api_url, params=api_options)
     twc_data = response.json()
     # Raise error for invalid HTTP response
     try:
@@ -49,7 +51,7 @@ def get_twc_forecast(stid, api_key, forecast_date):
     # The data has a 'daypart' section which has a time series of day/night pairs. This is useful for wind and
     # precipitation information, but we have to make some assumptions about the datetime to use it.
     twc_df = pd.DataFrame(twc_data['daypart'][0])
-    valid_days = [epoch_time_to_datetime(d) for d in twc_data['validTimeUtc'] for _ in range(2)]
+    valid_days = dates_to_utc([d for d in twc_data['validTimeUtc'] for _ in range(2)])
     twc_df['DateTime'] = pd.Series(valid_days) + twc_df['dayOrNight'].apply(dn_to_timedelta)
     if twc_df['dayOrNight'][0] is None:
         twc_df.drop(0, axis=0, inplace=True)
@@ -99,6 +101,6 @@ def main(config, model, stid, forecast_date):
         raise KeyError('wunderground.py: no api_key parameter defined for model %s in config!' % model)
 
     # Get forecast
-    forecast = get_twc_forecast(stid, api_key, forecast_date)
+    forecast = get_twc_forecast(config, model, stid, api_key, forecast_date)
 
     return forecast
@@ -16,32 +16,30 @@ from datetime import datetime, timedelta
 import pandas as pd
 import numpy as np
 from bs4 import BeautifulSoup
-from thetae.util import get_codes, c_to_f, mph_to_kt, wind_dir_to_deg, dewpoint_from_t_rh
+from thetae.util import c_to_f, mph_to_kt, wind_dir_to_deg
+from thetae.data import get_codes, dewpoint_from_t_rh
 from selenium import webdriver
-try:
-    from urllib.request import Request, urlopen
-except ImportError:
-    from urllib2 import Request, urlopen
+from thetae import http
 
 default_model_name = 'UKMET'
 
-# Header that is needed for urllib2 to work properly
+# Header that is needed for the UKMET site to work properly
 hdr = {
     'User-Agent': 'Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.11 (KHTML, like Gecko) Chrome/23.0.1271.64 '
                   'Safari/537.11',
     'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8',
     'Accept-Charset': 'ISO-8859-1,utf-8;q=0.7,*;q=0.3',
-    'Accept-Encoding': 'none',
     'Accept-Language': 'en-US,en;q=0.8',
-    'Connection': 'keep-alive'
 }
 
 
 # needs ukmet code
-def get_ukmet_forecast(stid, ukmet_code, forecast_date):
+def get_ukmet_forecast(config, model, stid, ukmet_code, forecast_date):
     """
     Retrieve UKMET data. 
 
+    :param config:
+    :param model: model name in config
     :param stid: station ID
     :param ukmet_code: site-specific URL code from ukmet.codes
     :param forecast_date: datetime of day to forecast
@@ -49,9 +47,9 @@ def get_ukmet_forecast(stid, ukmet_code, forecast_date):
     """
     # Retrieve the model data
     url = 'https://www.metoffice.gov.uk/public/weather/forecast/%s' % ukmet_code
-    req = Request(url, headers=hdr)
-    response = urlopen(req)
-    page = response.read().decode('utf-8', 'ignore')
+    response = http.model_get(config, model, url, headers=hdr)
+    response.raise_for_status()
+    page = response.content.decode('utf-8', 'ignore')
     soup = BeautifulSoup(page, 'lxml')
 
     # Find UTC offset and current time in HTML
@@ -197,6 +195,6 @@ def main(config, model, stid, forecast_date):
         raise
 
     # Get forecast
-    forecast = get_ukmet_forecast(stid, ukmet_code, forecast_date)
+    forecast = get_ukmet_forecast(config, model, stid, ukmet_code, forecast_date)
 
     return forecast
@@ -5,7 +5,7 @@
 #
 
 """
-Retrieve USL forecast data. Unfortunately need to use urlopen to run javascript.
+Retrieve USL forecast data.
 
 After code by Luke Madaus.
 """
@@ -16,10 +16,8 @@ from datetime import datetime, timedelta
 import re
 import pandas as pd
 import numpy as np
-try:
-    from urllib.request import urlopen, Request, HTTPError, URLError
-except ImportError:
-    from urllib2 import urlopen, Request, HTTPError, URLError
+from thetae import http
+from requests.exceptions import HTTPError
 
 default_model_name = 'USL'
 
@@ -43,35 +41,36 @@ def check_if_usl_forecast_exists(config, stid, run, forecast_date):
     run_date = (forecast_date - timedelta(days=1)).replace(hour=int(run))
     run_strtime = run_date.strftime('%Y%m%d_%H')
     api_url = 'http://www.microclimates.org/forecast/{}/'.format(stid)
-    req = Request(api_url)
+    response = http.get(api_url)
     try:
-        response = urlopen(req)
+        response.raise_for_status()
     except HTTPError:
         if config['debug'] > 9:
             print("usl: forecast for %s at run time %s doesn't exist" % (stid, run_date))
         raise
-    page = response.read().decode('utf-8', 'ignore')
+    page = response.content.decode('utf-8', 'ignore')
 
     # Look for string of USL run time in the home menu for this station ID (equal to -1 if not found)
     if page.find(run_strtime) == -1:
         if config['debug'] > 9:
             print("usl: forecast for %s at run time %s hasn't run yet" % (stid, run_date))
-        raise URLError("- usl: no correct date/time choice")
+        raise ValueError("- usl: no correct date/time choice")
 
 
-def get_usl_forecast(config, stid, run, forecast_date):
+def get_usl_forecast(config, model, stid, run, forecast_date):
 
     # Retrieve data
     api_url = 'http://www.microclimates.org/forecast/%s/%s.html'
     run_date = (forecast_date - timedelta(days=1)).replace(hour=int(run))
     get_url = api_url % (stid, datetime.strftime(run_date, '%Y%m%d_%H'))
+    response = http.model_get(config, model, get_url)
     try:
-        response = urlopen(get_url)
+        response.raise_for_status()
     except HTTPError:
         if config['debug'] > 9:
             print("usl: forecast for %s at run time %s doesn't exist" % (stid, run_date))
         raise
-    usl_data = response.read().decode('utf-8')
+    usl_data = response.content.decode('utf-8')
 
     # Create a DataFrame
     forecast_start = forecast_date.replace(hour=6)
@@ -155,7 +154,7 @@ def main(config, model, stid, forecast_date):
 
     # Check if forecast exists, retrieve if it does exists, otherwise raise error
     check_if_usl_forecast_exists(config, stid, run_time[:-1], forecast_date)
-    forecast = get_usl_forecast(config, stid, run_time[:-1], forecast_date)
+    forecast = get_usl_forecast(config, model, stid, run_time[:-1], forecast_date)
     return forecast
 
 
@@ -182,7 +181,7 @@ def historical(config, model, stid, forecast_dates):
     for forecast_date in forecast_dates:
         try:
             check_if_usl_forecast_exists(config, stid, run_time[:-1], forecast_date)
-            forecast = get_usl_forecast(config, stid, run_time[:-1], forecast_date)
+            forecast = get_usl_forecast(config, model, stid, run_time[:-1], forecast_date)
             forecasts.append(forecast)
         except BaseException as e:
             if int(config['debug']) > 9:
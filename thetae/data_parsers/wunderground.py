@@ -9,9 +9,11 @@ Retrieve Weather Underground forecast data.
 """
 
 from thetae import Forecast
-from thetae.util import epoch_time_to_datetime, mph_to_kt, inhg_to_mb
+from thetae.util import mph_to_kt, inhg_to_mb
+from thetae.data import dates_to_utc
 from datetime import datetime, timedelta
 import requests
+from thetae import http
 import pandas as pd
 import numpy as np
 
@@ -24,11 +26,8 @@ def convert_fcttime(fcttime_series, timezone=None):
     """
     Convert API's FCTTIME from epoch time to UTC time
     """
-    new_fcttime_series = fcttime_series.copy()
-    for j in range(len(fcttime_series)):
-        new_fcttime_series.iloc[j] = int(fcttime_series.iloc[j]['epoch'])
-        new_fcttime_series.iloc[j] = epoch_time_to_datetime(new_fcttime_series.iloc[j], timezone)
-    return new_fcttime_series
+    epoch_times = [int(fcttime['epoch']) for fcttime in fcttime_series]
+    return pd.Series(dates_to_utc(epoch_times, timezone), index=fcttime_series.index)
 
 
 def get_english_units(value):
@@ -66,13 +65,13 @@ def get_timezone(series):
     return timezone
 
 
-def get_wunderground_forecast(stid, api_key, forecast_date):
+def get_wunderground_forecast(config, model, stid, api_key, forecast_date):
 
     # retrieve api json data
     api_url = 'https://api.wunderground.com/api/%s/hourly/forecast/q/%s.json'
     api_options = {'features': 'hourly,forecast'}
     json_url = api_url % (api_key, stid)
-    response = requests.get(json_url, params=api_options)
+    response = http.model_get(config, model, json_url, params=api_options)
     wunderground_data = response.json()
     # Raise error for invalid HTTP response
     try:
@@ -136,6 +135,6 @@ def main(config, model, stid, forecast_date):
         raise KeyError('wunderground.py: no api_key parameter defined for model %s in config!' % model)
 
     # Get forecast
-    forecast = get_wunderground_forecast(stid, api_key, forecast_date)
+    forecast = get_wunderground_forecast(config, model, stid, api_key, forecast_date)
 
     return forecast
@@ -10,8 +10,14 @@ Functions for interfacing with SQL databases.
 
 import sqlite3
 import os
+import threading
+import numpy as np
 import pandas as pd
-from thetae.util import get_object, TimeSeries, Daily, Forecast, date_to_datetime, date_to_string, last_leap_year
+from contextlib import contextmanager
+from thetae.metrics import measure, add
+from thetae.trace import span
+from thetae.util import get_object, date_to_datetime, date_to_string, last_leap_year
+from thetae.data import TimeSeries, Daily, Forecast
 from datetime import datetime, timedelta
 from builtins import str
 
@@ -20,11 +26,37 @@ from builtins import str
 # Connection and utility functions
 # ==================================================================================================================== #
 
+# Open connections are kept for the rest of the run, one per database file in each thread. Connections are also kept in
+# a global list so that close_all() can close them from any thread.
+_local = threading.local()
+_lock = threading.Lock()
+_all_connections = []
+_generation = [0]
+
+# Optional lock shared by several processes writing to the same databases
+_write_lock = None
+
+# Column names of tables, by (database, table)
+_table_columns = {}
+
+# Climatology calendars, by (database, station ID)
+_climo_calendars = {}
+
+default_pragmas = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+}
+
+
 def connection(config, database):
     """
-    Initializes a connection to the database. We only need to check for errors in the config file here, because the
+    Returns a connection to the database. Connections are re-used for the whole run by the thread which opened them;
+    they should not be closed by the caller. We only need to check for errors in the config file here, because the
     main program will try to establish a connection before making any further progress.
 
+    New connections use the SQLite pragmas 'journal_mode' (default WAL) and 'synchronous' (default NORMAL), which may be
+    changed for each database in the config.
+
     :param config:
     :param database: str: name of database
     :return: sqlite3 database connection object
@@ -51,16 +83,151 @@ def connection(config, database):
         print('Error: database name error in config file')
         return
 
+    # Re-use an open connection, unless close_all has been called since it was opened
+    if getattr(_local, 'generation', None) != _generation[0]:
+        _local.connections = {}
+        _local.depth = {}
+        _local.generation = _generation[0]
+    if db_name in _local.connections:
+        return _local.connections[db_name]
+
     # Establish a connection
     try:
-        conn = sqlite3.connect(db_name)
+        conn = sqlite3.connect(db_name, timeout=30., check_same_thread=False)
+        for pragma in default_pragmas.keys():
+            value = config['Databases'][database].get(pragma, default_pragmas[pragma])
+            if config['debug'] > 50:
+                print('db.connection: setting %s = %s' % (pragma, value))
+            conn.execute('PRAGMA %s = %s;' % (pragma, value))
     except:
         print('Error connecting to database %s' % db_name)
         return
 
+    _local.connections[db_name] = conn
+    with _lock:
+        _all_connections.append(conn)
     return conn
 
 
+def table_columns(config, database, table):
+    """
+    Returns the upper-case column names of a table. These are cached until the next db.init or db.remove.
+
+    :param config:
+    :param database: str: name of database
+    :param table: str: name of table
+    :return: list of column names
+    """
+    if (database, table) not in _table_columns:
+        conn = connection(config, database)
+        cursor = conn.cursor()
+        cursor.execute("PRAGMA table_info(%s);" % table)
+        _table_columns[(database, table)] = [c[1].upper() for c in cursor.fetchall()]
+    return _table_columns[(database, table)]
+
+
+def close_all():
+    """
+    Close all open database connections, in all threads. Any open transactions are committed. This should be called at
+    the end of a run and before forking new processes.
+    """
+    with _lock:
+        for conn in _all_connections:
+            try:
+                conn.commit()
+                conn.close()
+            except sqlite3.Error:
+                pass
+        del _all_connections[:]
+        _generation[0] += 1
+
+
+def set_write_lock(lock):
+    """
+    Set a lock, e.g., a multiprocessing.Lock, which is held for every write and transaction, so that processes sharing
+    it write to the databases one at a time.
+    """
+    global _write_lock
+    _write_lock = lock
+
+
+@contextmanager
+def _locked():
+    if _write_lock is None:
+        yield
+    else:
+        with _write_lock:
+            yield
+
+
+def _in_transaction(conn):
+    return _local.depth.get(id(conn), 0) > 0
+
+
+@contextmanager
+def transaction(config, database):
+    """
+    Context manager which groups all writes to database in the current thread into a single transaction, which is
+    committed when the outermost transaction block exits, or rolled back if it exits with an exception. Blocks may be
+    nested.
+
+    :param config:
+    :param database: str: name of database
+    """
+    conn = connection(config, database)
+    if conn is None:
+        raise IOError('Error: db.transaction cannot connect to database %s' % database)
+    key = id(conn)
+    if _local.depth.get(key, 0) > 0:
+        _local.depth[key] += 1
+        try:
+            yield conn
+        finally:
+            _local.depth[key] -= 1
+        return
+
+    # The outermost transaction holds the write lock until it is committed
+    with _locked(), span('transaction %s' % database, 'db'):
+        _local.depth[key] = 1
+        try:
+            yield conn
+        except BaseException:
+            if config['debug'] > 9:
+                print('db.transaction: rolling back transaction on %s' % database)
+            conn.rollback()
+            raise
+        else:
+            if config['debug'] > 9:
+                print('db.transaction: committing transaction on %s' % database)
+            with measure('db', 'commit', database=database):
+                conn.commit()
+        finally:
+            _local.depth[key] = 0
+
+
+def index_name(table, columns):
+    """
+    Returns the name of the index on columns of table.
+    """
+    return '%s_IDX_%s' % (table, '_'.join([c.upper() for c in columns]))
+
+
+def create_indexes(config, cursor, table, indexes):
+    """
+    Creates the secondary indexes on table, if they do not already exist.
+
+    :param config:
+    :param cursor: sqlite3 cursor
+    :param table: str: name of table
+    :param indexes: list: list of tuples of column names for each index
+    """
+    for columns in indexes:
+        if config['debug'] > 50:
+            print('db.init: checking index on %s (%s)' % (table, ', '.join(columns)))
+        cursor.execute("CREATE INDEX IF NOT EXISTS %s ON %s (%s);" % (index_name(table, columns), table,
+                                                                       ', '.join(columns)))
+
+
 def init(config, reset_old=False):
     """
     Initializes new station IDs in the databases. Returns a list of all sites included in config that require historical
@@ -70,11 +237,13 @@ def init(config, reset_old=False):
     :param reset_old: if True, erases tables if they are too old
     """
     add_sites = []
+    _table_columns.clear()
     for data_binding in config['DataBinding'].keys():
         # Open the database and schema
         schema_name = config['DataBinding'][data_binding]['schema']
         database = config['DataBinding'][data_binding]['database']
         schema = get_object(schema_name).schema
+        schema_indexes = getattr(get_object(schema_name), 'indexes', {})
         conn = connection(config, database)
         if conn is None:
             raise IOError('Error: db.init cannot connect to database %s' % database)
@@ -134,13 +303,16 @@ def init(config, reset_old=False):
                             if config['debug'] > 0:
                                 print('db.init: %s table is old, adding to historical' % table)
 
+                # Create any secondary indexes for the table; this also adds new indexes to existing databases
+                create_indexes(config, cursor, table, schema_indexes.get(list(schema.keys())[t], []))
+
             # Lastly, add the site if we need to rerun historical data
             if add_site and stid not in add_sites:
                 add_sites.append(stid)
             elif config['debug'] > 0:
                 print('db.init: nothing to do for station %s' % stid)
 
-        conn.close()
+        conn.commit()
 
     return add_sites
 
@@ -152,6 +324,8 @@ def remove(config, stid):
     :param stid: str: station ID
     :return:
     """
+    _table_columns.clear()
+    _climo_calendars.clear()
     for data_binding in config['DataBinding'].keys():
         # Open the database and schema
         schema_name = config['DataBinding'][data_binding]['schema']
@@ -180,7 +354,7 @@ def remove(config, stid):
                     print('db.remove: deleting table %s' % table)
                 cursor.execute("DROP TABLE %s;" % table)
 
-        conn.close()
+        conn.commit()
 
 
 # ==================================================================================================================== #
@@ -214,7 +388,7 @@ def _write(config, values, database, table, replace=True):
             raise ValueError('db._write: all rows of values must have the same length.')
     # Find the length of the tuple formatter for the row length
     value_formatter = ('(' + '?,' * row_len)[:-1] + ')'
-    # Open a database connection and execute and commit
+    # Get the database connection and execute. Commit unless we are in a transaction.
     conn = connection(config, database)
     cursor = conn.cursor()
     if replace:
@@ -229,9 +403,14 @@ def _write(config, values, database, table, replace=True):
         print('db._write: committing values to %s table %s' % (database, table))
     if config['debug'] > 50:
         print(values)
-    cursor.executemany("%s INTO %s VALUES %s;" % (sql_cmd, table, value_formatter), values)
-    conn.commit()
-    conn.close()
+    with measure('db', 'write', table=table):
+        add('rows', len(values))
+        if _in_transaction(conn):
+            cursor.executemany("%s INTO %s VALUES %s;" % (sql_cmd, table, value_formatter), values)
+        else:
+            with _locked():
+                cursor.executemany("%s INTO %s VALUES %s;" % (sql_cmd, table, value_formatter), values)
+                conn.commit()
 
 
 def _read(config, database, table, model=None, start_date=None, end_date=None):
@@ -264,23 +443,30 @@ def _read(config, database, table, model=None, start_date=None, end_date=None):
     if config['debug'] > 9:
         print('db._read: getting data from %s for %s to %s' % (table, start, end))
 
-    # Open a database connection
+    # Get the database connection
     conn = connection(config, database)
     cursor = conn.cursor()
 
     # Fetch the data
-    if model is None:
-        sql_line = """SELECT * FROM %s WHERE DATETIME>=? AND DATETIME<=?
-                       ORDER BY DATETIME ASC;""" % table
-        cursor.execute(sql_line, (start, end))
-    else:
-        sql_line = """SELECT * FROM %s WHERE DATETIME>=? AND DATETIME<=?
-                       AND MODEL=? ORDER BY DATETIME ASC""" % table
-        cursor.execute(sql_line, (start, end, model.upper()))
-    values = cursor.fetchall()
+    with measure('db', 'read', table=table):
+        if model is None:
+            sql_line = """SELECT * FROM %s WHERE DATETIME>=? AND DATETIME<=?
+                           ORDER BY DATETIME ASC;""" % table
+            cursor.execute(sql_line, (start, end))
+        else:
+            sql_line = """SELECT * FROM %s WHERE DATETIME>=? AND DATETIME<=?
+                           AND MODEL=? ORDER BY DATETIME ASC""" % table
+            cursor.execute(sql_line, (start, end, model.upper()))
+        values = cursor.fetchall()
     if config['debug'] > 50:
         print('db._read: fetched the following values')
         print(values)
+        # Check that the query uses an index rather than a table scan
+        params = (start, end) if model is None else (start, end, model.upper())
+        cursor.execute('EXPLAIN QUERY PLAN ' + sql_line, params)
+        print('db._read: query plan:')
+        for plan in cursor.fetchall():
+            print('    %s' % plan[-1])
 
     # Check that we have data
     if len(values) == 0:
@@ -289,12 +475,10 @@ def _read(config, database, table, model=None, start_date=None, end_date=None):
         return
 
     # Get column names
-    cursor.execute("PRAGMA table_info(%s);" % table)
-    columns = [c[1].upper() for c in cursor.fetchall()]
+    columns = table_columns(config, database, table)
     if config['debug'] > 50:
         print('db._read: fetched the following column names')
         print(columns)
-    conn.close()  # Done with db
 
     # Convert to DataFrame and create TimeSeries
     data = pd.DataFrame(values)
@@ -323,35 +507,46 @@ def writeTimeSeries(config, timeseries, data_binding, table_type):
     :param table_type: str: type of table
     :return:
     """
+    def to_float(value):
+        """
+        Converts a single value to float if possible
+        """
+        try:
+            return float(value)
+        except (TypeError, ValueError):
+            return value
+
     def hourly_to_row(hourly, model, cols):
         """
-        Converts an hourly timeseries to sql rows
+        Converts an hourly timeseries to sql rows. The conversion is done one column at a time: the datetime column is
+        formatted to strings at once, and other columns are cast to float, falling back to converting each value only
+        for columns that are not entirely numeric, such as the weather condition.
         """
         if config['debug'] > 50:
             print('db.writeTimeSeries: converting timeseries data to SQL rows')
-        sql = []
-        hourly.columns = [c.upper() for c in hourly.columns]
-        cols = [c.upper() for c in cols]
-        for pd_row in hourly.itertuples():
-            try:
-                datestr = date_to_string(pd_row.DATETIME.to_pydatetime())
-            except TypeError:
-                datestr = pd_row.DATETIME
-            row = []
-            for col in cols:
+        data_columns = {c.upper(): c for c in hourly.columns}
+        num_rows = len(hourly.index)
+        sql_columns = []
+        for col in [c.upper() for c in cols]:
+            if col == 'PRIMARY KEY':
+                continue
+            elif col == 'MODEL':
+                values = [model] * num_rows
+            elif col not in data_columns:
+                values = [None] * num_rows
+            else:
+                column = hourly[data_columns[col]]
                 if col == 'DATETIME':
-                    row.append(datestr)
-                elif col == 'MODEL':
-                    row.append(model)
-                elif col != 'PRIMARY KEY':
-                    try:
-                        row.append(float(getattr(pd_row, col)))
-                    except AttributeError:
-                        row.append(None)
-                    except (TypeError, ValueError):
-                        row.append(getattr(pd_row, col))
-            sql.append(tuple(row))
-        return sql
+                    if pd.api.types.is_datetime64_any_dtype(column):
+                        values = column.dt.strftime('%Y-%m-%d %H:%M:%S').tolist()
+                    else:
+                        values = [date_to_string(d) for d in column.tolist()]
+                elif pd.api.types.is_numeric_dtype(column):
+                    values = column.to_numpy(dtype=float).tolist()
+                else:
+                    values = [to_float(v) for v in column.tolist()]
+            sql_columns.append(values)
+        return list(zip(*sql_columns))
 
     # Get the database and the names of columns in the schema
     database = config['DataBinding'][data_binding]['database']
@@ -449,6 +644,8 @@ def writeDaily(config, daily, data_binding, table_type):
     if config['debug'] > 9:
         print('db.writeDaily: writing data to table %s' % table)
     _write(config, daily_sql, database, table)
+    if table_type.upper() == 'CLIMO':
+        _climo_calendars.pop((database, stid.upper()), None)
 
 
 def writeForecast(config, forecast):
@@ -461,30 +658,33 @@ def writeForecast(config, forecast):
     """
     # Set the default database configuration
     data_binding = 'forecast'
+    database = config['DataBinding'][data_binding]['database']
     if config['debug'] > 9:
         print("db.writeForecast: writing forecast to '%s' data binding" % data_binding)
 
-    # The daily forecast part
-    table_type = 'DAILY_FORECAST'
-    if type(forecast) is list:
-        daily = [f.daily for f in forecast]
-    else:
-        daily = forecast.daily
-    writeDaily(config, daily, data_binding, table_type)
+    # Write the daily and hourly parts in one transaction
+    with transaction(config, database):
+        # The daily forecast part
+        table_type = 'DAILY_FORECAST'
+        if type(forecast) is list:
+            daily = [f.daily for f in forecast]
+        else:
+            daily = forecast.daily
+        writeDaily(config, daily, data_binding, table_type)
 
-    # The timeseries forecast part
-    table_type = 'HOURLY_FORECAST'
-    if type(forecast) is list:
-        timeseries = [f.timeseries for f in forecast]
-    else:
-        timeseries = forecast.timeseries
-    # Allow for timeseries to be empty
-    try:
-        writeTimeSeries(config, timeseries, data_binding, table_type)
-    except ValueError as e:
-        if config['debug'] > 9:
-            print("db.writeForecast warning: did not write timeseries ('%s')" % str(e))
-        pass
+        # The timeseries forecast part
+        table_type = 'HOURLY_FORECAST'
+        if type(forecast) is list:
+            timeseries = [f.timeseries for f in forecast]
+        else:
+            timeseries = forecast.timeseries
+        # Allow for timeseries to be empty
+        try:
+            writeTimeSeries(config, timeseries, data_binding, table_type)
+        except ValueError as e:
+            if config['debug'] > 9:
+                print("db.writeForecast warning: did not write timeseries ('%s')" % str(e))
+            pass
 
 
 # ==================================================================================================================== #
@@ -578,6 +778,42 @@ def readDaily(config, stid, data_binding, table_type, model=None, start_date=Non
         return daily_list[0]
 
 
+def readDates(config, stid, data_binding, table_type, model=None, start_date=None, end_date=None):
+    """
+    Return a sorted list of the datetimes of all rows in a table between start_date and end_date, inclusive, for the
+    given model if it is not None. If both start_date and end_date are None, returns all datetimes in the table.
+
+    :param config:
+    :param stid: str: station ID
+    :param data_binding: str: name of database binding to read from
+    :param table_type: str: type of table
+    :param model: str: model name
+    :param start_date: datetime or str: starting date
+    :param end_date: datetime or str: ending date
+    :return: list of datetimes
+    """
+    database = config['DataBinding'][data_binding]['database']
+    table = '%s_%s' % (stid.upper(), table_type.upper())
+    sql_line = "SELECT DATETIME FROM %s WHERE 1" % table
+    params = []
+    if start_date is not None:
+        sql_line += " AND DATETIME>=?"
+        params.append(date_to_string(date_to_datetime(start_date)))
+    if end_date is not None:
+        sql_line += " AND DATETIME<=?"
+        params.append(date_to_string(date_to_datetime(end_date)))
+    if model is not None:
+        sql_line += " AND MODEL=?"
+        params.append(model.upper())
+    if config['debug'] > 9:
+        print('db.readDates: getting dates from %s' % table)
+
+    conn = connection(config, database)
+    cursor = conn.cursor()
+    cursor.execute(sql_line + " ORDER BY DATETIME ASC;", tuple(params))
+    return [date_to_datetime(row[0]) for row in cursor.fetchall()]
+
+
 def readForecast(config, stid, model, date, hour_start=6, hour_padding=6, no_hourly_ok=False):
     """
     Return a Forecast object from the main theta-e database for a given model and date. This is specifically designed
@@ -627,3 +863,131 @@ def readForecast(config, stid, model, date, hour_start=6, hour_padding=6, no_hou
     forecast.timeseries = timeseries
     forecast.daily = daily
     return forecast
+
+
+# ==================================================================================================================== #
+# Bulk reading functions for many models and dates
+# ==================================================================================================================== #
+
+def _read_models(config, database, table, models, start_date, end_date):
+    """
+    Return a pandas DataFrame of all rows in table for any of the models between start_date and end_date, inclusive,
+    from a single query. The MODEL column contains the model names as given in models. Returns an empty DataFrame with
+    the table columns if there are no data.
+
+    :param config:
+    :param database: str: name of database
+    :param table: str: name of table to read from
+    :param models: list: model names
+    :param start_date: datetime or str: starting date
+    :param end_date: datetime or str: ending date
+    :return: pandas DataFrame
+    """
+    models = list(models)
+    model_names = {model.upper(): model for model in models}
+    start = date_to_string(date_to_datetime(start_date))
+    end = date_to_string(date_to_datetime(end_date))
+    if config['debug'] > 9:
+        print('db._read_models: getting data from %s for %d models for %s to %s' % (table, len(models), start, end))
+
+    conn = connection(config, database)
+    cursor = conn.cursor()
+    sql_line = """SELECT * FROM %s WHERE MODEL IN (%s) AND DATETIME>=? AND DATETIME<=?
+                   ORDER BY MODEL ASC, DATETIME ASC;""" % (table, ','.join(['?'] * len(models)))
+    with measure('db', 'read', table=table):
+        cursor.execute(sql_line, tuple(model_names.keys()) + (start, end))
+        values = cursor.fetchall()
+    if config['debug'] > 50:
+        print('db._read_models: fetched %d rows' % len(values))
+
+    data = pd.DataFrame(values, columns=table_columns(config, database, table))
+    data['MODEL'] = data['MODEL'].map(model_names)
+    return data
+
+
+def readDailyForecasts(config, stid, models, start_date, end_date):
+    """
+    Return the daily forecasts for all given models and all dates between start_date and end_date, inclusive, as a
+    pandas DataFrame with columns DATETIME, MODEL, HIGH, LOW, WIND, and RAIN. Dates or models without forecasts have no
+    rows. This is much faster than calling readDaily or readForecast for each model and date.
+
+    :param config:
+    :param stid: str: station ID
+    :param models: list: model names
+    :param start_date: datetime or str: starting date
+    :param end_date: datetime or str: ending date
+    :return: pandas DataFrame
+    """
+    database = config['DataBinding']['forecast']['database']
+    table = '%s_DAILY_FORECAST' % stid.upper()
+    return _read_models(config, database, table, models, start_date, end_date)
+
+
+def readHourlyForecasts(config, stid, models, start_date, end_date):
+    """
+    Return the hourly forecasts for all given models between start_date and end_date, inclusive, as a pandas DataFrame
+    with the DATETIME and MODEL columns followed by the columns of the hourly forecast table. Models without forecasts
+    have no rows.
+
+    :param config:
+    :param stid: str: station ID
+    :param models: list: model names
+    :param start_date: datetime or str: starting date
+    :param end_date: datetime or str: ending date
+    :return: pandas DataFrame
+    """
+    database = config['DataBinding']['forecast']['database']
+    table = '%s_HOURLY_FORECAST' % stid.upper()
+    return _read_models(config, database, table, models, start_date, end_date)
+
+
+def _climo_calendar(config, stid):
+    """
+    Returns the climatology for a station as an array of shape (366, 4) of high, low, wind, and rain for each day of
+    the year last_leap_year(). Days without climatology are NaN. The array is read from the CLIMO table once and kept
+    until climatology is next written.
+    """
+    database = config['DataBinding']['forecast']['database']
+    year = last_leap_year()
+    key = (database, stid.upper())
+    if key in _climo_calendars and _climo_calendars[key][0] == year:
+        return _climo_calendars[key][1]
+
+    if config['debug'] > 9:
+        print('db._climo_calendar: loading climatology for %s' % stid)
+    calendar = np.full((366, 4), np.nan)
+    table = '%s_CLIMO' % stid.upper()
+    data = _read(config, database, table, start_date=datetime(year, 1, 1), end_date=datetime(year, 12, 31))
+    if data is not None:
+        day_of_year = (pd.to_datetime(data['DATETIME']) - datetime(year, 1, 1)).dt.days.to_numpy()
+        valid = (day_of_year >= 0) & (day_of_year < 366)
+        calendar[day_of_year[valid]] = data[['HIGH', 'LOW', 'WIND', 'RAIN']].to_numpy(dtype=float)[valid]
+    _climo_calendars[key] = (year, calendar)
+    return calendar
+
+
+def readClimo(config, stid, start_date, end_date):
+    """
+    Return a list of Daily objects of climatology at a station for every day between start_date and end_date,
+    inclusive. The climatology for each day is that of the same day in last_leap_year(), but the Daily date is the
+    requested date. Days without climatology have NaN values.
+
+    :param config:
+    :param stid: str: station ID
+    :param start_date: datetime or str: starting date
+    :param end_date: datetime or str: ending date
+    :return: list of Dailys
+    """
+    calendar = _climo_calendar(config, stid)
+    year = last_leap_year()
+    start_date = date_to_datetime(start_date)
+    end_date = date_to_datetime(end_date)
+    dailys = []
+    current_date = start_date
+    while current_date <= end_date:
+        day_of_year = (current_date.replace(year=year) - datetime(year, 1, 1)).days
+        daily = Daily(stid, current_date)
+        daily.set_values(*calendar[day_of_year])
+        dailys.append(daily)
+        current_date += timedelta(days=1)
+    return dailys
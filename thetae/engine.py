@@ -14,11 +14,27 @@ Step 3: retrieve forecast data; save to database
 Step 4: retrieve verification data; save to database
 Step 5: run any calculation services, such as calculations for verification scores
 Step 6: run plotting scripts, theta-e website scripts
+
+With the --daemon option, the engine instead stays running after steps 0-2 and runs steps 3-6 repeatedly according to
+the schedule in the config (see thetae.scheduler). The HTTP session, database connections, and cached data are kept
+between runs. SIGTERM or SIGINT stop the daemon after the service that is running finishes; SIGHUP reloads the config
+file and schedule.
 """
 
 import sys
 import os
+import signal
+import threading
+import multiprocessing
+from datetime import datetime
 import thetae
+import thetae.http
+import thetae.graph
+import thetae.metrics
+import thetae.profiling
+import thetae.trace
+import thetae.registry
+from thetae.scheduler import Scheduler
 from thetae.util import get_object, get_config
 from builtins import str
 import warnings
@@ -26,6 +42,9 @@ import warnings
 
 service_groups = list(thetae.all_service_groups)
 
+# The config in historical worker processes
+_worker_config = None
+
 
 def main(args):
     """
@@ -37,6 +56,12 @@ def main(args):
     config = get_config(args.config)
     if config['suppress_warnings']:
         warnings.filterwarnings('ignore')
+    config['resume'] = getattr(args, 'resume', False)
+
+    # Set up the shared HTTP session used by the data sources, profiling, and tracing
+    thetae.http.init(config)
+    thetae.profiling.init(config, getattr(args, 'profile', None))
+    thetae.trace.init(config, getattr(args, 'trace', False))
 
     # Create the site_data archive directory, if necessary.
     site_directory = '%s/site_data' % config['THETAE_ROOT']
@@ -56,6 +81,9 @@ def main(args):
     print('thetae.engine: running database initialization checks')
     add_sites = thetae.db.init(config)
 
+    # Resolve and check all services and drivers
+    thetae.registry.validate(config)
+
     # Check for backfill-historical sites
     if args.b_stid is not None:
         print('thetae.engine: running backfill of historical data')
@@ -64,8 +92,9 @@ def main(args):
             sites = config['Stations'].keys()
         else:
             sites = args.b_stid
-        for stid in sites:
-            historical(config, stid)
+        run_historical(config, args, sites)
+        thetae.trace.write(config)
+        thetae.db.close_all()
         sys.exit(0)
 
     # Check for database resets
@@ -76,34 +105,206 @@ def main(args):
             sys.exit(1)
         for stid in args.r_stid:
             thetae.db.remove(config, stid)
+        thetae.db.close_all()
         sys.exit(0)
 
     # Step 2: for each site in add_sites above, run historical data
-    for stid in add_sites:
-        historical(config, stid)
+    if len(add_sites) > 0:
+        run_historical(config, args, add_sites)
 
-    # Steps 3-6: run services!
-    for service_group in config['Engine']['Services'].keys():
-        # Make sure we have defined a group to do what this asks
-        if service_group not in service_groups:
-            print('thetae.engine warning: doing nothing for services in %s' % service_group)
-            continue
-        for service in config['Engine']['Services'][service_group]:
-            # Execute the service
+    # Steps 3-6: run services, once or as a daemon
+    if getattr(args, 'daemon', False):
+        daemon(config, args)
+    else:
+        run_services(config, get_services(config))
+
+    # Done with the database
+    thetae.db.close_all()
+
+
+def get_services(config, names=None):
+    """
+    Return the list of services to run for a list of service group names and/or service paths, in order, skipping
+    groups which are not in service_groups. If names is None, all service groups are used.
+    """
+    groups = config['Engine']['Services']
+    if names is None:
+        names = list(groups.keys())
+    services = []
+    for name in names:
+        if name in groups.keys():
+            # Make sure we have defined a group to do what this asks
+            if name not in service_groups:
+                print('thetae.engine warning: doing nothing for services in %s' % name)
+                continue
+            group_services = groups[name]
+            if not isinstance(group_services, list):
+                group_services = [group_services]
+            services.extend(group_services)
+        else:
+            services.append(name)
+    return services
+
+
+def run_services(config, services, stop=None):
+    """
+    Run the main function of each service, in the order given by their dependencies (see thetae.graph), and save the
+    timing metrics of the run (see thetae.metrics). If stop (a threading.Event) is given and becomes set, the
+    remaining services are skipped.
+    """
+    thetae.metrics.reset()
+    thetae.graph.run(config, services, stop=stop)
+    thetae.metrics.write(config)
+    thetae.trace.write(config)
+
+
+def daemon(config, args):
+    """
+    Run services repeatedly according to the config schedule until stopped by SIGTERM or SIGINT. SIGHUP reloads the
+    config.
+    """
+    stop = threading.Event()
+    wake = threading.Event()
+    reload_flag = []
+
+    def handle_stop(signum, frame):
+        print('thetae.engine: received signal %d, stopping' % signum)
+        stop.set()
+        wake.set()
+
+    def handle_reload(signum, frame):
+        print('thetae.engine: received signal %d, reloading config' % signum)
+        reload_flag.append(True)
+        wake.set()
+
+    signal.signal(signal.SIGTERM, handle_stop)
+    signal.signal(signal.SIGINT, handle_stop)
+    if hasattr(signal, 'SIGHUP'):
+        signal.signal(signal.SIGHUP, handle_reload)
+
+    scheduler = Scheduler(config)
+    print('thetae.engine: running as daemon with jobs %s' % ', '.join([job.name for job in scheduler.jobs]))
+    while not stop.is_set():
+        if len(reload_flag) > 0:
+            del reload_flag[:]
             try:
-                get_object(service).main(config)
+                new_config = get_config(args.config)
+                new_config['resume'] = config['resume']
+                new_scheduler = Scheduler(new_config)
             except BaseException as e:
-                print('thetae.engine warning: failed to run service %s' % service)
+                print('thetae.engine warning: failed to reload config; keeping the previous config')
                 print("*** Reason: '%s'" % str(e))
-                if config['traceback']:
-                    raise
+            else:
+                config = new_config
+                scheduler = new_scheduler
+                thetae.http.init(config)
+                thetae.profiling.init(config, getattr(args, 'profile', None))
+                thetae.trace.init(config, getattr(args, 'trace', False))
+                thetae.db.close_all()
+                add_sites = thetae.db.init(config)
+                if len(add_sites) > 0:
+                    run_historical(config, args, add_sites)
+
+        # Run the jobs which are due, then any jobs which run after them
+        queue = scheduler.due()
+        while len(queue) > 0 and not stop.is_set():
+            job = queue.pop(0)
+            print('thetae.engine: running job %s at %s' % (job.name, datetime.utcnow()))
+            run_services(config, get_services(config, job.services), stop=stop)
+            for next_job in scheduler.completed(job):
+                if next_job not in queue:
+                    queue.append(next_job)
+
+        # Sleep until the next job is due
+        next_time = scheduler.next_time()
+        if next_time is None:
+            print('thetae.engine: no timed jobs in schedule; stopping')
+            break
+        wait = (next_time - datetime.utcnow()).total_seconds()
+        if wait > 0:
+            if config['debug'] > 9:
+                print('thetae.engine: sleeping until %s' % next_time)
+            wake.wait(wait)
+            wake.clear()
+
+
+def run_historical(config, args, sites):
+    """
+    Run historical for each of the sites, and print a summary of any failures. If args.jobs is greater than 1, the
+    sites are processed in parallel by that many worker processes. Each worker reads the config file itself, and writes
+    to the database are serialized by a lock shared by all workers.
+    """
+    sites = list(sites)
+    num_jobs = min(getattr(args, 'jobs', 1) or 1, len(sites))
+    failures = {}
+
+    if num_jobs <= 1:
+        for s, stid in enumerate(sites):
+            failures[stid] = historical(config, stid)
+            print('thetae.engine: finished historical for %s (%d of %d)' % (stid, s + 1, len(sites)))
+    else:
+        print('thetae.engine: running historical for %d sites with %d processes' % (len(sites), num_jobs))
+        # Connections must not be shared with forked processes
+        thetae.db.close_all()
+        lock = multiprocessing.Lock()
+        pool = multiprocessing.Pool(num_jobs, initializer=_init_historical_worker,
+                                    initargs=(args.config, config['resume'], lock, service_groups,
+                                              getattr(args, 'profile', None), thetae.trace.enabled()))
+        try:
+            for s, (stid, site_failures, events) in enumerate(pool.imap_unordered(_historical_worker, sites)):
+                failures[stid] = site_failures
+                thetae.trace.add_events(*events)
+                print('thetae.engine: finished historical for %s (%d of %d)' % (stid, s + 1, len(sites)))
+            pool.close()
+        except BaseException:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+
+    # Summary of failures
+    num_failures = sum([len(f) for f in failures.values()])
+    if num_failures == 0:
+        print('thetae.engine: historical completed for all sites')
+        return
+    print('thetae.engine warning: %d historical services failed:' % num_failures)
+    for stid in sites:
+        for service, reason in failures[stid]:
+            print("    %s: %s ('%s')" % (stid, service, reason))
+
+
+def _init_historical_worker(config_file, resume, lock, groups, profile=None, trace=False):
+    """
+    Set up a worker process for run_historical.
+    """
+    global _worker_config, service_groups
+    _worker_config = get_config(config_file)
+    if _worker_config['suppress_warnings']:
+        warnings.filterwarnings('ignore')
+    _worker_config['resume'] = resume
+    service_groups = list(groups)
+    thetae.http.init(_worker_config)
+    thetae.profiling.init(_worker_config, profile)
+    thetae.trace.init(_worker_config, trace)
+    thetae.db.set_write_lock(lock)
+
+
+def _historical_worker(stid):
+    """
+    Run historical for a site in a worker process. Returns the site, its list of failures, and its trace events.
+    """
+    try:
+        return stid, historical(_worker_config, stid), thetae.trace.pop_events()
+    finally:
+        thetae.db.close_all()
 
 
 def historical(config, stid):
     """
-    Run services if they have a 'historical' attribute.
+    Run services if they have a 'historical' attribute. Returns a list of (service, reason) for services which failed.
     """
     global service_groups
+    failures = []
 
     for service_group in config['Engine']['Services'].keys():
         # Make sure we have defined a group to do what this asks
@@ -113,7 +314,8 @@ def historical(config, stid):
         for service in config['Engine']['Services'][service_group]:
             # Execute the service.
             try:
-                get_object(service).historical(config, stid)
+                with thetae.metrics.measure('historical', service, station=stid):
+                    get_object(service).historical(config, stid)
             except AttributeError:
                 if config['debug'] > 9:
                     print("thetae.engine warning: no 'historical' attribute for service %s" % service)
@@ -123,3 +325,6 @@ def historical(config, stid):
                 print("*** Reason: '%s'" % str(e))
                 if config['traceback']:
                     raise
+                failures.append((service, str(e)))
+
+    return failures
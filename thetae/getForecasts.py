@@ -8,18 +8,84 @@
 Service to get all forecasts specified in config. The main process is used to get the next day's forecast in accordance
 with the main engine process, while the historical process is used in the engine historical function to produce
 historical forecasts for valid sources.
+
+The main process runs once for all stations (it has no station_main, see thetae.graph), so that the retrievals for
+every station and model share one pool of threads and are written to the database in a single transaction.
 """
 
-from thetae.db import writeForecast
+from thetae.db import writeForecast, transaction, readDates
 from datetime import datetime, timedelta
 from thetae.util import get_object, config_date_to_datetime, to_bool
+from thetae.quota import QuotaExceededError
+from thetae import jobs
+from thetae.metrics import measure
+from thetae.registry import supports
+from thetae.http import cache_stats
 from builtins import str
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+# Data used and written by this service, for the engine's service graph (see thetae.graph)
+requires = []
+provides = ['forecast']
+
+
+def get_forecast(config, model, stid, forecast_date):
+    """
+    Retrieve a single Forecast from the driver for model at stid. Returns None if the driver fails, unless the config
+    traceback option is set, in which case the exception is raised. This function may be called from worker threads.
+    """
+    try:
+        driver = config['Models'][model]['driver']
+    except KeyError:
+        print('getForecasts warning: driver not specified for model %s' % model)
+        return
+    if config['debug'] > 0:
+        print('getForecasts: getting forecast from %s for %s' % (model, stid))
+
+    try:
+        # Each forecast has a function 'main' which returns a Forecast
+        with measure('driver', driver, model=model, station=stid):
+            forecast = get_object(driver).main(config, model, stid, forecast_date)
+        # Set the model name
+        forecast.set_model(model)
+    except QuotaExceededError as e:
+        print('getForecasts: deferring forecast from %s for %s' % (model, stid))
+        print("*** Reason: '%s'" % str(e))
+        return
+    except BaseException as e:
+        print('getForecasts: failed to get forecast from %s for %s' % (model, stid))
+        print("*** Reason: '%s'" % str(e))
+        if config['traceback']:
+            raise
+        return
+
+    return forecast
+
+
+def write_forecast(config, forecast):
+    """
+    Write a Forecast to the database, isolating any errors. Forecasts are never written by the retrieval worker threads.
+    """
+    try:
+        if config['debug'] > 9:
+            print('getForecasts: writing forecast to database')
+        writeForecast(config, forecast)
+    except BaseException as e:
+        print('getForecasts: failed to write forecast to database')
+        print("*** Reason: '%s'" % str(e))
+        if config['traceback']:
+            raise
 
 
 def main(config):
     """
     Main function. Iterates through sites and models and writes each to the 'forecast' database. The outer loop over
-    sites is more efficient for those APIs which have limited calls/minute.
+    sites is more efficient for those APIs which have limited calls/minute. Drivers which can retrieve data for many
+    stations at once do so first (see prepare).
+
+    If the config Engine option 'forecast_workers' is greater than 1, then the (station, model) retrievals are
+    dispatched to a pool of threads of that size. Once all the Forecasts are retrieved, the main thread writes them to
+    the database in a single transaction, so that the database is not locked for writing during retrieval.
     """
 
     # Figure out which day we are forecasting for: the next UTC day.
@@ -27,47 +93,113 @@ def main(config):
     forecast_date = (datetime(time_now.year, time_now.month, time_now.day) + timedelta(days=1))
     print('getForecasts: forecast date %s' % forecast_date)
 
-    # Go through the models in config
+    prepare(config)
+    num_workers = get_num_workers(config)
+
+    if num_workers <= 1:
+        forecasts = retrieve_sequential(config, forecast_date)
+    else:
+        forecasts = retrieve_concurrent(config, forecast_date, num_workers)
+    print_cache_stats(config)
+
+    # All forecasts from this run are written to the database in a single transaction
+    database = config['DataBinding']['forecast']['database']
+    with transaction(config, database):
+        for forecast in forecasts:
+            write_forecast(config, forecast)
+
+
+def prepare(config):
+    """
+    Before the forecasts for each station are retrieved, let drivers which can retrieve data for many stations at once
+    (those with a function 'prefetch') do so. Each driver's prefetch is called for each of its models with the list of
+    all stations; the driver's main function then uses the prefetched data.
+    """
+    time_now = datetime.utcnow()
+    forecast_date = (datetime(time_now.year, time_now.month, time_now.day) + timedelta(days=1))
+    stations = list(config['Stations'].keys())
+    for model in config['Models'].keys():
+        try:
+            driver = config['Models'][model]['driver']
+        except KeyError:
+            continue
+        try:
+            if not supports(driver, 'prefetch'):
+                continue
+            if config['debug'] > 9:
+                print('getForecasts: prefetching forecasts from %s for %d stations' % (model, len(stations)))
+            with measure('driver', driver, model=model, station='prefetch'):
+                get_object(driver).prefetch(config, model, stations, forecast_date)
+        except BaseException as e:
+            print('getForecasts: failed to prefetch forecasts from %s' % model)
+            print("*** Reason: '%s'" % str(e))
+            if config['traceback']:
+                raise
+
+
+def get_num_workers(config):
+    """
+    Return the number of threads used to retrieve forecasts, from the config Engine option 'forecast_workers'.
+    """
+    try:
+        return int(config['Engine']['forecast_workers'])
+    except (KeyError, ValueError):
+        return 1
+
+
+def retrieve_sequential(config, forecast_date):
+    """
+    Retrieve forecasts for each station and model in turn. Returns a list of the Forecasts retrieved.
+    """
+    forecasts = []
     for stid in config['Stations'].keys():
         print('getForecasts: getting forecasts for station %s' % stid)
-
-        # Get the forecast from the driver at each site
         for model in config['Models'].keys():
-            try:
-                driver = config['Models'][model]['driver']
-            except KeyError:
-                print('getForecasts warning: driver not specified for model %s' % model)
-                continue
-            if config['debug'] > 0:
-                print('getForecasts: getting forecast from %s' % model)
+            forecast = get_forecast(config, model, stid, forecast_date)
+            if forecast is not None:
+                forecasts.append(forecast)
+    return forecasts
 
-            try:
-                # Each forecast has a function 'main' which returns a Forecast
-                forecast = get_object(driver).main(config, model, stid, forecast_date)
-                # Set the model name
-                forecast.set_model(model)
-            except BaseException as e:
-                print('getForecasts: failed to get forecast from %s for %s' % (model, stid))
-                print("*** Reason: '%s'" % str(e))
-                if config['traceback']:
-                    raise
-                continue
-            # Write to the database
-            try:
-                if config['debug'] > 9:
-                    print('getForecasts: writing forecast to database')
-                writeForecast(config, forecast)
-            except BaseException as e:
-                print('getForecasts: failed to write forecast to database')
-                print("*** Reason: '%s'" % str(e))
-                if config['traceback']:
-                    raise
+
+def retrieve_concurrent(config, forecast_date, num_workers):
+    """
+    Retrieve forecasts with a pool of num_workers threads. Returns a list of the Forecasts retrieved.
+    """
+    # Keep the station-major order of submission so that rate-limited APIs see the same pattern.
+    print('getForecasts: getting forecasts using %d workers' % num_workers)
+    with ThreadPoolExecutor(max_workers=num_workers) as executor:
+        futures = []
+        forecasts = []
+        for stid in config['Stations'].keys():
+            for model in config['Models'].keys():
+                futures.append(executor.submit(get_forecast, config, model, stid, forecast_date))
+        try:
+            for future in as_completed(futures):
+                forecast = future.result()
+                if forecast is not None:
+                    forecasts.append(forecast)
+        except BaseException:
+            # Only reached with the traceback option; don't start any more retrievals
+            for future in futures:
+                future.cancel()
+            raise
+    return forecasts
+
+
+def print_cache_stats(config):
+    """
+    Print the HTTP cache hits, misses, and revalidations from this run.
+    """
+    stats = cache_stats()
+    if stats is not None and config['debug'] > 9:
+        print('getForecasts: HTTP cache: %(hits)d hits, %(misses)d misses, %(revalidations)d revalidations' % stats)
 
 
 def historical(config, stid):
     """
     Function to obtain historical forecast data, for a specific site. Iterates over models which have the 'historical'
-    parameter set to True, and begins at the config start_date.
+    parameter set to True, and begins at the config start_date. Only dates without a daily forecast from the model in
+    the database are retrieved. Forecasts are retrieved and written in chunks of dates recorded in thetae.jobs.
     """
 
     print('getForecasts: getting historical forecasts for station %s' % stid)
@@ -84,6 +216,10 @@ def historical(config, stid):
     while date < time_now:
         forecast_dates.append(date)
         date = date + timedelta(hours=24)
+    if len(forecast_dates) == 0:
+        print('getForecasts: history_start %s for station %s is not in the past; no historical forecasts to get' %
+              (start_date, stid))
+        return
     if config['debug'] > 9:
         print('getForecasts: getting historical forecasts starting %s' % start_date)
 
@@ -99,28 +235,54 @@ def historical(config, stid):
             print('getForecasts warning: driver not specified for model %s' % model)
             continue
 
-        # Get the forecasts from the driver
-        try:
-            # Each driver should have a function 'historical' which returns a list of Forecasts
-            print('getForecasts: getting historical forecasts from %s' % model)
-            forecasts = get_object(driver).historical(config, model, stid, forecast_dates)
-            # Set the model name
-            forecasts = [f.set_model(model) for f in forecasts]
-        except BaseException as e:
-            print('getForecasts: failed to get historical forecasts from %s for %s' % (model, stid))
-            print("*** Reason: '%s'" % str(e))
-            if config['traceback']:
-                raise
-            continue
-        # Write to the database
-        try:
+        # Only get forecasts for dates which are not already in the database
+        existing = set(readDates(config, stid, 'forecast', 'daily_forecast', model=model,
+                                 start_date=forecast_dates[0], end_date=forecast_dates[-1]))
+        model_dates = [d for d in forecast_dates if d not in existing]
+        if len(model_dates) == 0:
             if config['debug'] > 9:
-                print('getForecasts: writing historical forecasts to database')
-            writeForecast(config, forecasts)
-        except BaseException as e:
-            print('getForecasts: failed to write historical forecasts to database')
-            print("*** Reason: '%s'" % str(e))
-            if config['traceback']:
-                raise
+                print('getForecasts: all historical forecasts from %s already in database' % model)
+            continue
+        print('getForecasts: getting %d historical forecasts from %s' % (len(model_dates), model))
+
+        # Get the forecasts in chunks of dates, writing each chunk when it is done
+        chunks = jobs.plan(config, stid, 'getForecasts', jobs.get_chunks(config, forecast_dates[0], forecast_dates[-1]),
+                           model=model)
+        for chunk in chunks:
+            chunk_dates = [d for d in model_dates if chunk[0] <= d <= chunk[1]]
+            if len(chunk_dates) == 0:
+                jobs.finish(config, stid, 'getForecasts', chunk, model=model)
+                continue
+
+            # Get the forecasts from the driver
+            try:
+                # Each driver should have a function 'historical' which returns a list of Forecasts
+                if config['debug'] > 9:
+                    print('getForecasts: getting historical forecasts from %s for %s to %s' %
+                          (model, chunk_dates[0], chunk_dates[-1]))
+                with measure('driver', driver, model=model, station=stid):
+                    forecasts = get_object(driver).historical(config, model, stid, chunk_dates)
+                # Set the model name
+                forecasts = [f.set_model(model) for f in forecasts]
+            except BaseException as e:
+                print('getForecasts: failed to get historical forecasts from %s for %s' % (model, stid))
+                print("*** Reason: '%s'" % str(e))
+                jobs.finish(config, stid, 'getForecasts', chunk, failure=str(e), model=model)
+                if config['traceback']:
+                    raise
+                continue
+            # Write to the database
+            try:
+                if len(forecasts) > 0:
+                    if config['debug'] > 9:
+                        print('getForecasts: writing historical forecasts to database')
+                    writeForecast(config, forecasts)
+                jobs.finish(config, stid, 'getForecasts', chunk, model=model)
+            except BaseException as e:
+                print('getForecasts: failed to write historical forecasts to database')
+                print("*** Reason: '%s'" % str(e))
+                jobs.finish(config, stid, 'getForecasts', chunk, failure=str(e), model=model)
+                if config['traceback']:
+                    raise
 
     return
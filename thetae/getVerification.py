@@ -10,10 +10,22 @@ the main engine process, while the historical process is used in the engine hist
 observations.
 """
 
-from thetae.db import writeTimeSeries, writeDaily
+from thetae.db import writeTimeSeries, writeDaily, readDates
 from datetime import datetime, timedelta
-from thetae.util import get_object, config_date_to_datetime
+from thetae.util import get_object, config_date_to_datetime, find_gaps, last_leap_year
+from thetae import jobs
+from thetae.metrics import measure
 from builtins import str
+import pandas as pd
+
+# Missing ranges of historical verification and obs separated by no more than this many days or hours of existing data
+# are retrieved together, to limit the number of requests to the API.
+gap_join_days = 3
+gap_join_hours = 12
+
+# Data used and written by this service, for the engine's service graph (see thetae.graph)
+requires = []
+provides = ['verif', 'obs']
 
 
 def main(config):
@@ -21,80 +33,105 @@ def main(config):
     Main function. Runs the obs and verification for the past 24 hours.
     """
 
-    data_binding = 'forecast'
-
     # Figure out which day we are verifying for: today.
     time_now = datetime.utcnow()
     verif_date = datetime(time_now.year, time_now.month, time_now.day)
     print('getVerification: verification date %s' % verif_date)
 
     # Verification
-    # Find the verification driver
-    try:
-        verif_driver = config['Verify']['Verification']['driver']
-    except KeyError:
-        print('getVerification error: no driver specified for Verification!')
-        raise
-    # Iterate over stations
+    verif_driver = get_driver(config, 'Verification')
     for stid in config['Stations'].keys():
-        if config['debug'] > 9:
-            print('getVerification: getting verification for station %s' % stid)
-        try:
-            # Verification and obs main() only need to know the stid
-            verification = get_object(verif_driver).main(config, stid)
-        except BaseException as e:
-            print('getVerification: failed to get verification for %s' % stid)
-            print("*** Reason: '%s'" % str(e))
-            if config['traceback']:
-                raise
-            continue
-        # Write to the database
-        try:
-            if config['debug'] > 9:
-                print('getVerification: writing verification to database')
-            writeDaily(config, verification, data_binding, 'verif')
-        except BaseException as e:
-            print('getVerification: failed to write verification to database')
-            print("*** Reason: '%s'" % str(e))
-            if config['traceback']:
-                raise
+        get_verification(config, verif_driver, stid)
 
     # Obs
-    # Find the obs driver
+    obs_driver = get_driver(config, 'Obs')
+    for stid in config['Stations'].keys():
+        get_obs(config, obs_driver, stid)
+
+
+def station_main(config, stid):
+    """
+    Runs the obs and verification for the past 24 hours for a single station. Used by the engine to run the service
+    separately for each station.
+    """
+    print('getVerification: getting verification and obs for station %s' % stid)
+    get_verification(config, get_driver(config, 'Verification'), stid)
+    get_obs(config, get_driver(config, 'Obs'), stid)
+
+
+def get_driver(config, data_type):
+    """
+    Return the name of the driver for data_type ('Verification', 'Obs', or 'Climo') in the config Verify section.
+    """
     try:
-        obs_driver = config['Verify']['Obs']['driver']
+        return config['Verify'][data_type]['driver']
     except KeyError:
-        print('getVerification error: no driver specified for Obs!')
+        print('getVerification error: no driver specified for %s!' % data_type)
         raise
-    # Iterate over stations
-    for stid in config['Stations'].keys():
-        # Get the obs
+
+
+def get_verification(config, verif_driver, stid):
+    """
+    Retrieve the verification for a station and write it to the database, isolating any errors.
+    """
+    if config['debug'] > 9:
+        print('getVerification: getting verification for station %s' % stid)
+    try:
+        # Verification and obs main() only need to know the stid
+        with measure('driver', verif_driver, station=stid):
+            verification = get_object(verif_driver).main(config, stid)
+    except BaseException as e:
+        print('getVerification: failed to get verification for %s' % stid)
+        print("*** Reason: '%s'" % str(e))
+        if config['traceback']:
+            raise
+        return
+    # Write to the database
+    try:
         if config['debug'] > 9:
-            print('getVerification: getting obs for station %s' % stid)
-        try:
-            # Verification and obs main() only need to know the stid
+            print('getVerification: writing verification to database')
+        writeDaily(config, verification, 'forecast', 'verif')
+    except BaseException as e:
+        print('getVerification: failed to write verification to database')
+        print("*** Reason: '%s'" % str(e))
+        if config['traceback']:
+            raise
+
+
+def get_obs(config, obs_driver, stid):
+    """
+    Retrieve the obs for a station and write them to the database, isolating any errors.
+    """
+    # Get the obs
+    if config['debug'] > 9:
+        print('getVerification: getting obs for station %s' % stid)
+    try:
+        # Verification and obs main() only need to know the stid
+        with measure('driver', obs_driver, station=stid):
             obs = get_object(obs_driver).main(config, stid)
-        except BaseException as e:
-            print('getVerification: failed to get obs for %s' % stid)
-            print("*** Reason: '%s'" % str(e))
-            if config['traceback']:
-                raise
-            continue
-        # Write to the database
-        try:
-            if config['debug'] > 9:
-                print('getVerification: writing obs to database')
-            writeTimeSeries(config, obs, data_binding, 'obs')
-        except BaseException as e:
-            print('getVerification: failed to write obs to database')
-            print("*** Reason: '%s'" % str(e))
-            if config['traceback']:
-                raise
+    except BaseException as e:
+        print('getVerification: failed to get obs for %s' % stid)
+        print("*** Reason: '%s'" % str(e))
+        if config['traceback']:
+            raise
+        return
+    # Write to the database
+    try:
+        if config['debug'] > 9:
+            print('getVerification: writing obs to database')
+        writeTimeSeries(config, obs, 'forecast', 'obs')
+    except BaseException as e:
+        print('getVerification: failed to write obs to database')
+        print("*** Reason: '%s'" % str(e))
+        if config['traceback']:
+            raise
 
 
 def historical(config, stid):
     """
-    Retrive historical verification (and climo!) for a stid.
+    Retrive historical verification (and climo!) for a stid. Only the days of verification and hours of obs which are
+    missing from the database are retrieved, in as few ranges of dates as possible. These are retrieved and written in
+    chunks of dates recorded in thetae.jobs. Climatology is only retrieved if it is not complete.
     """
 
     data_binding = 'forecast'
@@ -117,27 +154,50 @@ def historical(config, stid):
     except KeyError:
         print('getVerification error: no driver specified for Verification!')
         raise
-    # Get verification
-    if config['debug'] > 9:
-        print('getVerification: getting historical verification')
-    try:
-        # Verification and obs historical() need config, stid, start_date
-        verification = get_object(verif_driver).historical(config, stid, start_date)
-    except BaseException as e:
-        print('getVerification: failed to get historical verification for %s' % stid)
-        print("*** Reason: '%s'" % str(e))
-        if config['traceback']:
-            raise
-    # Write to the database
-    try:
-        if config['debug'] > 9:
-            print('getVerification: writing historical verification to database')
-        writeDaily(config, verification, data_binding, 'verif')
-    except BaseException as e:
-        print('getVerification: failed to write historical verification to database')
-        print("*** Reason: '%s'" % str(e))
-        if config['traceback']:
-            raise
+    # Find the missing days in each chunk of the backfill. Verification days run from 6Z to 6Z, so each range ends just
+    # before 6Z on the next day.
+    verif_dates = pd.date_range(start_date, time_now, freq='D').to_pydatetime()
+    existing = readDates(config, stid, data_binding, 'verif', start_date=start_date, end_date=time_now)
+    if len(verif_dates) > 0:
+        chunks = jobs.plan(config, stid, 'verification', jobs.get_chunks(config, verif_dates[0], verif_dates[-1]))
+    else:
+        chunks = []
+    for chunk in chunks:
+        chunk_dates = [d for d in verif_dates if chunk[0] <= d <= chunk[1]]
+        failure = None
+        for gap_start, gap_end in find_gaps(chunk_dates, existing, timedelta(days=1), join=gap_join_days):
+            # Today's verification has not started before 6Z
+            if gap_start + timedelta(hours=6) >= time_now:
+                continue
+            gap_end = min(gap_end + timedelta(days=1, hours=5, minutes=59), time_now)
+            # Get verification
+            if config['debug'] > 9:
+                print('getVerification: getting historical verification from %s to %s' % (gap_start, gap_end))
+            try:
+                # Verification and obs historical() need config, stid, start_date, end_date
+                with measure('driver', verif_driver, station=stid):
+                    verification = get_object(verif_driver).historical(config, stid, gap_start, end_date=gap_end)
+            except BaseException as e:
+                print('getVerification: failed to get historical verification for %s' % stid)
+                print("*** Reason: '%s'" % str(e))
+                failure = str(e)
+                if config['traceback']:
+                    jobs.finish(config, stid, 'verification', chunk, failure)
+                    raise
+                continue
+            # Write to the database
+            try:
+                if config['debug'] > 9:
+                    print('getVerification: writing historical verification to database')
+                writeDaily(config, verification, data_binding, 'verif')
+            except BaseException as e:
+                print('getVerification: failed to write historical verification to database')
+                print("*** Reason: '%s'" % str(e))
+                failure = str(e)
+                if config['traceback']:
+                    jobs.finish(config, stid, 'verification', chunk, failure)
+                    raise
+        jobs.finish(config, stid, 'verification', chunk, failure)
 
     # Obs
     # Find the obs driver
@@ -146,29 +206,58 @@ def historical(config, stid):
     except KeyError:
         print('getVerification error: no driver specified for Obs!')
         raise
-    # Get obs
-    if config['debug'] > 9:
-        print('getVerification: getting historical obs')
-    try:
-        # Verification and obs historical() need config, stid, start_date
-        obs = get_object(obs_driver).historical(config, stid, start_date)
-    except BaseException as e:
-        print('getVerification: failed to get historical obs for %s' % stid)
-        print("*** Reason: '%s'" % str(e))
-        if config['traceback']:
-            raise
-    # Write to the database
-    try:
-        if config['debug'] > 9:
-            print('getVerification: writing historical obs to database')
-        writeTimeSeries(config, obs, data_binding, 'obs')
-    except BaseException as e:
-        print('getVerification: failed to write historical obs to database')
-        print("*** Reason: '%s'" % str(e))
-        if config['traceback']:
-            raise
+    # Find the missing hours in each chunk of the backfill. Obs are not exactly on the hour, so look for any ob within
+    # each hour.
+    obs_dates = pd.date_range(start_date, time_now, freq='h').to_pydatetime()
+    existing = readDates(config, stid, data_binding, 'obs', start_date=start_date, end_date=time_now)
+    existing = [d.replace(minute=0, second=0, microsecond=0) for d in existing]
+    if len(obs_dates) > 0:
+        chunks = jobs.plan(config, stid, 'obs', jobs.get_chunks(config, obs_dates[0], obs_dates[-1]))
+    else:
+        chunks = []
+    for chunk in chunks:
+        chunk_dates = [d for d in obs_dates if chunk[0] <= d < chunk[1] + timedelta(days=1)]
+        failure = None
+        for gap_start, gap_end in find_gaps(chunk_dates, existing, timedelta(hours=1), join=gap_join_hours):
+            gap_end = min(gap_end + timedelta(minutes=59), time_now)
+            # Get obs
+            if config['debug'] > 9:
+                print('getVerification: getting historical obs from %s to %s' % (gap_start, gap_end))
+            try:
+                # Verification and obs historical() need config, stid, start_date, end_date
+                with measure('driver', obs_driver, station=stid):
+                    obs = get_object(obs_driver).historical(config, stid, gap_start, end_date=gap_end)
+            except BaseException as e:
+                print('getVerification: failed to get historical obs for %s' % stid)
+                print("*** Reason: '%s'" % str(e))
+                failure = str(e)
+                if config['traceback']:
+                    jobs.finish(config, stid, 'obs', chunk, failure)
+                    raise
+                continue
+            # Write to the database
+            try:
+                if config['debug'] > 9:
+                    print('getVerification: writing historical obs to database')
+                writeTimeSeries(config, obs, data_binding, 'obs')
+            except BaseException as e:
+                print('getVerification: failed to write historical obs to database')
+                print("*** Reason: '%s'" % str(e))
+                failure = str(e)
+                if config['traceback']:
+                    jobs.finish(config, stid, 'obs', chunk, failure)
+                    raise
+        jobs.finish(config, stid, 'obs', chunk, failure)
 
     # Climo
+    # Skip if we already have climatology for every day of the year
+    climo_year = last_leap_year()
+    existing = readDates(config, stid, data_binding, 'climo', start_date=datetime(climo_year, 1, 1),
+                         end_date=datetime(climo_year, 12, 31))
+    if len(existing) >= 366:
+        if config['debug'] > 9:
+            print('getVerification: climatology already in database')
+        return
     # Find the climo driver
     try:
         climo_driver = config['Verify']['Climo']['driver']
@@ -179,13 +268,15 @@ def historical(config, stid):
     if config['debug'] > 9:
         print('getVerification: getting historical climatology')
     try:
-        # Verification and obs historical() need config, stid, start_date
-        climo = get_object(climo_driver).historical(config, stid)
+        # Climo historical() needs only config, stid
+        with measure('driver', climo_driver, station=stid):
+            climo = get_object(climo_driver).historical(config, stid)
     except BaseException as e:
         print('getVerification: failed to get climo for %s' % stid)
         print("*** Reason: '%s'" % str(e))
         if config['traceback']:
             raise
+        return
     # Write to the database
     try:
         if config['debug'] > 9:
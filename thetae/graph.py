@@ -0,0 +1,206 @@
+#
+# Copyright (c) 2019 Jonathan Weyn <jweyn@uw.edu>
+#
+# See the file LICENSE for your rights.
+#
+
+"""
+Dependency graph of services for the theta-e engine.
+
+A service module may declare the data it uses and produces with module-level lists of names, 'requires' and
+'provides', for example:
+
+    requires = ['forecast', 'obs']
+    provides = ['plots']
+
+A service which requires a name runs after every service in the same run which provides it, regardless of the order
+of the services in the config. A service which also has a function station_main(config, stid) is run separately for
+each station, so that, e.g., the plots for one station only wait for the data of that station, while a service without
+station_main (such as thetae.calcVerification) waits for the data of all stations. Services which do not declare
+'requires' and 'provides' keep their place in the order of the config: they run after all services listed before them,
+and all services listed after them wait for them. Services with 'thread_safe = False' (e.g., those using matplotlib)
+never run at the same time as each other.
+
+The graph is run by the number of threads given by the config Engine option 'service_workers'. With one worker (the
+default), the services run one at a time in the main thread, in the order of the config except where a dependency
+requires otherwise. The start and end times of each service are printed as a timeline at the end of the run.
+"""
+
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from thetae.metrics import measure
+from thetae.util import get_object
+import thetae
+from builtins import str
+
+# Lock held by services which are not thread-safe
+_serial_lock = threading.Lock()
+
+
+class Node(object):
+    """
+    A service, or a service for a single station, in the graph.
+    """
+
+    def __init__(self, index, position, service, stid=None):
+        self.index = index
+        self.position = position
+        self.service = service
+        self.stid = stid
+        self.module = get_object(service)
+        self.requires = getattr(self.module, 'requires', None)
+        self.provides = getattr(self.module, 'provides', None)
+        self.declared = self.requires is not None and self.provides is not None
+        self.thread_safe = getattr(self.module, 'thread_safe', True)
+        self.depends = set()
+
+    @property
+    def name(self):
+        if self.stid is None:
+            return self.service
+        return '%s[%s]' % (self.service, self.stid)
+
+    def run(self, config):
+        if self.stid is None:
+            self.module.main(config)
+        else:
+            self.module.station_main(config, self.stid)
+
+    def depends_on(self, other):
+        """
+        Whether this node must run after other.
+        """
+        if not (self.declared and other.declared):
+            return other.position < self.position
+        if len(set(other.provides) & set(self.requires)) == 0:
+            return False
+        return other.stid is None or self.stid is None or other.stid == self.stid
+
+
+def build(config, services):
+    """
+    Return the list of Nodes for a list of services, with their dependencies.
+
+    :param config:
+    :param services: list: service paths, in config order
+    :return: list of Node
+    """
+    nodes = []
+    for position, service in enumerate(services):
+        module = get_object(service)
+        if hasattr(module, 'station_main') and hasattr(module, 'requires') and hasattr(module, 'provides'):
+            for stid in config['Stations'].keys():
+                nodes.append(Node(len(nodes), position, service, stid))
+        else:
+            nodes.append(Node(len(nodes), position, service))
+    for node in nodes:
+        for other in nodes:
+            if other is not node and other.position != node.position and node.depends_on(other):
+                node.depends.add(other.index)
+    check_cycles(nodes)
+    return nodes
+
+
+def check_cycles(nodes):
+    """
+    Raise a ValueError if the dependencies of nodes are circular.
+    """
+    done = set()
+    remaining = list(nodes)
+    while len(remaining) > 0:
+        ready = [node for node in remaining if node.depends <= done]
+        if len(ready) == 0:
+            raise ValueError('graph error: circular dependencies between services %s' %
+                             ', '.join(sorted(set([node.service for node in remaining]))))
+        for node in ready:
+            done.add(node.index)
+            remaining.remove(node)
+
+
+def run_node(config, node, start_time, timeline):
+    """
+    Run a node, isolating any errors unless the config traceback option is set. Records its start and end times, in
+    seconds from start_time, in timeline.
+    """
+    start = time.time()
+    try:
+        with measure('service', node.service, station=node.stid):
+            if node.thread_safe:
+                node.run(config)
+            else:
+                with _serial_lock:
+                    node.run(config)
+    except BaseException as e:
+        print('graph warning: failed to run service %s' % node.name)
+        print("*** Reason: '%s'" % str(e))
+        if config['traceback']:
+            raise
+    finally:
+        timeline.append((node.name, threading.current_thread().name, start - start_time, time.time() - start_time))
+
+
+def run(config, services, stop=None):
+    """
+    Run the graph of services. If stop (a threading.Event) is given and becomes set, no more services are started.
+
+    :param config:
+    :param services: list: service paths, in config order
+    :param stop: threading.Event: optional
+    """
+    nodes = build(config, services)
+    try:
+        num_workers = int(config['Engine']['service_workers'])
+    except (KeyError, ValueError):
+        num_workers = 1
+    if config['debug'] > 50:
+        for node in nodes:
+            print('graph: %s depends on %s' % (node.name, ', '.join([nodes[d].name for d in sorted(node.depends)])))
+
+    start_time = time.time()
+    timeline = []
+    done = set()
+    pending = list(nodes)
+    if num_workers <= 1:
+        # Run the first ready node in config order each time
+        while len(pending) > 0 and not (stop is not None and stop.is_set()):
+            node = [n for n in pending if n.depends <= done][0]
+            pending.remove(node)
+            run_node(config, node, start_time, timeline)
+            done.add(node.index)
+    else:
+        # Writes from different threads must not overlap
+        thetae.db.set_write_lock(threading.Lock())
+        executor = ThreadPoolExecutor(max_workers=num_workers)
+        running = {}
+        try:
+            while len(pending) > 0 or len(running) > 0:
+                if not (stop is not None and stop.is_set()):
+                    for node in [n for n in pending if n.depends <= done]:
+                        pending.remove(node)
+                        running[executor.submit(run_node, config, node, start_time, timeline)] = node
+                elif len(running) == 0:
+                    break
+                finished, _ = wait(list(running.keys()), return_when=FIRST_COMPLETED)
+                for future in finished:
+                    node = running.pop(future)
+                    done.add(node.index)
+                    # Only raises with the traceback option
+                    future.result()
+        finally:
+            for future in running.keys():
+                future.cancel()
+            executor.shutdown(wait=True)
+            thetae.db.set_write_lock(None)
+    print_timeline(config, timeline)
+
+
+def print_timeline(config, timeline):
+    """
+    Print the start and end time, in seconds from the start of the run, and the thread of each service that ran.
+    """
+    if config['debug'] < 1 or len(timeline) == 0:
+        return
+    print('graph: timeline of services (seconds):')
+    for name, thread, start, end in sorted(timeline, key=lambda t: t[2]):
+        print('    %8.2f %8.2f  %-20s %s' % (start, end, thread, name))
@@ -0,0 +1,240 @@
+#
+# Copyright (c) 2019 Jonathan Weyn <jweyn@uw.edu>
+#
+# See the file LICENSE for your rights.
+#
+
+"""
+Shared HTTP session for all theta-e data sources.
+
+All requests go through a single requests Session, so that connections to each host are kept alive and re-used between
+requests instead of paying for DNS, TCP, and TLS setup each time. The session asks for gzip-compressed responses, sets a
+default timeout, retries failed requests with exponential backoff, and limits the number of simultaneous requests to
+any single host. Options are read from the optional 'HTTP' section of the config by init(), which the engine calls at
+startup; otherwise the defaults below are used.
+
+Responses may also be cached on disk in THETAE_ROOT/site_data/cache (see thetae.cache). A cached response is used as-is
+for cache_ttl hours; after that it is revalidated with the server using its ETag or Last-Modified headers when
+available. Drivers use model_get(), which takes the cache TTL for the model from the config and counts requests which
+actually reach the network against the model's API limits (see thetae.quota).
+"""
+
+import time
+import threading
+import requests
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
+from requests.adapters import HTTPAdapter
+try:
+    from urllib3.util.retry import Retry
+except ImportError:
+    from requests.packages.urllib3.util.retry import Retry
+try:
+    from urllib.parse import urlparse
+except ImportError:
+    from urlparse import urlparse
+from thetae.cache import ResponseCache
+from thetae.metrics import measure, add
+from thetae.quota import api_call, get_api_name, get_limits, QuotaExceededError
+from thetae.util import to_bool
+
+default_options = {
+    'timeout': 30.,
+    'retries': 3,
+    'backoff_factor': 0.5,
+    'host_connections': 4,
+    'cache': True,
+    'cache_size': 100,
+    'cache_ttl': None,
+}
+
+_options = dict(default_options)
+_sessions = {}
+_cache = None
+_lock = threading.Lock()
+_host_semaphores = {}
+
+
+def init(config):
+    """
+    Set the HTTP options from the config and reset the shared session.
+
+    :param config:
+    :return:
+    """
+    global _cache
+    options = dict(default_options)
+    try:
+        http_config = config['HTTP']
+    except KeyError:
+        http_config = {}
+    for key in ['timeout', 'backoff_factor', 'cache_ttl']:
+        try:
+            options[key] = float(http_config[key])
+        except (KeyError, ValueError):
+            pass
+    for key in ['retries', 'host_connections', 'cache_size']:
+        try:
+            options[key] = int(http_config[key])
+        except (KeyError, ValueError):
+            pass
+    try:
+        options['cache'] = to_bool(http_config['cache'])
+    except (KeyError, ValueError):
+        pass
+    if config['debug'] > 50:
+        print('http: using options %s' % options)
+
+    with _lock:
+        _options.update(options)
+        for session in _sessions.values():
+            session.close()
+        _sessions.clear()
+        _host_semaphores.clear()
+        if options['cache']:
+            cache_dir = '%s/site_data/cache' % config['THETAE_ROOT']
+            _cache = ResponseCache(cache_dir, max_size=options['cache_size'] * 1024 * 1024)
+        else:
+            _cache = None
+
+
+def get_session(retry_status=True):
+    """
+    Return the shared requests Session, creating it if necessary. If retry_status is False, the session only retries
+    requests which could not connect, never those which got an error response from the server, so that every request
+    which reaches the server is made (and counted) by get().
+    """
+    with _lock:
+        if retry_status not in _sessions:
+            import thetae
+            if retry_status:
+                retry = Retry(total=_options['retries'], backoff_factor=_options['backoff_factor'],
+                              status_forcelist=(429, 500, 502, 503, 504), raise_on_status=False)
+            else:
+                retry = Retry(total=_options['retries'], connect=_options['retries'], read=0, status=0, redirect=0,
+                              backoff_factor=_options['backoff_factor'], raise_on_status=False)
+            adapter = HTTPAdapter(pool_connections=16, pool_maxsize=_options['host_connections'], max_retries=retry)
+            session = requests.Session()
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            session.headers.update({
+                'User-Agent': 'theta-e/%s' % thetae.__version__,
+                'Accept-Encoding': 'gzip, deflate',
+            })
+            _sessions[retry_status] = session
+        return _sessions[retry_status]
+
+
+def _host_semaphore(url):
+    host = urlparse(url).netloc
+    with _lock:
+        if host not in _host_semaphores:
+            _host_semaphores[host] = threading.BoundedSemaphore(_options['host_connections'])
+        return _host_semaphores[host]
+
+
+def _cached_response(url, meta, content):
+    """
+    Re-create a requests Response from a cached entry.
+    """
+    response = requests.models.Response()
+    response.status_code = 200
+    response.reason = 'OK'
+    response.url = url
+    response.headers = CaseInsensitiveDict(meta['headers'])
+    response.encoding = get_encoding_from_headers(response.headers)
+    response._content = content
+    return response
+
+
+def get(url, params=None, timeout=None, cache_ttl=None, before_request=None, retry_status=True, **kwargs):
+    """
+    Perform a GET request with the shared session. Accepts the same keyword arguments as requests.get. Does not raise
+    an exception for HTTP error responses; use response.raise_for_status().
+
+    :param url: str: URL
+    :param params: dict: query parameters
+    :param timeout: float: timeout in seconds; if None, uses the configured default
+    :param cache_ttl: float: if given, use a cached response up to this many hours old
+    :param before_request: function: if given, called with no arguments before any request goes to the network
+    :param retry_status: bool: if False, do not retry requests which get an error response (see get_session)
+    :return: requests Response
+    """
+    if timeout is None:
+        timeout = _options['timeout']
+    cache = _cache if cache_ttl is not None else None
+
+    # Check the cache
+    headers = dict(kwargs.pop('headers', None) or {})
+    if cache is not None:
+        full_url = requests.Request('GET', url, params=params).prepare().url
+        entry = cache.load(full_url)
+        if entry is not None:
+            meta, content = entry
+            if time.time() - meta['time'] < cache_ttl * 3600.:
+                cache.count('hits')
+                return _cached_response(full_url, meta, content)
+            # Stale: ask the server whether it has changed
+            if 'ETag' in meta['headers']:
+                headers['If-None-Match'] = meta['headers']['ETag']
+            if 'Last-Modified' in meta['headers']:
+                headers['If-Modified-Since'] = meta['headers']['Last-Modified']
+
+    if before_request is not None:
+        before_request()
+    session = get_session(retry_status)
+    with _host_semaphore(url), measure('http', urlparse(url).netloc):
+        response = session.get(url, params=params, timeout=timeout, headers=headers, **kwargs)
+        add('bytes', len(response.content))
+
+    if cache is not None:
+        if response.status_code == 304 and entry is not None:
+            cache.count('revalidations')
+            cache.refresh(full_url)
+            return _cached_response(full_url, entry[0], entry[1])
+        cache.count('misses')
+        if response.status_code == 200:
+            cache.store(full_url, response.headers, response.content)
+    return response
+
+
+def get_cache_ttl(config, model):
+    """
+    Return the cache TTL in hours for a model: its 'cache_ttl' parameter in the config Models section, otherwise the
+    default 'cache_ttl' in the HTTP section. Returns None if neither is set, i.e., no caching.
+    """
+    try:
+        return float(config['Models'][model]['cache_ttl'])
+    except (KeyError, ValueError):
+        return _options['cache_ttl']
+
+
+def model_get(config, model, url, params=None, **kwargs):
+    """
+    Perform a GET request on behalf of the driver for a model. The response is cached according to the model's cache
+    TTL, and requests which go to the network are counted against the model's API limits. Requests to an API with
+    limits are not retried on error responses, since each retry would use a call, and a 429 (Too Many Requests) response
+    raises a QuotaExceededError, so that the forecast is deferred.
+
+    :param config:
+    :param model: str: model name in config
+    :param url: str: URL
+    :param params: dict: query parameters
+    :return: requests Response
+    """
+    per_minute, per_day = get_limits(config, get_api_name(config, model))
+    limited = per_minute is not None or per_day is not None
+    response = get(url, params=params, cache_ttl=get_cache_ttl(config, model),
+                   before_request=lambda: api_call(config, model), retry_status=not limited, **kwargs)
+    if limited and response.status_code == 429:
+        raise QuotaExceededError('API for %s returned 429 Too Many Requests' % model)
+    return response
+
+
+def cache_stats():
+    """
+    Return a dictionary of cache hits, misses, and revalidations for this process, or None if there is no cache.
+    """
+    if _cache is None:
+        return None
+    return _cache.stats()
@@ -0,0 +1,126 @@
+#
+# Copyright (c) 2019 Jonathan Weyn <jweyn@uw.edu>
+#
+# See the file LICENSE for your rights.
+#
+
+"""
+Persistent job plans for historical backfills.
+
+Historical data are retrieved in chunks of dates, each of which is written to the database as soon as it is complete.
+The chunks for each (station, service, model) are recorded in a small SQLite database, THETAE_ROOT/archive/
+theta-e-jobs.sdb, along with whether they are pending, done, or failed. Chunks always start on a fixed grid of
+'backfill_chunk_days' days from the start of the backfill, so that a backfill which is interrupted can be resumed with
+the --resume option: chunks which were completed are then skipped, even if the source had no data for some of their
+dates. Without --resume, the plan is reset and every chunk is checked again.
+"""
+
+import os
+import sqlite3
+from datetime import datetime, timedelta
+from thetae.util import date_to_string, to_bool
+
+default_chunk_days = 30
+
+
+def connection(config):
+    """
+    Returns a connection to the jobs database, creating it if necessary.
+    """
+    db_dir = '%s/archive' % config['THETAE_ROOT']
+    if not (os.path.isdir(db_dir)):
+        os.makedirs(db_dir)
+    conn = sqlite3.connect('%s/theta-e-jobs.sdb' % db_dir, timeout=30.)
+    conn.execute("""CREATE TABLE IF NOT EXISTS JOBS (STID TEXT NOT NULL, SERVICE TEXT NOT NULL, MODEL TEXT NOT NULL,
+                    START TEXT NOT NULL, END TEXT NOT NULL, STATUS TEXT, REASON TEXT, UPDATED TEXT,
+                    PRIMARY KEY (STID, SERVICE, MODEL, START));""")
+    return conn
+
+
+def chunk_days(config):
+    """
+    Returns the number of days in each chunk of a backfill.
+    """
+    try:
+        return int(config['Engine']['backfill_chunk_days'])
+    except (KeyError, ValueError):
+        return default_chunk_days
+
+
+def get_chunks(config, start_date, end_date):
+    """
+    Returns a list of (start, end) datetime tuples of the chunks of days between start_date and end_date, inclusive.
+    """
+    days = chunk_days(config)
+    chunks = []
+    chunk_start = start_date
+    while chunk_start <= end_date:
+        chunk_end = min(chunk_start + timedelta(days=days - 1), end_date)
+        chunks.append((chunk_start, chunk_end))
+        chunk_start = chunk_start + timedelta(days=days)
+    return chunks
+
+
+def plan(config, stid, service, chunks, model=''):
+    """
+    Record the chunks of a backfill for a station, service, and model, and return the chunks which remain to be done.
+    If config['resume'] is set, chunks that were completed in a previous run are kept and skipped; otherwise any
+    previous plan is replaced.
+
+    :param config:
+    :param stid: str: station ID
+    :param service: str: name of the service or data type
+    :param chunks: list: (start, end) datetime tuples
+    :param model: str: model name, if applicable
+    :return: list of (start, end) tuples to do
+    """
+    resume = to_bool(config.get('resume', False))
+    conn = connection(config)
+    with conn:
+        if not resume:
+            conn.execute("DELETE FROM JOBS WHERE STID=? AND SERVICE=? AND MODEL=?;", (stid, service, model))
+        conn.executemany("INSERT OR IGNORE INTO JOBS VALUES (?, ?, ?, ?, ?, 'pending', NULL, ?);",
+                         [(stid, service, model, date_to_string(start), date_to_string(end),
+                           date_to_string(datetime.utcnow())) for start, end in chunks])
+        done = conn.execute("SELECT START FROM JOBS WHERE STID=? AND SERVICE=? AND MODEL=? AND STATUS='done';",
+                            (stid, service, model)).fetchall()
+    conn.close()
+    done = set([row[0] for row in done])
+    remaining = [chunk for chunk in chunks if date_to_string(chunk[0]) not in done]
+    if config['debug'] > 9 and len(remaining) < len(chunks):
+        print('jobs: resuming %s %s for %s: %d of %d chunks already done' %
+              (service, model, stid, len(chunks) - len(remaining), len(chunks)))
+    return remaining
+
+
+def mark(config, stid, service, chunk, status, model='', reason=None):
+    """
+    Set the status ('pending', 'done', or 'failed') of a chunk of a backfill.
+
+    :param config:
+    :param stid: str: station ID
+    :param service: str: name of the service or data type
+    :param chunk: (start, end) datetime tuple
+    :param status: str: new status
+    :param model: str: model name, if applicable
+    :param reason: str: optional reason for a failure
+    """
+    conn = connection(config)
+    with conn:
+        conn.execute("""UPDATE JOBS SET STATUS=?, REASON=?, UPDATED=?
+                        WHERE STID=? AND SERVICE=? AND MODEL=? AND START=?;""",
+                     (status, reason, date_to_string(datetime.utcnow()), stid, service, model,
+                      date_to_string(chunk[0])))
+    conn.close()
+
+
+def finish(config, stid, service, chunk, failure=None, model=''):
+    """
+    Record the result of a chunk: failed if failure (a reason) is given, otherwise done. Chunks which reach the
+    current UTC day are left pending, since their data are not yet complete.
+    """
+    time_now = datetime.utcnow()
+    if failure is not None:
+        mark(config, stid, service, chunk, 'failed', model=model, reason=failure)
+    elif chunk[1] < datetime(time_now.year, time_now.month, time_now.day):
+        mark(config, stid, service, chunk, 'done', model=model)
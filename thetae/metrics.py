@@ -0,0 +1,213 @@
+#
+# Copyright (c) 2019 Jonathan Weyn <jweyn@uw.edu>
+#
+# See the file LICENSE for your rights.
+#
+
+"""
+Lightweight timing instrumentation for theta-e runs.
+
+Sections of code are measured with the measure() context manager, under a category ('service', 'driver', 'http', or
+'db'), a name, and optional labels such as the station and model:
+
+    with measure('driver', driver, model=model, station=stid):
+        forecast = get_object(driver).main(config, model, stid, forecast_date)
+
+For each (category, name, labels), the number of calls, wall time, CPU time of the calling thread, and number of calls
+which raised an exception are accumulated. Code inside a measured section may also count bytes downloaded and rows
+written with add(); these are added to every section being measured in the current thread, so that, e.g., the bytes
+downloaded by a driver appear both under its HTTP host and under the driver.
+
+At the end of each engine run, write() saves the measurements as a JSON file in THETAE_ROOT/archive/metrics and as a
+Prometheus textfile, THETAE_ROOT/archive/theta-e.prom, which may be read by the node_exporter textfile collector.
+Export is enabled by the config Engine option 'metrics'; JSON files older than 'metrics_days' days (default 30) are
+removed.
+"""
+
+import os
+import json
+import time
+import threading
+from datetime import datetime
+from contextlib import contextmanager
+from thetae.util import to_bool
+from thetae.trace import span
+
+# CPU time of the current thread, where available
+_cpu_time = getattr(time, 'thread_time', time.process_time)
+
+_lock = threading.Lock()
+_local = threading.local()
+_records = {}
+_run_start = [time.time(), datetime.utcnow()]
+
+counters = ['calls', 'wall', 'cpu', 'errors', 'bytes', 'rows']
+default_days = 30
+
+
+def reset():
+    """
+    Clear all measurements and mark the start of a new run.
+    """
+    with _lock:
+        _records.clear()
+        _run_start[:] = [time.time(), datetime.utcnow()]
+
+
+def _active():
+    if not hasattr(_local, 'active'):
+        _local.active = []
+    return _local.active
+
+
+@contextmanager
+def measure(category, name, **labels):
+    """
+    Context manager which records the wall and CPU time of the code inside it, and whether it raised an exception.
+
+    :param category: str: type of operation, e.g., 'service'
+    :param name: str: name of the operation, e.g., the service or driver path
+    :param labels: optional labels, e.g., station and model
+    """
+    key = (category, name, tuple(sorted((k, str(v)) for k, v in labels.items() if v is not None)))
+    record = dict.fromkeys(counters, 0)
+    active = _active()
+    active.append(record)
+    wall_start = time.time()
+    cpu_start = _cpu_time()
+    try:
+        if len(key[2]) > 0:
+            span_name = '%s [%s]' % (name, ', '.join([v for k, v in key[2]]))
+        else:
+            span_name = name
+        with span(span_name, category, **labels):
+            yield
+    except BaseException:
+        record['errors'] += 1
+        raise
+    finally:
+        record['wall'] += time.time() - wall_start
+        record['cpu'] += _cpu_time() - cpu_start
+        record['calls'] += 1
+        active.remove(record)
+        with _lock:
+            totals = _records.setdefault(key, dict.fromkeys(counters, 0))
+            for counter in counters:
+                totals[counter] += record[counter]
+
+
+def add(counter, value):
+    """
+    Add value to a counter ('bytes' or 'rows') of every section being measured in the current thread.
+    """
+    for record in _active():
+        record[counter] += value
+
+
+def get_records():
+    """
+    Return a list of dictionaries of the measurements of this run, sorted by decreasing wall time.
+    """
+    with _lock:
+        items = list(_records.items())
+    records = []
+    for (category, name, labels), totals in items:
+        record = {'category': category, 'name': name}
+        record.update(dict(labels))
+        record.update(totals)
+        records.append(record)
+    records.sort(key=lambda r: r['wall'], reverse=True)
+    return records
+
+
+def _prometheus_labels(record):
+    labels = [(k, v) for k, v in record.items() if k not in counters]
+    escaped = [(k, str(v).replace('\\', '\\\\').replace('"', '\\"')) for k, v in labels]
+    return ','.join(['%s="%s"' % (k, v) for k, v in sorted(escaped)])
+
+
+def prometheus_text(records, run_time):
+    """
+    Return the measurements in the Prometheus text exposition format.
+    """
+    lines = []
+    metrics = [
+        ('calls', 'thetae_calls_total', 'counter', 'Number of calls'),
+        ('wall', 'thetae_wall_seconds_total', 'counter', 'Wall time in seconds'),
+        ('cpu', 'thetae_cpu_seconds_total', 'counter', 'CPU time of the calling thread in seconds'),
+        ('errors', 'thetae_errors_total', 'counter', 'Number of calls which raised an exception'),
+        ('bytes', 'thetae_downloaded_bytes_total', 'counter', 'Bytes downloaded'),
+        ('rows', 'thetae_written_rows_total', 'counter', 'Database rows written'),
+    ]
+    for counter, metric, metric_type, description in metrics:
+        lines.append('# HELP %s %s' % (metric, description))
+        lines.append('# TYPE %s %s' % (metric, metric_type))
+        for record in records:
+            lines.append('%s{%s} %s' % (metric, _prometheus_labels(record), repr(float(record[counter]))))
+    lines.append('# HELP thetae_run_seconds Wall time of the last run in seconds')
+    lines.append('# TYPE thetae_run_seconds gauge')
+    lines.append('thetae_run_seconds %s' % repr(float(run_time)))
+    lines.append('# HELP thetae_run_timestamp_seconds Time at which the last run finished')
+    lines.append('# TYPE thetae_run_timestamp_seconds gauge')
+    lines.append('thetae_run_timestamp_seconds %s' % repr(float(time.time())))
+    return '\n'.join(lines) + '\n'
+
+
+def prune(config, metrics_dir, metrics_days):
+    """
+    Remove metrics files last modified more than metrics_days days ago. Does nothing if metrics_days is 0.
+    """
+    if metrics_days <= 0:
+        return
+    oldest = time.time() - metrics_days * 86400.
+    for file_name in os.listdir(metrics_dir):
+        if not (file_name.startswith('theta-e-metrics-') and file_name.endswith('.json')):
+            continue
+        metrics_file = os.path.join(metrics_dir, file_name)
+        try:
+            if os.path.getmtime(metrics_file) < oldest:
+                if config['debug'] > 9:
+                    print('metrics: removing old file %s' % metrics_file)
+                os.remove(metrics_file)
+        except OSError:
+            pass
+
+
+def write(config):
+    """
+    Save the measurements of this run, if the config Engine option 'metrics' is set. Prints the slowest operations if
+    debug is on.
+    """
+    try:
+        enabled = to_bool(config['Engine']['metrics'])
+    except KeyError:
+        enabled = False
+    if not enabled:
+        return
+    run_time = time.time() - _run_start[0]
+    records = get_records()
+    if config['debug'] > 9:
+        print('metrics: slowest operations in this run (wall, cpu seconds):')
+        for record in records[:10]:
+            print('    %8.2f %8.2f  %s %s' % (record['wall'], record['cpu'], record['category'],
+                                             _prometheus_labels(record)))
+
+    metrics_dir = '%s/archive/metrics' % config['THETAE_ROOT']
+    if not (os.path.isdir(metrics_dir)):
+        os.makedirs(metrics_dir)
+    metrics_file = '%s/theta-e-metrics-%s.json' % (metrics_dir, _run_start[1].strftime('%Y%m%d%H%M%S'))
+    if config['debug'] > 9:
+        print('metrics: writing %s' % metrics_file)
+    with open(metrics_file, 'w') as f:
+        json.dump({'start': _run_start[1].isoformat() + 'Z', 'wall': run_time, 'records': records}, f, indent=1)
+    try:
+        metrics_days = float(config['Engine']['metrics_days'])
+    except (KeyError, ValueError):
+        metrics_days = default_days
+    prune(config, metrics_dir, metrics_days)
+
+    # Write the textfile atomically, since it may be read at any time
+    prom_file = '%s/archive/theta-e.prom' % config['THETAE_ROOT']
+    with open(prom_file + '.tmp', 'w') as f:
+        f.write(prometheus_text(records, run_time))
+    os.rename(prom_file + '.tmp', prom_file)
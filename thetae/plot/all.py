@@ -13,6 +13,26 @@ from datetime import datetime, timedelta
 from thetae.util import get_object, config_date_to_datetime, to_bool
 from builtins import str
 
+# Data used and written by this service, for the engine's service graph (see thetae.graph). matplotlib is not
+# thread-safe, so plots are never made at the same time as other non-thread-safe services.
+requires = ['forecast', 'obs', 'verif', 'climo']
+provides = ['plots']
+thread_safe = False
+
+
+def get_stations(config):
+    """
+    Return the stations for which to produce output: all stations if the config option 'plot_all_stations' is set,
+    otherwise only the current station.
+    """
+    try:
+        plot_all_stations = to_bool(config['Plot']['Options']['plot_all_stations'])
+    except:
+        plot_all_stations = False
+    if plot_all_stations:
+        return list(config['Stations'].keys())
+    return [config['current_stid']]
+
 
 def main(config):
     """
@@ -31,15 +51,7 @@ def main(config):
     except KeyError:
         print("plot.all warning: no plots specified by key 'plots' in config!")
         return
-    # If a config option is given to do plots for all stations, do so
-    try:
-        plot_all_stations = to_bool(config['Plot']['Options']['plot_all_stations'])
-    except:
-        plot_all_stations = False
-    if plot_all_stations:
-        stations = config['Stations'].keys()
-    else:
-        stations = [config['current_stid']]
+    stations = get_stations(config)
 
     # Do the plots
     for plot_type in plot_types:
@@ -58,6 +70,32 @@ def main(config):
                 continue
             
 
+def station_main(config, stid):
+    """
+    Produce all plots specified in config for a single station, if it is one of the stations selected by
+    get_stations. Used by the engine to run the service separately for each station.
+    """
+    if stid not in get_stations(config):
+        return
+    time_now = datetime.utcnow()
+    forecast_date = (datetime(time_now.year, time_now.month, time_now.day) + timedelta(days=1))
+    try:
+        plot_types = list(config['Plot']['plots'])
+    except KeyError:
+        print("plot.all warning: no plots specified by key 'plots' in config!")
+        return
+    for plot_type in plot_types:
+        if config['debug'] > 9:
+            print("plot.all: making '%s' plot for station %s" % (plot_type, stid))
+        try:
+            get_object('thetae.plot.%s' % plot_type).main(config, stid, forecast_date)
+        except BaseException as e:
+            print('plot.all: failed to make plot %s for %s' % (plot_type, stid))
+            print("*** Reason: '%s'" % str(e))
+            if config['traceback']:
+                raise
+
+
 def historical(config, stid):
     """
     Function to produce historical plots, for a specific site. Iterates over plotting functions specified in config
@@ -0,0 +1,180 @@
+#
+# Copyright (c) 2019 Jonathan Weyn <jweyn@uw.edu>
+#
+# See the file LICENSE for your rights.
+#
+
+"""
+Optional profiling of services and drivers.
+
+Profiling is turned on with the --profile option of the theta-e script, or the config Engine option 'profile', set to
+either 'cprofile' or 'tracemalloc'. While it is on, the functions of every service or driver returned by
+util.get_object whose path starts with one of the config Engine 'profile_targets' (all of them, if none are given) are
+run under the profiler. Each call writes a file to THETAE_ROOT/archive/profiles: a cProfile '.prof' file, which can be
+read with pstats or snakeviz, or a '.txt' report of the top 'profile_top' lines allocating memory.
+
+Only one section is profiled at a time. A profiled function which is called while another is being profiled, for
+example a driver called by a profiled service, or in another thread, runs without its own profile. Note that cProfile
+only profiles the thread in which it runs.
+"""
+
+import os
+import re
+import time
+import threading
+import functools
+from contextlib import contextmanager
+
+modes = ['cprofile', 'tracemalloc']
+default_top = 25
+
+_options = {'mode': None, 'targets': [], 'top': default_top, 'directory': None}
+_lock = threading.Lock()
+_count = [0]
+
+
+def init(config, mode=None):
+    """
+    Set the profiling options from the config. The mode, if given (e.g., from the command line), overrides the config.
+    """
+    engine_config = config.get('Engine', {})
+    if mode is None:
+        mode = engine_config.get('profile', None) or None
+    if mode is not None and mode not in modes:
+        raise ValueError("profiling: unknown profile mode '%s'; must be one of %s" % (mode, ', '.join(modes)))
+    targets = engine_config.get('profile_targets', [])
+    if not isinstance(targets, list):
+        targets = [targets]
+    try:
+        top = int(engine_config['profile_top'])
+    except (KeyError, ValueError):
+        top = default_top
+    _options.update({
+        'mode': mode,
+        'targets': [t for t in targets if t],
+        'top': top,
+        'directory': '%s/archive/profiles' % config['THETAE_ROOT'],
+    })
+    if mode is not None:
+        print('profiling: profiling %s with %s; writing to %s' %
+              (', '.join(_options['targets']) or 'all services and drivers', mode, _options['directory']))
+
+
+def enabled():
+    return _options['mode'] is not None
+
+
+def selected(path):
+    """
+    Whether the object at path (as given to util.get_object) should be profiled.
+    """
+    if not enabled():
+        return False
+    if len(_options['targets']) == 0:
+        return True
+    return any([path == t or path.startswith(t + '.') for t in _options['targets']])
+
+
+def _file_name(name, extension):
+    # Only called while holding _lock
+    _count[0] += 1
+    count = _count[0]
+    safe_name = re.sub(r'[^A-Za-z0-9_.-]', '_', name)
+    return os.path.join(_options['directory'], '%s-%s-%d.%s' %
+                        (safe_name, time.strftime('%Y%m%d%H%M%S'), count, extension))
+
+
+@contextmanager
+def profile(name):
+    """
+    Context manager which profiles the code inside it, if profiling is on and no other section is being profiled.
+    """
+    if not enabled() or not _lock.acquire(False):
+        yield
+        return
+    try:
+        if not (os.path.isdir(_options['directory'])):
+            os.makedirs(_options['directory'])
+        if _options['mode'] == 'cprofile':
+            with _cprofile(name):
+                yield
+        else:
+            with _tracemalloc(name):
+                yield
+    finally:
+        _lock.release()
+
+
+@contextmanager
+def _cprofile(name):
+    import cProfile
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        profile_file = _file_name(name, 'prof')
+        profiler.dump_stats(profile_file)
+        print('profiling: wrote %s' % profile_file)
+
+
+@contextmanager
+def _tracemalloc(name):
+    import tracemalloc
+    tracemalloc.start()
+    try:
+        yield
+    finally:
+        snapshot = tracemalloc.take_snapshot()
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        statistics = snapshot.statistics('lineno')
+        report_file = _file_name(name, 'txt')
+        with open(report_file, 'w') as f:
+            f.write('%s\n' % name)
+            f.write('Memory allocated at end: %.1f KiB; peak: %.1f KiB\n' % (current / 1024., peak / 1024.))
+            f.write('Top %d lines allocating memory still in use at end:\n' % _options['top'])
+            for stat in statistics[:_options['top']]:
+                f.write('%s\n' % stat)
+        print('profiling: wrote %s' % report_file)
+
+
+def wrap_function(function, name):
+    """
+    Return function wrapped to run under the profiler.
+    """
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        with profile(name):
+            return function(*args, **kwargs)
+    return wrapper
+
+
+class ProfiledModule(object):
+    """
+    Proxy for a module whose functions run under the profiler when called.
+    """
+
+    def __init__(self, module, name):
+        self._module = module
+        self._name = name
+
+    def __getattr__(self, attr):
+        value = getattr(self._module, attr)
+        if callable(value) and not isinstance(value, type) and not attr.startswith('_'):
+            return wrap_function(value, '%s.%s' % (self._name, attr))
+        return value
+
+
+def wrap(obj, path):
+    """
+    Return a profiled version of the object at path, returned by util.get_object, if it is selected for profiling.
+    """
+    if not selected(path):
+        return obj
+    if callable(obj) and not isinstance(obj, type):
+        return wrap_function(obj, path)
+    if hasattr(obj, '__file__'):
+        return ProfiledModule(obj, path)
+    return obj
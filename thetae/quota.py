@@ -0,0 +1,184 @@
+#
+# Copyright (c) 2019 Jonathan Weyn <jweyn@uw.edu>
+#
+# See the file LICENSE for your rights.
+#
+
+"""
+Rate limits and daily quotas for API-backed data sources.
+
+Limits are declared for each model in the 'Models' section of the config with the parameters 'calls_per_minute' and
+'calls_per_day'. Models using the same driver share the same API (and hence the same limits) unless a different
+'api_name' parameter is given. Drivers call api_call() immediately before each request to the API. The per-minute limit
+is enforced with a token bucket, which blocks until a call is allowed. The daily limit is enforced with a ledger of
+calls made for each API on the current UTC day, which is saved in THETAE_ROOT/archive so that repeated runs of the
+engine share it. The ledger is updated under a lock on a lock file, so that processes running at the same time do not
+lose each other's calls. When the daily quota is used up, api_call() raises a QuotaExceededError, which getForecasts
+treats as a deferred forecast rather than a failure.
+"""
+
+import os
+import json
+import time
+import threading
+from datetime import datetime
+from contextlib import contextmanager
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+class QuotaExceededError(Exception):
+    pass
+
+
+class TokenBucket(object):
+    """
+    Token bucket allowing 'rate' calls per minute, with bursts of up to 'capacity' calls.
+    """
+
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate) / 60.
+        self.capacity = float(capacity or max(1., float(rate)))
+        self.tokens = self.capacity
+        self.last_time = time.time()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Take a token from the bucket, waiting until one is available.
+        """
+        while True:
+            with self.lock:
+                time_now = time.time()
+                self.tokens = min(self.capacity, self.tokens + (time_now - self.last_time) * self.rate)
+                self.last_time = time_now
+                if self.tokens >= 1.:
+                    self.tokens -= 1.
+                    return
+                wait = (1. - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+_lock = threading.Lock()
+_buckets = {}
+
+
+# ==================================================================================================================== #
+# Limits and the ledger
+# ==================================================================================================================== #
+
+def get_api_name(config, model):
+    """
+    Return the name of the API used by model. Defaults to the model's driver.
+    """
+    model_config = config['Models'][model]
+    return model_config.get('api_name', model_config.get('driver', model))
+
+
+def get_limits(config, api_name):
+    """
+    Return the (calls_per_minute, calls_per_day) limits for an API, taking the smallest of the limits declared by all
+    models which use it. Either value is None if there is no limit.
+    """
+    per_minute = None
+    per_day = None
+    for model in config['Models'].keys():
+        if get_api_name(config, model) != api_name:
+            continue
+        try:
+            value = int(config['Models'][model]['calls_per_minute'])
+            per_minute = value if per_minute is None else min(per_minute, value)
+        except (KeyError, ValueError):
+            pass
+        try:
+            value = int(config['Models'][model]['calls_per_day'])
+            per_day = value if per_day is None else min(per_day, value)
+        except (KeyError, ValueError):
+            pass
+    return per_minute, per_day
+
+
+def _ledger_file(config):
+    return '%s/archive/api_ledger.json' % config['THETAE_ROOT']
+
+
+def _read_ledger(config):
+    """
+    Read the ledger of API calls, dropping any entries which are not from the current UTC day.
+    """
+    today = datetime.utcnow().strftime('%Y-%m-%d')
+    try:
+        with open(_ledger_file(config), 'r') as f:
+            ledger = json.load(f)
+    except (IOError, OSError, ValueError):
+        ledger = {}
+    return {api: entry for api, entry in ledger.items() if entry.get('date') == today}
+
+
+def _write_ledger(config, ledger):
+    ledger_file = _ledger_file(config)
+    ledger_dir = os.path.dirname(ledger_file)
+    if not (os.path.isdir(ledger_dir)):
+        os.makedirs(ledger_dir)
+    temp_file = '%s.%d.tmp' % (ledger_file, os.getpid())
+    with open(temp_file, 'w') as f:
+        json.dump(ledger, f)
+    os.rename(temp_file, ledger_file)
+
+
+@contextmanager
+def _ledger_lock(config):
+    """
+    Hold the ledger lock, both against other threads and, with an exclusive lock on a lock file, other processes (for
+    example, historical workers, or a daemon and a manual run), so that no process overwrites another's calls.
+    """
+    with _lock:
+        if fcntl is None:
+            yield
+            return
+        lock_file = _ledger_file(config) + '.lock'
+        lock_dir = os.path.dirname(lock_file)
+        if not (os.path.isdir(lock_dir)):
+            os.makedirs(lock_dir)
+        with open(lock_file, 'a') as f:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+def api_call(config, model):
+    """
+    Register a call to the API used by model. Waits as necessary to satisfy the per-minute limit and raises a
+    QuotaExceededError if the daily quota has been used.
+
+    :param config:
+    :param model: str: model name in config
+    :return:
+    """
+    api_name = get_api_name(config, model)
+    per_minute, per_day = get_limits(config, api_name)
+    if per_minute is None and per_day is None:
+        return
+
+    # Check and update the ledger first so that we never wait for a call we cannot make
+    if per_day is not None:
+        with _ledger_lock(config):
+            ledger = _read_ledger(config)
+            entry = ledger.setdefault(api_name, {'date': datetime.utcnow().strftime('%Y-%m-%d'), 'calls': 0})
+            if entry['calls'] >= per_day:
+                raise QuotaExceededError('daily quota of %d calls used for %s' % (per_day, api_name))
+            entry['calls'] += 1
+            _write_ledger(config, ledger)
+        if config['debug'] > 9:
+            print('quota: call %d of %d today for %s' % (entry['calls'], per_day, api_name))
+
+    if per_minute is not None:
+        with _lock:
+            if api_name not in _buckets:
+                _buckets[api_name] = TokenBucket(per_minute)
+            bucket = _buckets[api_name]
+        bucket.acquire()
@@ -0,0 +1,115 @@
+#
+# Copyright (c) 2019 Jonathan Weyn <jweyn@uw.edu>
+#
+# See the file LICENSE for your rights.
+#
+
+"""
+Registry of the services, drivers, and schemas named in the config.
+
+At startup, the engine calls validate(), which resolves every service, model driver, verification driver, and database
+schema once with util.get_object (which caches them), checks that each has the entry points it needs, and records what
+each supports:
+
+    main: the function called by the main engine process
+    historical: retrieval of historical data
+    station_main: running separately for each station (services; see thetae.graph)
+    prefetch: retrieval of data for many stations at once (drivers), called by getForecasts before the forecasts for
+        each station are retrieved
+
+Problems are printed as warnings, so that one broken driver does not stop the others; with the config traceback option,
+an exception is raised instead.
+"""
+
+from thetae.util import get_object, to_bool
+from builtins import str
+
+capability_names = ['main', 'historical', 'station_main', 'prefetch']
+
+_capabilities = {}
+
+
+def capabilities(path):
+    """
+    Return a dictionary of the capabilities of the object at path, resolving it if necessary.
+    """
+    if path not in _capabilities:
+        obj = get_object(path)
+        _capabilities[path] = dict([(name, callable(getattr(obj, name, None))) for name in capability_names])
+    return _capabilities[path]
+
+
+def supports(path, capability):
+    """
+    Return True if the object at path has the capability, e.g., 'prefetch'.
+    """
+    return capabilities(path)[capability]
+
+
+def _check(config, problems, kind, name, path, required):
+    try:
+        caps = capabilities(path)
+    except BaseException as e:
+        problems.append("%s %s: cannot load '%s' (%s)" % (kind, name, path, str(e)))
+        return
+    for capability in required:
+        if not caps[capability]:
+            problems.append("%s %s: '%s' has no '%s' function" % (kind, name, path, capability))
+    if config['debug'] > 9:
+        print('registry: %s %s (%s): %s' % (kind, name, path,
+                                            ', '.join([c for c in capability_names if caps[c]]) or 'nothing'))
+
+
+def validate(config):
+    """
+    Resolve and check all the services, drivers, and schemas in the config. Returns a list of problems found.
+    """
+    problems = []
+
+    # Services
+    for service_group in config['Engine']['Services'].keys():
+        services = config['Engine']['Services'][service_group]
+        if not isinstance(services, list):
+            services = [services]
+        for service in services:
+            if service:
+                _check(config, problems, 'service', service_group, service, ['main'])
+
+    # Model drivers
+    for model in config['Models'].keys():
+        try:
+            driver = config['Models'][model]['driver']
+        except KeyError:
+            problems.append('model %s: no driver specified' % model)
+            continue
+        required = ['main']
+        try:
+            if to_bool(config['Models'][model]['historical']):
+                required.append('historical')
+        except KeyError:
+            pass
+        _check(config, problems, 'model', model, driver, required)
+
+    # Verification drivers
+    for data_type, required in [('Verification', ['main', 'historical']), ('Obs', ['main', 'historical']),
+                                ('Climo', ['historical'])]:
+        try:
+            driver = config['Verify'][data_type]['driver']
+        except KeyError:
+            problems.append('verify %s: no driver specified' % data_type)
+            continue
+        _check(config, problems, 'verify', data_type, driver, required)
+
+    # Schemas
+    for data_binding in config['DataBinding'].keys():
+        try:
+            schema_name = config['DataBinding'][data_binding]['schema']
+            get_object(schema_name).schema
+        except BaseException as e:
+            problems.append("data binding %s: cannot load schema (%s)" % (data_binding, str(e)))
+
+    for problem in problems:
+        print('registry warning: %s' % problem)
+    if len(problems) > 0 and config['traceback']:
+        raise ValueError('registry: %d problems found in config; see warnings above' % len(problems))
+    return problems
@@ -0,0 +1,148 @@
+#
+# Copyright (c) 2019 Jonathan Weyn <jweyn@uw.edu>
+#
+# See the file LICENSE for your rights.
+#
+
+"""
+Scheduler for running the theta-e engine as a daemon.
+
+The schedule is read from the 'Schedule' subsection of the config Engine section. Each entry is a job, which runs a list
+of services or service groups. A job runs either every 'interval' minutes, at the UTC 'hours' (at 'minute' past the
+hour), or 'after' any of a list of other jobs completes. Timed jobs also run once when the daemon starts. For example:
+
+    [[Schedule]]
+        [[[obs]]]
+            services = thetae.getVerification,
+            interval = 60
+        [[[forecasts]]]
+            services = thetae.getForecasts,
+            hours = 3, 9, 15, 21
+            minute = 30
+        [[[output]]]
+            services = calc_services, output_services
+            after = obs, forecasts
+
+Without a schedule, all service groups run every hour.
+"""
+
+from datetime import datetime, timedelta
+
+
+class Job(object):
+    """
+    A scheduled list of services.
+    """
+
+    def __init__(self, name, services, interval=None, hours=None, minute=0, after=None):
+        self.name = name
+        self.services = services
+        self.interval = interval
+        self.hours = hours
+        self.minute = minute
+        self.after = after or []
+        self.last_run = None
+
+    def next_run(self):
+        """
+        Return the next time at which the job should run, or None if it only runs after other jobs.
+        """
+        if self.interval is None and self.hours is None:
+            return None
+        if self.last_run is None:
+            return datetime.utcnow()
+        if self.interval is not None:
+            return self.last_run + timedelta(minutes=self.interval)
+        # Find the next scheduled hour after the last run
+        date = self.last_run.replace(minute=self.minute, second=0, microsecond=0)
+        while date <= self.last_run or date.hour not in self.hours:
+            date += timedelta(hours=1)
+        return date
+
+
+class Scheduler(object):
+    """
+    Keeps track of when each job in the config schedule should run.
+    """
+
+    def __init__(self, config):
+        self.jobs = []
+        try:
+            schedule = config['Engine']['Schedule']
+        except KeyError:
+            schedule = {}
+        if len(schedule) == 0:
+            self.jobs.append(Job('all', list(config['Engine']['Services'].keys()), interval=60.))
+        for name in schedule.keys():
+            options = schedule[name]
+            services = options.get('services', [])
+            if not isinstance(services, list):
+                services = [services]
+            interval = options.get('interval', None)
+            hours = options.get('hours', None)
+            if hours is not None:
+                if not isinstance(hours, list):
+                    hours = [hours]
+                try:
+                    hours = [int(h) for h in hours if str(h).strip() != '']
+                except ValueError:
+                    raise ValueError("scheduler: job '%s' has invalid 'hours' %s" % (name, hours))
+                if len(hours) == 0 or any([h < 0 or h > 23 for h in hours]):
+                    raise ValueError("scheduler: job '%s' must have 'hours' between 0 and 23" % name)
+            after = options.get('after', None)
+            if after is not None and not isinstance(after, list):
+                after = [after]
+            if interval is None and hours is None and after is None:
+                raise ValueError("scheduler: job '%s' must have one of 'interval', 'hours', or 'after'" % name)
+            if interval is not None and float(interval) <= 0:
+                raise ValueError("scheduler: job '%s' must have a positive 'interval'" % name)
+            minute = int(options.get('minute', 0))
+            if minute < 0 or minute > 59:
+                raise ValueError("scheduler: job '%s' must have 'minute' between 0 and 59" % name)
+            self.jobs.append(Job(name, services, interval=None if interval is None else float(interval), hours=hours,
+                                 minute=minute, after=after))
+        names = [job.name for job in self.jobs]
+        for job in self.jobs:
+            for name in job.after:
+                if name not in names:
+                    raise ValueError("scheduler: job '%s' runs after unknown job '%s'" % (job.name, name))
+        self.check_cycles()
+
+    def check_cycles(self):
+        """
+        Raise a ValueError if the 'after' dependencies of the jobs are circular, since the jobs would run each other
+        forever.
+        """
+        done = set()
+        remaining = list(self.jobs)
+        while len(remaining) > 0:
+            ready = [job for job in remaining if set(job.after) <= done]
+            if len(ready) == 0:
+                raise ValueError("scheduler: circular 'after' dependencies between jobs %s" %
+                                 ', '.join(sorted([job.name for job in remaining])))
+            for job in ready:
+                done.add(job.name)
+                remaining.remove(job)
+
+    def next_time(self):
+        """
+        Return the earliest time at which any timed job should run.
+        """
+        times = [job.next_run() for job in self.jobs if job.next_run() is not None]
+        if len(times) == 0:
+            return None
+        return min(times)
+
+    def due(self):
+        """
+        Return the list of jobs which should run now.
+        """
+        time_now = datetime.utcnow()
+        return [job for job in self.jobs if job.next_run() is not None and job.next_run() <= time_now]
+
+    def completed(self, job):
+        """
+        Record that a job has run, and return the jobs which run after it.
+        """
+        job.last_run = datetime.utcnow()
+        return [j for j in self.jobs if job.name in j.after]
@@ -19,6 +19,10 @@ schema keys, e.g., KSEA_OBS. The tables represent:
     VERIF: individual days' verified high, low, wind, and rain
     DAILY_FORECAST: model forecasts of next day's high, low, wind, and rain
     CLIMO: climatological yearly norms, populated once
+
+A schema may also define secondary indexes for its tables in the 'indexes'
+dictionary, with each table's value a list of tuples of column names. These
+are created by db.init, including on existing databases.
 """
 
 schema = {
@@ -72,3 +76,13 @@ schema = {
         ('rain', 'REAL')
     ]
 }
+
+indexes = {
+    # Readers of forecasts select one model over a range of dates
+    'HOURLY_FORECAST': [
+        ('Model', 'DateTime')
+    ],
+    'DAILY_FORECAST': [
+        ('Model', 'DateTime')
+    ]
+}
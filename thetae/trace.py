@@ -0,0 +1,128 @@
+#
+# Copyright (c) 2019 Jonathan Weyn <jweyn@uw.edu>
+#
+# See the file LICENSE for your rights.
+#
+
+"""
+Timeline traces of theta-e runs in the Chrome trace-event format.
+
+Tracing is off by default, and is turned on with the --trace option of the theta-e script or the config Engine option
+'trace'. While it is on, a span is recorded for every section of code measured by thetae.metrics (each service and
+station, driver call, HTTP request, and database operation), every database transaction, and every subprocess, along
+with the process and thread in which it ran. At the end of each engine run, the spans are written to
+THETAE_ROOT/archive/traces/theta-e-trace-<time>.json, which can be opened in chrome://tracing or Perfetto
+(https://ui.perfetto.dev). When tracing is off, span() does nothing.
+"""
+
+import os
+import json
+import time
+import threading
+from datetime import datetime
+from contextlib import contextmanager
+from thetae.util import to_bool
+
+_enabled = [False]
+_lock = threading.Lock()
+_events = []
+_thread_names = {}
+
+
+def init(config, enabled=False):
+    """
+    Turn tracing on if enabled (e.g., from the command line) or the config Engine option 'trace' is set, and clear any
+    recorded spans.
+    """
+    if not enabled:
+        try:
+            enabled = to_bool(config['Engine']['trace'])
+        except KeyError:
+            enabled = False
+    _enabled[0] = enabled
+    with _lock:
+        del _events[:]
+        _thread_names.clear()
+    if enabled and config['debug'] > 0:
+        print('trace: recording a trace of this run')
+
+
+def enabled():
+    return _enabled[0]
+
+
+@contextmanager
+def span(name, category, **args):
+    """
+    Context manager which records a span covering the code inside it, if tracing is on.
+
+    :param name: str: name of the span
+    :param category: str: category, e.g., 'service' or 'http'
+    :param args: optional values shown with the span
+    """
+    if not _enabled[0]:
+        yield
+        return
+    start = time.time()
+    try:
+        yield
+    finally:
+        end = time.time()
+        thread = threading.current_thread()
+        event = {
+            'name': name,
+            'cat': category,
+            'ph': 'X',
+            'ts': int(start * 1e6),
+            'dur': int((end - start) * 1e6),
+            'pid': os.getpid(),
+            'tid': thread.ident,
+        }
+        if len(args) > 0:
+            event['args'] = dict((k, str(v)) for k, v in args.items() if v is not None)
+        with _lock:
+            _events.append(event)
+            _thread_names[(event['pid'], event['tid'])] = thread.name
+
+
+def pop_events():
+    """
+    Return and clear the spans recorded so far, along with the names of their threads, e.g., to send them from a worker
+    process to the main process.
+    """
+    with _lock:
+        events = list(_events)
+        thread_names = list(_thread_names.items())
+        del _events[:]
+        _thread_names.clear()
+    return events, thread_names
+
+
+def add_events(events, thread_names):
+    """
+    Add spans recorded elsewhere, as returned by pop_events.
+    """
+    with _lock:
+        _events.extend(events)
+        _thread_names.update(dict(thread_names))
+
+
+def write(config):
+    """
+    Write the spans recorded since the last write to a trace file, if tracing is on.
+    """
+    if not _enabled[0]:
+        return
+    events, thread_names = pop_events()
+    thread_names = dict(thread_names)
+    events.sort(key=lambda e: e['ts'])
+    for (pid, tid), thread_name in thread_names.items():
+        events.append({'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': tid, 'args': {'name': thread_name}})
+
+    trace_dir = '%s/archive/traces' % config['THETAE_ROOT']
+    if not (os.path.isdir(trace_dir)):
+        os.makedirs(trace_dir)
+    trace_file = '%s/theta-e-trace-%s.json' % (trace_dir, datetime.utcnow().strftime('%Y%m%d%H%M%S'))
+    with open(trace_file, 'w') as f:
+        json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
+    print('trace: wrote %s' % trace_file)
@@ -5,16 +5,15 @@
 #
 
 """
-Utility functions and classes for theta-e.
+Utility functions for theta-e. The data classes and the functions which need numpy, pandas, or pytz are in thetae.data.
 """
 
 from datetime import datetime, timedelta
 import thetae
-import pytz
 import os
-import numpy as np
-import pandas as pd
+import importlib
 from builtins import str
+from thetae import profiling
 try:
     from urllib.request import urlopen
 except ImportError:
@@ -25,87 +24,48 @@ except ImportError:
 # Classes
 # ==================================================================================================================== #
 
-class TimeSeries(object):
-    """
-    TimeSeries object, which is really just a wrapper for a pandas DataFrame.
-    """
-
-    def __init__(self, stid):
-        self.stid = stid
-        self.model = None
-        self.data = pd.DataFrame()
-
-
-class Daily(object):
-    """
-    Daily object, which contains high, low, wind, and rain for a specific date.
-    """
-
-    def __init__(self, stid, date):
-        self.stid = stid
-        self.date = date
-        self.model = None
-        self.high = None
-        self.low = None
-        self.wind = None
-        self.rain = None
-
-    def set_values(self, high, low, wind, rain):
-        self.high = to_float(high)
-        self.low = to_float(low)
-        self.wind = to_float(wind)
-        self.rain = to_float(rain)
-
-    def get_values(self):
-        return self.high, self.low, self.wind, self.rain
-
-
-class Forecast(object):
-    """
-    Forecast object for a single date. Contains both a timeseries and daily objects.
-    stid and model should be type str; date should be datetime object.
-    """
-
-    def __init__(self, stid, model, date):
-        self.stid = stid
-        self.model = model
-        self.date = date
-        self.timeseries = TimeSeries(stid)
-        self.timeseries.model = model
-        self.daily = Daily(stid, date)
-        self.daily.model = model
+class IncompatibleVersionError(Exception):
+    pass
 
-    def set_model(self, model):
-        """
-        Changes the model name in the Forecast object and in the embedded TimeSeries and Daily.
-        """
-        self.model = model
-        self.timeseries.model = model
-        self.daily.model = model
-        return self
 
-    def set_stid(self, stid):
-        """
-        Changes the station ID name in the Forecast object and in the embedded TimeSeries and Daily.
-        """
-        self.stid = stid
-        self.timeseries.stid = stid
-        self.daily.stid = stid
-        return self
+# Names which moved to thetae.data; they are still found here on first access (PEP 562), for existing drivers
+_data_names = ['TimeSeries', 'Daily', 'Forecast', 'write_codes', 'get_codes', 'write_ensemble_daily',
+               'read_ensemble_daily', 'localized_date_to_utc', 'epoch_time_to_datetime', 'dates_to_utc',
+               'wind_uv_to_speed_dir', 'dewpoint_from_t_rh']
 
 
-class IncompatibleVersionError(Exception):
-    pass
+def __getattr__(name):
+    if name in _data_names:
+        return getattr(importlib.import_module('thetae.data'), name)
+    raise AttributeError("module '%s' has no attribute '%s'" % (__name__, name))
 
 
 # ==================================================================================================================== #
 # General utility functions
 # ==================================================================================================================== #
 
+# Objects already found by get_object, by path
+_objects = {}
+
+
 def get_object(module_class):
     """
     Given a string with a module class name, it imports and returns the class.
     This function (c) Tom Keffer, weeWX; modified by Jonathan Weyn.
+    Each object is only imported once; later calls return it from a cache. If the object is selected for profiling
+    (see thetae.profiling), a profiled version of it is returned.
+    """
+    try:
+        mod = _objects[module_class]
+    except KeyError:
+        mod = _import_object(module_class)
+        _objects[module_class] = mod
+    return profiling.wrap(mod, module_class)
+
+
+def _import_object(module_class):
+    """
+    Import and return the object at the path module_class.
     """
     # Split the path into its parts
     parts = module_class.split('.')
@@ -183,123 +143,6 @@ def get_config(config_path):
     return config_dict
 
 
-def write_codes(config, codes_dict, codes_file, header='station ID,'):
-    """
-    Write a codes dictionary to a file of comma-separated values with one header row, given by 'header'. For use when a
-    data source can provide a needed code but a cache is useful. The dictionary is expected to have station IDs as keys
-    and either strings or tuples of strings as items, just like the output of get_codes().
-
-    :param config:
-    :param codes_dict: dict: dictionary of codes to write, where keys are station IDs
-    :param codes_file: str: CSV file name (located within THETAE_ROOT/codes)
-    :param header: str: the descriptive header row
-    :return:
-    """
-    codes_directory = '%s/codes' % config['THETAE_ROOT']
-    if not(os.path.isdir(codes_directory)):
-        os.makedirs(codes_directory)
-    codes_file_name = '%s/%s' % (codes_directory, codes_file)
-    num_keys = len(list(codes_dict.keys()))
-    if type(codes_dict[list(codes_dict.keys())[0]]) is tuple:
-        num_codes = len(codes_dict[list(codes_dict.keys())[0]])
-    else:
-        num_codes = 1
-    codes_array = np.empty((num_keys, num_codes + 1), dtype=object)
-    row = 0
-    for key, code in codes_dict.items():
-        codes_array[row, 0] = key
-        codes_array[row, 1:] = code
-        row += 1
-    np.savetxt(codes_file_name, codes_array, fmt='%s', delimiter=',', header=header)
-
-
-def get_codes(config, codes_file, stid=None):
-    """
-    Return a dict-format index of codes in codes_file for data sources where necessary. The file is expected to be
-    comma-separated values with one header row. If more than one code (i.e. column) per site is given, then the value
-    of the exported dictionary is a tuple of all the codes. Codes values are returned as string types. If stid is
-    provided, then only the codes for that station ID are returned; otherwise, the entire dictionary is returned.
-
-    :param config:
-    :param codes_file: str: CSV file name (located within THETAE_ROOT/codes)
-    :param stid: str: if given, only returns the codes for a specific stid
-    :return: codes_dict or codes: dictionary of codes, or code values for a station ID
-    """
-    codes_file_name = '%s/codes/%s' % (config['THETAE_ROOT'], codes_file)
-    codes_array = np.genfromtxt(codes_file_name, dtype='str', delimiter=',', skip_header=1)
-    if len(codes_array.shape) == 1:
-        codes_array = np.expand_dims(codes_array, axis=0)
-    num_sites, num_codes = codes_array.shape
-    num_codes -= 1  # remove the column for stid
-    codes_dict = {}
-    for s in range(num_sites):
-        site = codes_array[s, 0].upper()
-        if num_codes == 1:
-            codes_dict[site] = codes_array[s, 1]
-        else:
-            codes_dict[site] = tuple(codes_array[s, 1:])
-    if stid is not None:
-        return codes_dict[stid]
-    else:
-        return codes_dict
-
-
-def write_ensemble_daily(config, forecasts, ensemble_file):
-    """
-    Writes ensemble daily forecast data, provided in the form of a list of Forecast or Daily objects, for tomorrow's
-    forecast. The specific file should be provided in the 'Models' section of config. The function read_ensemble_daily
-    can be used to read the file generated from this function, e.g. to generate plots.
-
-    :param config:
-    :param forecasts: list: list of Forecast objects
-    :param ensemble_file: str: CSV file name (located within THETAE_ROOT/site_data)
-    :return:
-    """
-    ensemble_file_name = '%s/site_data/%s' % (config['THETAE_ROOT'], ensemble_file)
-    header = 'date,model,high,low,wind,rain'
-    num_forecasts = len(forecasts)
-    daily_array = np.empty((num_forecasts, 6), dtype=object)
-    for f in range(num_forecasts):
-        daily_array[f, 0] = date_to_string(forecasts[f].date)
-        daily_array[f, 1] = forecasts[f].model
-        try:
-            daily_array[f, 2:] = forecasts[f].daily.get_values()
-        except AttributeError:
-            daily_array[f, 2:] = forecasts[f].get_values()
-    np.savetxt(ensemble_file_name, daily_array, fmt='%s', delimiter=',', header=header)
-
-
-def read_ensemble_daily(config, ensemble_file, stid=None, forecast_date=None):
-    """
-    Generates a list of Daily objects from a specified file (as generated by write_ensemble_daily).
-
-    :param config:
-    :param ensemble_file: str: CSV file name (located within THETAE_ROOT/site_data)
-    :param stid: str: station ID
-    :return: list: list of Daily objects
-    """
-    ensemble_file_name = '%s/site_data/%s' % (config['THETAE_ROOT'], ensemble_file)
-    daily_array = np.genfromtxt(ensemble_file_name, dtype='str', delimiter=',', skip_header=1)
-    ensemble_date = date_to_datetime(daily_array[0][0])
-    dailys = []
-    if stid is None:
-        stid = config['current_stid']
-    if forecast_date is None:
-        forecast_date = ensemble_date
-    else:
-        # Raise an error if the requested forecast date is not the one in the file
-        if date_to_datetime(forecast_date) != ensemble_date:
-            raise ValueError('Requested forecast date does not match that in file (%s)' % ensemble_date)
-        
-    for day in range(daily_array.shape[0]):
-        daily = Daily(stid, forecast_date)
-        daily.model = daily_array[day, 0]
-        daily.set_values(*tuple(daily_array[day, 2:]))
-        dailys.append(daily)
-
-    return dailys
-
-
 def get_ghcn_stid(config, stid):
     """
     After code by Luke Madaus.
@@ -421,27 +264,27 @@ def meso_api_dates(start_date, end_date):
     return start, end
 
 
-def localized_date_to_utc(date):
-    """
-    Return a timezone-unaware UTC time from a timezone-aware localized datetime object.
+def find_gaps(dates, existing, step, join=0):
     """
-    if not isinstance(date, datetime):
-        return date
-    return date.astimezone(pytz.utc).replace(tzinfo=None)
-
+    Return a list of (start, end) tuples of the ranges of dates which are not in existing. dates must be sorted and
+    evenly spaced by step. Ranges separated by no more than join existing dates are combined into one.
 
-def epoch_time_to_datetime(timestamp, timezone=None):
+    :param dates: list of datetimes: requested dates
+    :param existing: set or list of datetimes which are already available
+    :param step: timedelta: spacing of dates
+    :param join: int: maximum number of existing dates between ranges which are combined
+    :return: list of (start, end) datetime tuples, inclusive
     """
-    Return a timezone-unaware datetime from an epoch time representation. If timezone string is provided, then
-    converts a localized epoch time.
-    """
-    if timezone is None:
-        return datetime.utcfromtimestamp(timestamp)
-    else:
-        date = datetime.fromtimestamp(timestamp)
-        tz = pytz.timezone(timezone)
-        date = tz.localize(date)
-        return localized_date_to_utc(date)
+    existing = set(existing)
+    gaps = []
+    for date in dates:
+        if date in existing:
+            continue
+        if len(gaps) > 0 and date - gaps[-1][1] <= step * (join + 1):
+            gaps[-1][1] = date
+        else:
+            gaps.append([date, date])
+    return [tuple(gap) for gap in gaps]
 
 
 def last_leap_year(date=None):
@@ -581,34 +424,3 @@ def wind_dir_to_deg(val):
     dir_deg = [22.5 * x for x in range(len(dir_text))]
     conversion = dict(zip(dir_text, dir_deg))
     return conversion[val]
-
-
-def wind_uv_to_speed_dir(uval, vval):
-    """
-    Converts U and V component of wind to a speed and direction
-    """
-    vel_val = np.sqrt(uval**2 + vval**2)
-    wdir = 180/np.pi * np.arctan2(uval, vval)
-    wdir += 180
-    if wdir < 0:
-        wdir += 360
-    return vel_val, wdir
-
-
-def dewpoint_from_t_rh(t, rh, is_f=False):
-    """
-    Calculate dewpoint from temperature relative humidity in %.
-
-    :param t: temperature in C
-    :param rh: relative humidity in %
-    :param is_f: if True, temperature is in Fahrenheit, otherwise, Celsius
-    :return: dewpoint: dewpoint in specified temperature units
-    """
-    if is_f:
-        t = f_to_c(t)
-    dewpoint = (243.04 * (np.log(rh/100.) + ((17.625 * t) / (243.04 + t))) /
-                (17.625 - np.log(rh/100.) - ((17.625 * t) / (243.04 + t))))
-    if is_f:
-        return c_to_f(dewpoint)
-    else:
-        return dewpoint
@@ -19,15 +19,9 @@
 #                                                                                                                      #
 # ==================================================================================================================== #
 
-try:
-    import urllib.parse
-    import urllib.request
-    import urllib.error
-except ImportError:
-    import urllib2
-    import urllib
-
 import json
+import requests
+from thetae import http
 
 
 # ==================================================================================================================== #
@@ -148,19 +142,12 @@ class Meso(object):
 
         json_error = 'Could not retrieve JSON values. Try again with a shorter date range.'
 
-        # For python 3.4
+        # Use the shared theta-e HTTP session
         try:
-            qsp = urllib.parse.urlencode(request_dict, doseq=True)
-            resp = urllib.request.urlopen(self.base_url + endpoint + '?' + qsp).read()
-
-        # For python 2.7
-        except AttributeError or NameError:
-            try:
-                qsp = urllib.urlencode(request_dict, doseq=True)
-                resp = urllib2.urlopen(self.base_url + endpoint + '?' + qsp).read()
-            except urllib2.URLError:
-                raise MesoPyError(http_error)
-        except urllib.error.URLError:
+            response = http.get(self.base_url + endpoint, params=request_dict)
+            response.raise_for_status()
+            resp = response.content
+        except requests.exceptions.RequestException:
             raise MesoPyError(http_error)
 
         try:
@@ -10,7 +10,8 @@ Retrieve climatology data from ulmo's ghcn_daily
 
 import ulmo
 import numpy as np
-from thetae.util import get_ghcn_stid, Daily
+from thetae.util import get_ghcn_stid
+from thetae.data import Daily
 from datetime import datetime, timedelta
 from builtins import str
 
@@ -11,7 +11,8 @@ Retrieve observations from MesoWest.
 from .MesoPy import Meso
 import pandas as pd
 import numpy as np
-from thetae.util import meso_api_dates, date_to_string, TimeSeries
+from thetae.util import meso_api_dates, date_to_string
+from thetae.data import TimeSeries
 from datetime import datetime, timedelta
 
 
@@ -173,12 +174,14 @@ def main(config, stid):
     return timeseries
 
 
-def historical(config, stid, start_date):
+def historical(config, stid, start_date, end_date=None):
     """
-    Retrieves observations at site stid starting at start_date.
+    Retrieves observations at site stid starting at start_date and ending at end_date, or the current time if end_date
+    is None.
     """
 
-    end_date = datetime.utcnow()
+    if end_date is None:
+        end_date = datetime.utcnow()
     start, end = meso_api_dates(start_date, end_date)
 
     timeseries = get_obs(config, stid, start, end)
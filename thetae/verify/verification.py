@@ -13,12 +13,17 @@ import pandas as pd
 import numpy as np
 import os
 import re
-from thetae.util import meso_api_dates, Daily
+from thetae.util import meso_api_dates
+from thetae.data import Daily
 from datetime import datetime, timedelta
-import requests
+from thetae import http
 from builtins import str
 
 
+# Stations for which historical CF6 files were retrieved during this run
+_cf6_historical_stations = set()
+
+
 def get_cf6_files(config, stid, num_files=1):
     """
     After code by Luke Madaus
@@ -53,7 +58,7 @@ def get_cf6_files(config, stid, num_files=1):
         nws_site = '&'.join((nws_url, version))
         if config['debug'] > 50:
             print('get_cf6_files: fetching from %s' % nws_site)
-        response = requests.get(nws_site)
+        response = http.get(nws_site)
         cf6_data = response.text
 
         # Remove the header
@@ -430,19 +435,22 @@ def main(config, stid):
     return dailys
 
 
-def historical(config, stid, start_date):
+def historical(config, stid, start_date, end_date=None):
     """
-    Retrieves historical verifications starting at start (datetime). Sets the hour of start to 6, so that we don't get
-    incomplete verifications.
+    Retrieves historical verifications starting at start (datetime) and ending at end_date, or the current time if
+    end_date is None. Sets the hour of start to 6, so that we don't get incomplete verifications.
     """
 
     # Get dates
     start_date = start_date.replace(hour=6)
-    end_date = datetime.utcnow()
+    if end_date is None:
+        end_date = datetime.utcnow()
     start, end = meso_api_dates(start_date, end_date)
 
-    # Download CF6 files
-    get_cf6_files(config, stid, 12)
+    # Download CF6 files, only once per station if this is called for several ranges of dates
+    if stid not in _cf6_historical_stations:
+        get_cf6_files(config, stid, 12)
+        _cf6_historical_stations.add(stid)
 
     # Get the daily verification
     dailys = get_verification(config, stid, start, end, use_climo=True)
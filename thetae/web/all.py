@@ -13,6 +13,24 @@ from datetime import datetime, timedelta
 from thetae.util import get_object, config_date_to_datetime, to_bool
 from builtins import str
 
+# Data used and written by this service, for the engine's service graph (see thetae.graph)
+requires = ['forecast', 'obs', 'verif', 'climo', 'stats']
+provides = ['web']
+
+
+def get_stations(config):
+    """
+    Return the stations for which to produce output: all stations if the config option 'output_all_stations' is set,
+    otherwise only the current station.
+    """
+    try:
+        plot_all_stations = to_bool(config['Web']['Options']['output_all_stations'])
+    except:
+        plot_all_stations = False
+    if plot_all_stations:
+        return list(config['Stations'].keys())
+    return [config['current_stid']]
+
 
 def main(config):
     """
@@ -31,15 +49,7 @@ def main(config):
     except KeyError:
         print("web.all warning: no output specified by key 'outputs' in config!")
         return
-    # If a config option is given to do outputs for all stations, do so
-    try:
-        plot_all_stations = to_bool(config['Web']['Options']['output_all_stations'])
-    except:
-        plot_all_stations = False
-    if plot_all_stations:
-        stations = config['Stations'].keys()
-    else:
-        stations = [config['current_stid']]
+    stations = get_stations(config)
 
     # Do the outputs
     for output_type in output_types:
@@ -58,6 +68,32 @@ def main(config):
                 continue
 
 
+def station_main(config, stid):
+    """
+    Produce all outputs specified in config for a single station, if it is one of the stations selected by
+    get_stations. Used by the engine to run the service separately for each station.
+    """
+    if stid not in get_stations(config):
+        return
+    time_now = datetime.utcnow()
+    forecast_date = (datetime(time_now.year, time_now.month, time_now.day) + timedelta(days=1))
+    try:
+        output_types = list(config['Web']['outputs'])
+    except KeyError:
+        print("web.all warning: no output specified by key 'outputs' in config!")
+        return
+    for output_type in output_types:
+        if config['debug'] > 9:
+            print("web.all: producing '%s' output for station %s" % (output_type, stid))
+        try:
+            get_object('thetae.web.%s' % output_type).main(config, stid, forecast_date)
+        except BaseException as e:
+            print('web.all: failed to output %s for %s' % (output_type, stid))
+            print("*** Reason: '%s'" % str(e))
+            if config['traceback']:
+                raise
+
+
 def historical(config, stid):
     """
     Function to produce historical web output, for a specific site. Iterates over web functions specified in config
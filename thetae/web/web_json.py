@@ -14,8 +14,8 @@ import os
 import pandas as pd
 import numpy as np
 from collections import OrderedDict
-from thetae.util import Daily, Forecast, last_leap_year
-from thetae.db import readForecast, readTimeSeries, readDaily
+from thetae.util import date_to_string
+from thetae.db import readTimeSeries, readDaily, readDailyForecasts, readHourlyForecasts, readClimo
 
 
 def json_daily(config, stid, models, forecast_date, start_date=None):
@@ -28,37 +28,44 @@ def json_daily(config, stid, models, forecast_date, start_date=None):
         dates = [forecast_date]
     else:
         dates = pd.date_range(start_date, forecast_date, freq='D').to_pydatetime()
+    if config['debug'] > 9:
+        print('web.json: retrieving daily data at %s' % stid)
+    forecasts = readDailyForecasts(config, stid, models, dates[0], dates[-1])
+    # Eliminate 'NaN'
+    forecasts = forecasts.astype(object).where(pd.notnull(forecasts), None)
+    date_strings = [date_to_string(d) for d in dates]
     for model in models:
-        if config['debug'] > 9:
-            print('web.json: retrieving daily data for %s at %s' % (model, stid))
-        forecasts = []
-        for date in dates:
-            try:
-                forecasts.append(readForecast(config, stid, model, date, no_hourly_ok=True))
-            except (ValueError, IndexError):
-                forecasts.append(Forecast(stid, model, date))
-        daily[model] = {v.upper(): [getattr(forecasts[f].daily, v) for f in range(len(forecasts))] for v in variables}
+        model_forecasts = forecasts[forecasts['MODEL'] == model].set_index('DATETIME')
+        daily[model] = OrderedDict()
+        for v in variables:
+            values = model_forecasts[v.upper()].to_dict()
+            daily[model][v.upper()] = [values.get(d, None) for d in date_strings]
         daily[model]['DATETIME'] = [d.isoformat() + 'Z' for d in dates]
 
     return daily
 
 
-def json_hourly(config, stid, models, forecast_date):
+def json_hourly(config, stid, models, forecast_date, hour_start=6, hour_padding=18):
     """
     Produce a json file for hourly forecast values at a station from the given models, and save it to file.
     """
     hourly = OrderedDict()
+    if config['debug'] > 9:
+        print('web.json: retrieving hourly data at %s' % stid)
+    # Only models with a daily forecast for this date are included
+    daily_models = set(readDailyForecasts(config, stid, models, forecast_date, forecast_date)['MODEL'])
+    start_date = forecast_date + timedelta(hours=hour_start - hour_padding)
+    end_date = forecast_date + timedelta(hours=hour_start + 24 + hour_padding)
+    forecasts = readHourlyForecasts(config, stid, models, start_date, end_date)
+    # Eliminate 'NaN'
+    forecasts = forecasts.astype(object).where(pd.notnull(forecasts), None)
     for model in models:
-        if config['debug'] > 9:
-            print('web.json: retrieving hourly data for %s at %s' % (model, stid))
-        try:
-            forecast = readForecast(config, stid, model, forecast_date, hour_padding=18, no_hourly_ok=True)
-            # Eliminate 'NaN'
-            ts = forecast.timeseries.data.where(pd.notnull(forecast.timeseries.data), None)
-            ts['DATETIME'] = pd.to_datetime(ts['DATETIME']).dt.strftime('%Y-%m-%dT%H:%M:%SZ')
-            hourly[model] = ts.to_dict(orient='list', into=OrderedDict)
-        except (ValueError, KeyError):
+        ts = forecasts[forecasts['MODEL'] == model].drop('MODEL', axis=1)
+        if model not in daily_models or len(ts.index) == 0:
             hourly[model] = OrderedDict()
+            continue
+        ts['DATETIME'] = pd.to_datetime(ts['DATETIME']).dt.strftime('%Y-%m-%dT%H:%M:%SZ')
+        hourly[model] = ts.to_dict(orient='list', into=OrderedDict)
 
     return hourly
 
@@ -104,18 +111,7 @@ def json_climo(config, stid, start_date):
     variables = ['high', 'low', 'wind', 'rain']
     if config['debug'] > 9:
         print('web.json: retrieving climo for %s' % stid)
-    dailys = []
-    current_date = start_date
-    while current_date <= end_date:
-        climo_date = current_date.replace(year=last_leap_year())
-        try:
-            daily = readDaily(config, stid, 'forecast', 'climo', start_date=climo_date, end_date=climo_date)
-            daily.date = current_date
-        except ValueError:  # missing climo data
-            daily = Daily(stid, current_date)
-            daily.set_values(np.nan, np.nan, np.nan, np.nan)
-        dailys.append(daily)
-        current_date += timedelta(days=1)
+    dailys = readClimo(config, stid, start_date, end_date)
     for v in variables:
         climo[v.upper()] = [getattr(dailys[j], v) if not(np.isnan(getattr(dailys[j], v))) else None
                             for j in range(len(dailys))]